@@ -0,0 +1,75 @@
+"""
+Micro-benchmark da leitura do texto de CC_CS_JSON_* em registros.
+
+Compara o caminho antigo (colchetes + replace('}{', '},{') + json.loads, que
+corrompe campos texto com '}{') com util_iter_json, com e sem orjson, e com
+a leitura valor a valor por raw_decode, que util_iter_json usa quando há
+'}{' dentro de um campo texto. Os payloads são de estoque, gerados como no
+fake_servers, com --locais registros por código.
+
+Exemplo:
+    python -m benchmarks.bench_json --locais 10,200,2000 --repeticoes 200
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils  # noqa: E402
+from benchmarks.fake_servers import json_estoque  # noqa: E402
+
+
+def _caminho_antigo(raw: str) -> List[Dict[str, Any]]:
+    data = json.loads(f"[{raw}]".replace("}{", "},{"))
+    return [data] if isinstance(data, dict) else list(data)
+
+
+def _iter_json_sem_orjson(raw: str) -> List[Dict[str, Any]]:
+    orjson, utils.orjson = utils.orjson, None
+    try:
+        return list(utils.util_iter_json(raw))
+    finally:
+        utils.orjson = orjson
+
+
+CAMINHOS: Dict[str, Callable[[str], List[Dict[str, Any]]]] = {
+    "replace+json.loads": _caminho_antigo,
+    "util_iter_json": lambda raw: list(utils.util_iter_json(raw)),
+    "util_iter_json (sem orjson)": _iter_json_sem_orjson,
+    "raw_decode valor a valor": lambda raw: list(utils._iter_json_concatenado(raw)),
+}
+
+
+def medir(locais: int, repeticoes: int) -> Dict[str, float]:
+    """Microssegundos por payload de cada caminho (melhor de 3 rodadas)."""
+    raw = json_estoque(123, 1, locais)
+    esperado = _caminho_antigo(raw)
+    tempos = {}
+    for nome, fn in CAMINHOS.items():
+        assert fn(raw) == esperado, nome
+        melhor = min(timeit.repeat(lambda f=fn: f(raw), number=repeticoes, repeat=3))
+        tempos[nome] = 1e6 * melhor / repeticoes
+    return tempos
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Leitura de JSON concatenado: replace vs util_iter_json")
+    parser.add_argument("--locais", default="10,200,2000", help="registros de estoque por payload")
+    parser.add_argument("--repeticoes", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    for locais in (int(v) for v in args.locais.split(",") if v.strip()):
+        tamanho = len(json_estoque(123, 1, locais))
+        tempos = medir(locais, args.repeticoes)
+        base = tempos["replace+json.loads"]
+        print(f"{locais} registros ({tamanho / 1024:.0f} KB):")
+        for nome, us in tempos.items():
+            print(f"    {nome:<28} {us:>10.1f} µs  {base / us:>5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
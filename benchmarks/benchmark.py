@@ -0,0 +1,144 @@
+"""
+Benchmark de ponta a ponta contra os servidores locais de fake_servers.
+
+Para cada combinação de step/lote/workers, executa processar_parceiros e/ou
+processar_produtos em um processo novo (limitadores, sessões e token não
+vazam entre execuções), apontado para os servidores locais e com um
+ESTADO_DB temporário. Reporta registros/s, requisições por endpoint,
+latências p50/p99 vistas pelos servidores e o pico de RSS do processo.
+
+Exemplo:
+    python -m benchmarks.benchmark --parceiros 5000 --produtos 2000 \\
+        --step 100,500 --lote 50,200 --workers 10,35 --json resultado.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_servers import FakeConfig, FakeServers  # noqa: E402
+
+
+def _executar(entidade: str, step: int, lote: int, workers: int,
+              env: Dict[str, str], saida: "multiprocessing.Queue") -> None:
+    """Roda uma execução dentro do processo filho e devolve as métricas pela fila."""
+    os.environ.update(env)
+    from processamentos import processar_parceiros, processar_produtos
+
+    logging.getLogger().setLevel(logging.WARNING)
+    processar = processar_parceiros if entidade == "parceiros" else processar_produtos
+    inicio = time.perf_counter()
+    resumo = processar(step, lote, workers, forcar=True)
+    duracao = time.perf_counter() - inicio
+    saida.put({
+        "duracao_s": round(duracao, 3),
+        "registros": resumo.get("registros", 0),
+        "lotes_com_falha": resumo.get("lotes_com_falha", 0),
+        # ru_maxrss vem em KiB no Linux
+        "pico_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+
+
+def executar_configuracao(fake: FakeServers, entidade: str, step: int, lote: int,
+                          workers: int) -> Dict[str, Any]:
+    """Executa uma combinação em processo separado e junta as métricas dos servidores."""
+    fake.stats.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **fake.env(),
+            "ESTADO_DB": os.path.join(tmp, "estado.db"),
+            "METRICAS_DIR": os.path.join(tmp, "metricas"),
+            "SNK_TOKEN_ARQUIVO": os.path.join(tmp, "token.json"),
+            "SNK_TIMEOUTS": os.getenv("SNK_TIMEOUTS", "10,10,10"),
+            "CS_TIMEOUT": os.getenv("CS_TIMEOUT", "10"),
+        }
+        ctx = multiprocessing.get_context("spawn")
+        fila = ctx.Queue()
+        proc = ctx.Process(target=_executar, args=(entidade, step, lote, workers, env, fila))
+        proc.start()
+        metricas = fila.get()
+        proc.join()
+
+    metricas["registros_por_s"] = round(metricas["registros"] / metricas["duracao_s"], 1) \
+        if metricas["duracao_s"] else 0.0
+    return {
+        "entidade": entidade,
+        "step": step,
+        "lote": lote,
+        "workers": workers,
+        **metricas,
+        "endpoints": fake.stats.resumo(),
+    }
+
+
+def _imprimir(resultado: Dict[str, Any]) -> None:
+    print(
+        f"{resultado['entidade']:<9} step={resultado['step']:<5} lote={resultado['lote']:<5} "
+        f"workers={resultado['workers']:<4} | {resultado['registros']:>7} registros em "
+        f"{resultado['duracao_s']:>7.2f}s = {resultado['registros_por_s']:>8.1f}/s | "
+        f"RSS {resultado['pico_rss_mb']:.0f} MB | falhas {resultado['lotes_com_falha']}"
+    )
+    for nome, e in sorted(resultado["endpoints"].items()):
+        print(
+            f"    {nome:<16} {e['requisicoes']:>6} req  {e['erros']:>4} erros  "
+            f"p50 {e['p50_ms']:>7.1f}ms  p99 {e['p99_ms']:>7.1f}ms"
+        )
+
+
+def _lista_int(texto: str) -> List[int]:
+    return [int(v) for v in texto.split(",") if v.strip()]
+
+
+def main(argv=None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Benchmark de throughput contra servidores locais")
+    parser.add_argument("--entidades", default="parceiros,produtos")
+    parser.add_argument("--step", type=_lista_int, default=[500])
+    parser.add_argument("--lote", type=_lista_int, default=[100])
+    parser.add_argument("--workers", type=_lista_int, default=[10])
+    parser.add_argument("--parceiros", type=int, default=2000, help="tamanho da base de parceiros")
+    parser.add_argument("--produtos", type=int, default=1000, help="tamanho da base de produtos")
+    parser.add_argument("--locais", type=int, default=3, help="registros de estoque por produto")
+    parser.add_argument("--latencia-sankhya", type=float, default=0.01)
+    parser.add_argument("--latencia-cs", type=float, default=0.02)
+    parser.add_argument("--erro-sankhya", type=float, default=0.0, help="taxa de HTTP 500 (0..1)")
+    parser.add_argument("--erro-cs", type=float, default=0.0, help="taxa de HTTP 500 (0..1)")
+    parser.add_argument("--timeout", type=float, default=0.0, help="taxa de respostas que travam")
+    parser.add_argument("--json", help="grava os resultados neste arquivo")
+    args = parser.parse_args(argv)
+
+    config = FakeConfig(
+        n_parceiros=args.parceiros,
+        n_produtos=args.produtos,
+        locais_por_produto=args.locais,
+        latencia_sankhya=args.latencia_sankhya,
+        latencia_cs=args.latencia_cs,
+        taxa_erro_sankhya=args.erro_sankhya,
+        taxa_erro_cs=args.erro_cs,
+        taxa_timeout=args.timeout,
+    )
+
+    resultados = []
+    with FakeServers(config) as fake:
+        matriz = itertools.product(args.entidades.split(","), args.step, args.lote, args.workers)
+        for entidade, step, lote, workers in matriz:
+            resultado = executar_configuracao(fake, entidade, step, lote, workers)
+            _imprimir(resultado)
+            resultados.append(resultado)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    return resultados
+
+
+if __name__ == "__main__":
+    main()
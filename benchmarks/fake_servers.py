@@ -0,0 +1,394 @@
+"""
+Servidores locais que imitam o Sankhya e a API CS, para testes e benchmarks.
+
+- Sankhya: POST /login e GET /gateway/v1/mge/service.sbr (DbExplorerSP.executeQuery),
+  entendendo as consultas que o projeto gera (páginas keyset/OFFSET, COUNT, MIN/MAX,
+  CC_CS_JSON_* por código e em lote, GETDATE).
+- CS: POST /CS_IntegracaoV1/{Cliente,ProdutoUpdate,Saldos_Atualiza}, com ou
+  sem Content-Encoding: gzip.
+
+Latência, taxas de erro/timeout, validade dos tokens (HTTP 401 depois de
+token_ttl segundos) e tamanho da base são configuráveis em FakeConfig; FakeStats conta requisições, erros, registros e latências por
+endpoint.
+
+Uso:
+    with FakeServers(FakeConfig(n_parceiros=1000)) as fake:
+        os.environ.update(fake.env())
+        ...
+"""
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class FakeConfig:
+    """
+    Parâmetros da simulação (segundos para latências, 0..1 para taxas).
+
+    Recusas da CS pelo código do registro (CODPARC/CODPROD):
+    - codigos_recusados: o item volta com Sucesso=false no retorno por item;
+    - codigos_transitorios: idem, com erro de timeout, só na primeira vez;
+    - codigos_opacos: o lote inteiro volta HTTP 400, sem detalhe por item.
+
+    endpoints_sem_gzip (ex.: "ProdutoUpdate") respondem HTTP 415 a corpo gzip.
+    """
+
+    def __init__(
+        self,
+        n_parceiros: int = 1000,
+        n_produtos: int = 1000,
+        locais_por_produto: int = 3,
+        latencia_sankhya: float = 0.01,
+        latencia_por_codigo: float = 0.0005,
+        latencia_cs: float = 0.02,
+        latencia_por_registro_cs: float = 0.0001,
+        taxa_erro_sankhya: float = 0.0,
+        taxa_erro_cs: float = 0.0,
+        taxa_timeout: float = 0.0,
+        timeout_segundos: float = 5.0,
+        token_ttl: Optional[float] = None,
+        versao: int = 1,
+        seed: Optional[int] = None,
+        codigos_recusados: Iterable[int] = (),
+        codigos_transitorios: Iterable[int] = (),
+        codigos_opacos: Iterable[int] = (),
+        endpoints_sem_gzip: Iterable[str] = ()
+    ):
+        self.n_parceiros = n_parceiros
+        self.n_produtos = n_produtos
+        self.locais_por_produto = locais_por_produto
+        self.latencia_sankhya = latencia_sankhya
+        self.latencia_por_codigo = latencia_por_codigo
+        self.latencia_cs = latencia_cs
+        self.latencia_por_registro_cs = latencia_por_registro_cs
+        self.taxa_erro_sankhya = taxa_erro_sankhya
+        self.taxa_erro_cs = taxa_erro_cs
+        self.taxa_timeout = taxa_timeout
+        self.timeout_segundos = timeout_segundos
+        self.token_ttl = token_ttl
+        self.versao = versao
+        self.random = random.Random(seed)
+        self.codigos_recusados = set(codigos_recusados)
+        self.codigos_transitorios = set(codigos_transitorios)
+        self.codigos_opacos = set(codigos_opacos)
+        self.endpoints_sem_gzip = set(endpoints_sem_gzip)
+
+
+class FakeStats:
+    """Contadores thread-safe por endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.endpoints: Dict[str, Dict[str, Any]] = {}
+
+    def registrar(self, endpoint: str, latencia: float, erro: bool = False,
+                  registros: int = 0, bytes_corpo: int = 0, gzip: bool = False) -> None:
+        with self._lock:
+            e = self.endpoints.setdefault(endpoint, {
+                "requisicoes": 0, "erros": 0, "registros": 0, "bytes": 0, "gzip": 0, "latencias": []
+            })
+            e["requisicoes"] += 1
+            e["erros"] += int(erro)
+            e["registros"] += registros
+            e["bytes"] += bytes_corpo
+            e["gzip"] += int(gzip)
+            e["latencias"].append(latencia)
+
+    def resumo(self) -> Dict[str, Dict[str, Any]]:
+        """Contagens e p50/p99 de latência (ms) por endpoint."""
+        with self._lock:
+            saida = {}
+            for nome, e in self.endpoints.items():
+                lat = sorted(e["latencias"])
+                saida[nome] = {
+                    "requisicoes": e["requisicoes"],
+                    "erros": e["erros"],
+                    "registros": e["registros"],
+                    "bytes": e["bytes"],
+                    "gzip": e["gzip"],
+                    "p50_ms": round(1000 * lat[len(lat) // 2], 1) if lat else 0.0,
+                    "p99_ms": round(1000 * lat[min(len(lat) - 1, int(len(lat) * 0.99))], 1) if lat else 0.0,
+                }
+            return saida
+
+
+# Geração determinística dos documentos CC_CS_JSON_*
+
+def json_parceiro(codigo: int, versao: int) -> str:
+    return json.dumps([{
+        "CODPARC": codigo,
+        "NOMEPARC": f"PARCEIRO {codigo}",
+        "CGC_CPF": f"{codigo:011d}",
+        "VERSAO": versao,
+    }])
+
+
+def json_produto(codigo: int, versao: int) -> str:
+    return json.dumps({
+        "CODPROD": codigo,
+        "DESCRPROD": f"PRODUTO {codigo}",
+        "REFERENCIA": f"REF-{codigo:06d}",
+        "VERSAO": versao,
+    })
+
+
+def json_estoque(codigo: int, versao: int, locais: int) -> str:
+    # Objetos concatenados, como a função do Sankhya devolve
+    return "".join(
+        json.dumps({
+            "CODPROD": codigo,
+            "CODLOCAL": local,
+            "CONTROLE": "",
+            "ESTOQUE": (codigo * 7 + local * 3 + versao) % 500,
+        })
+        for local in range(1, locais + 1)
+    )
+
+
+_RE_JSON_FN = re.compile(r"CC_CS_JSON_(\w+)\(")
+_RE_IN = re.compile(r"\bIN\s*\(([^)]*)\)", re.IGNORECASE)
+_RE_JSON_UNICO = re.compile(r"CC_CS_JSON_(\w+)\(\s*'?(\d+)'?\s*\)")
+_RE_TOP = re.compile(r"SELECT\s+TOP\s+(\d+)", re.IGNORECASE)
+_RE_COMPARA = re.compile(r"K\.\w+\s*(>=|>|<=|<)\s*'?(\d+)'?")
+_RE_MODULO = re.compile(r"K\.\w+\s*%\s*(\d+)\s*=\s*(\d+)")
+_RE_OFFSET = re.compile(r"OFFSET\s+(\d+)\s+ROWS\s+FETCH\s+NEXT\s+(\d+)", re.IGNORECASE)
+
+
+class FakeSankhya:
+    """Interpreta as consultas DbExplorer geradas pelo projeto sobre a base simulada."""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+
+    def _documento(self, funcao: str, codigo: int) -> Optional[str]:
+        cfg = self.config
+        if funcao == "PARCEIRO":
+            return json_parceiro(codigo, cfg.versao) if 1 <= codigo <= cfg.n_parceiros else None
+        if not 1 <= codigo <= cfg.n_produtos:
+            return None
+        if funcao == "PRODUTO":
+            return json_produto(codigo, cfg.versao)
+        if funcao == "ESTOQUE":
+            return json_estoque(codigo, cfg.versao, cfg.locais_por_produto)
+        return None
+
+    def _chaves(self, sql: str) -> List[int]:
+        total = self.config.n_parceiros if "CODPARC" in sql else self.config.n_produtos
+        return list(range(1, total + 1))
+
+    def executar(self, sql: str) -> List[list]:
+        sql_upper = sql.upper()
+
+        if "GETDATE(), 126" in sql_upper:
+            return [[datetime.now().isoformat(timespec="milliseconds")]]
+
+        funcoes = _RE_JSON_FN.findall(sql)
+        if funcoes and (m_in := _RE_IN.search(sql)):
+            linhas = []
+            for item in m_in.group(1).split(","):
+                codigo = int(item.strip().strip("'"))
+                docs = [self._documento(f, codigo) for f in funcoes]
+                # Código existente com uma das funções sem retorno: coluna NULL
+                if any(d is not None for d in docs):
+                    linhas.append([codigo, *docs])
+            return linhas
+        if m := _RE_JSON_UNICO.search(sql):
+            return [[self._documento(m.group(1), int(m.group(2)))]]
+
+        chaves = self._chaves(sql)
+        if "COUNT(" in sql_upper:
+            return [[len(chaves)]]
+        if "MIN(" in sql_upper and "MAX(" in sql_upper:
+            return [[min(chaves), max(chaves)]] if chaves else [[None, None]]
+
+        if m := _RE_TOP.search(sql):
+            for op, valor in _RE_COMPARA.findall(sql):
+                v = int(valor)
+                chaves = [c for c in chaves if {
+                    ">": c > v, ">=": c >= v, "<": c < v, "<=": c <= v
+                }[op]]
+            for n, resto in _RE_MODULO.findall(sql):
+                chaves = [c for c in chaves if c % int(n) == int(resto)]
+            return [[c] for c in chaves[:int(m.group(1))]]
+
+        if m := _RE_OFFSET.search(sql):
+            inicio, n = int(m.group(1)), int(m.group(2))
+            return [[c] for c in chaves[inicio:inicio + n]]
+
+        return [[c] for c in chaves]
+
+
+def _handler(nome: str, fake: "FakeServers"):
+    cfg, stats = fake.config, fake.stats
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # silencia o log padrão do http.server
+            pass
+
+        def _corpo(self) -> bytes:
+            corpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.headers.get("Content-Encoding") == "gzip":
+                corpo = gzip.decompress(corpo)
+            return corpo
+
+        def _responder(self, status: int, dados: Any) -> None:
+            saida = json.dumps(dados).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(saida)))
+            self.end_headers()
+            self.wfile.write(saida)
+
+        def _simular_falha(self, taxa_erro: float) -> Optional[int]:
+            sorteio = cfg.random.random()
+            if sorteio < cfg.taxa_timeout:
+                time.sleep(cfg.timeout_segundos)
+            elif sorteio < cfg.taxa_timeout + taxa_erro:
+                return 500
+            return None
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            inicio = time.perf_counter()
+            path = self.path.split("?")[0]
+
+            if nome == "sankhya" and path.endswith("/login"):
+                self._corpo()
+                self._responder(200, {"bearerToken": fake.emitir_token()})
+                stats.registrar("login", time.perf_counter() - inicio)
+                return
+
+            endpoint = path.rsplit("/", 1)[-1]
+            comprimido = self.headers.get("Content-Encoding") == "gzip"
+            if comprimido and endpoint in cfg.endpoints_sem_gzip:
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._responder(415, {"erro": "Content-Encoding não suportado"})
+                stats.registrar(endpoint, time.perf_counter() - inicio, erro=True, gzip=True)
+                return
+            corpo = self._corpo()
+            registros = json.loads(corpo) if corpo else []
+            time.sleep(cfg.latencia_cs + cfg.latencia_por_registro_cs * len(registros))
+            status = self._simular_falha(cfg.taxa_erro_cs)
+            aceitos = 0
+            if status:
+                self._responder(status, {"erro": "falha simulada"})
+            else:
+                status, resposta, aceitos = fake.responder_cs(registros)
+                self._responder(status, resposta)
+            stats.registrar(
+                endpoint, time.perf_counter() - inicio, erro=status != 200,
+                registros=aceitos,
+                bytes_corpo=int(self.headers.get("Content-Length") or 0),
+                gzip=comprimido
+            )
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            inicio = time.perf_counter()
+            corpo = json.loads(self._corpo() or b"{}")
+            token = (self.headers.get("Authorization") or "").replace("Bearer ", "")
+            if not fake.token_valido(token):
+                self._responder(401, {"erro": "token inválido ou expirado"})
+                stats.registrar("executeQuery", time.perf_counter() - inicio, erro=True)
+                return
+            sql = corpo.get("requestBody", {}).get("sql", "")
+            linhas = fake.sankhya.executar(sql)
+            por_codigo = len(linhas) if "CC_CS_JSON_" in sql else 0
+            time.sleep(cfg.latencia_sankhya + cfg.latencia_por_codigo * por_codigo)
+            status = self._simular_falha(cfg.taxa_erro_sankhya)
+            if status:
+                self._responder(status, {"erro": "falha simulada"})
+            else:
+                self._responder(200, {"responseBody": {"rows": linhas}})
+            stats.registrar("executeQuery", time.perf_counter() - inicio, erro=bool(status))
+
+    return Handler
+
+
+class FakeServers:
+    """Sobe os servidores Sankhya e CS em portas locais livres."""
+
+    def __init__(self, config: Optional[FakeConfig] = None):
+        self.config = config or FakeConfig()
+        self.stats = FakeStats()
+        self.sankhya = FakeSankhya(self.config)
+        self._servidores: Dict[str, ThreadingHTTPServer] = {}
+        self._tokens: Dict[str, float] = {}
+        self._tokens_lock = threading.Lock()
+        self._recusas_lock = threading.Lock()
+        self._transitorios_vistos: set = set()
+
+    def responder_cs(self, registros: List[Dict[str, Any]]) -> Tuple[int, Any, int]:
+        """(status, resposta, registros aceitos) de um POST à CS, segundo as recusas configuradas."""
+        cfg = self.config
+        codigos = [r.get("CODPARC", r.get("CODPROD")) if isinstance(r, dict) else None for r in registros]
+        if any(c in cfg.codigos_opacos for c in codigos):
+            return 400, {"Sucesso": False, "Mensagem": "Erro ao processar o lote"}, 0
+
+        itens = []
+        with self._recusas_lock:
+            for codigo in codigos:
+                if codigo in cfg.codigos_recusados:
+                    itens.append({"Sucesso": False, "Mensagem": f"Registro {codigo} inválido"})
+                elif codigo in cfg.codigos_transitorios and codigo not in self._transitorios_vistos:
+                    self._transitorios_vistos.add(codigo)
+                    itens.append({"Sucesso": False, "Mensagem": "Timeout ao gravar o registro"})
+                else:
+                    itens.append({"Sucesso": True})
+        aceitos = sum(1 for i in itens if i["Sucesso"])
+        if aceitos == len(itens):
+            return 200, {"Sucesso": True, "Quantidade": aceitos}, aceitos
+        return 200, {"Sucesso": False, "Quantidade": aceitos, "Itens": itens}, aceitos
+
+    def emitir_token(self) -> str:
+        with self._tokens_lock:
+            token = f"fake-token-{len(self._tokens) + 1}"
+            self._tokens[token] = time.monotonic()
+            return token
+
+    def token_valido(self, token: str) -> bool:
+        with self._tokens_lock:
+            emitido = self._tokens.get(token)
+        if emitido is None:
+            return False
+        return self.config.token_ttl is None or time.monotonic() - emitido < self.config.token_ttl
+
+    def start(self) -> "FakeServers":
+        for nome in ("sankhya", "cs"):
+            srv = ThreadingHTTPServer(("127.0.0.1", 0), _handler(nome, self))
+            srv.daemon_threads = True
+            threading.Thread(target=srv.serve_forever, name=f"fake-{nome}", daemon=True).start()
+            self._servidores[nome] = srv
+        return self
+
+    def stop(self) -> None:
+        for srv in self._servidores.values():
+            srv.shutdown()
+            srv.server_close()
+        self._servidores.clear()
+
+    def url(self, nome: str) -> str:
+        return f"http://127.0.0.1:{self._servidores[nome].server_port}"
+
+    def env(self) -> Dict[str, str]:
+        """Variáveis de ambiente que apontam o projeto para os servidores locais."""
+        return {
+            "SANKHYA_BASE_URL": self.url("sankhya"),
+            "CS_BASE_URL": f"{self.url('cs')}/CS_IntegracaoV1",
+        }
+
+    def __enter__(self) -> "FakeServers":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,143 @@
+"""
+Checkpoint de execuções paginadas por keyset, usado pelo pipeline.
+
+O pipeline avisa quando lista uma página e quando cada (tipo, código)
+termina: confirmado pela CS, descartado pelos filtros ou com falha. Uma
+página está concluída quando todos os seus códigos terminaram sem falha, ou
+com falhas já guardadas na fila de retentativas (que as reenvia por conta
+própria); a chave do checkpoint avança até a última página de um prefixo
+contínuo de páginas concluídas (elas terminam fora de ordem).
+
+Na retomada (--resume), a listagem recomeça depois dessa chave e os códigos
+já confirmados nas páginas seguintes são pulados, por tipo, mesmo que a
+chave nunca tenha avançado.
+"""
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from estado import CheckpointStore
+
+
+def chave_execucao(tipos: List[str], query_base: str, chave: str, filtro: Optional[str] = None) -> str:
+    """Identifica a execução pelos tipos e pela consulta paginada."""
+    assinatura = hashlib.sha1(f"{query_base}|{chave}|{filtro or ''}".encode("utf-8")).hexdigest()[:12]
+    return f"{'/'.join(tipos)}:{assinatura}"
+
+
+class Checkpoint:
+    """Acompanha páginas e códigos de uma execução e grava o progresso em CheckpointStore."""
+
+    def __init__(self, store: CheckpointStore, execucao: str, retomar: bool = False):
+        self.store = store
+        self.execucao = execucao
+        self._lock = threading.Lock()
+        self.ultima_chave: Optional[str] = None
+        self._paginas_base = 0
+        self._confirmados: Dict[str, Set[str]] = {}
+
+        if not retomar:
+            store.limpar(execucao)
+        else:
+            # Na retomada nada é apagado: os códigos confirmados valem mesmo
+            # sem a linha do checkpoint (nenhuma página chegou a ser concluída)
+            salvo = store.carregar(execucao)
+            if salvo is not None:
+                self.ultima_chave = salvo["ultima_chave"]
+                self._paginas_base = salvo["paginas"]
+            tipos = execucao.split(":", 1)[0].split("/")
+            self._confirmados = {t: set(store.confirmados(execucao, t)) for t in tipos}
+            ja = sum(len(c) for c in self._confirmados.values())
+            if salvo is None and not ja:
+                logging.info(f"⏩ Nenhum checkpoint de '{execucao}' para retomar; começando do início")
+            else:
+                logging.info(
+                    f"⏩ Retomando '{execucao}' depois da chave {self.ultima_chave} "
+                    f"({self._paginas_base} páginas concluídas, {ja} códigos já confirmados)"
+                    + (f", checkpoint de {salvo['atualizado_em']}" if salvo else "")
+                )
+
+        # Estado da execução atual
+        self._pendentes: Dict[int, Set[Tuple[str, str]]] = {}
+        self._falhas: Set[int] = set()
+        self._ultima: Dict[int, Any] = {}
+        self._codigos: Dict[int, Dict[str, List[Any]]] = {}
+        self._pagina_de: Dict[Tuple[str, str], int] = {}
+        self._concluidas: Set[int] = set()
+        self._proxima = 0
+
+    def pendentes(self, tipo: str, codigos: List[Any]) -> List[Any]:
+        """Códigos da página que ainda não foram confirmados para o tipo."""
+        ja = self._confirmados.get(tipo)
+        if not ja:
+            return codigos
+        return [c for c in codigos if str(c) not in ja]
+
+    def pagina_listada(self, idx: int, pagina: List[Any], enfileirados: Dict[str, List[Any]]) -> None:
+        with self._lock:
+            self._ultima[idx] = pagina[-1] if pagina else None
+            self._codigos[idx] = {t: pagina for t in enfileirados}
+            pendentes = {(t, str(c)) for t, cods in enfileirados.items() for c in cods}
+            for item in pendentes:
+                self._pagina_de[item] = idx
+            self._pendentes[idx] = pendentes
+            if not pendentes:
+                self._concluir(idx)
+
+    def concluidos(self, tipo: str, codigos: Iterable[Any]) -> None:
+        """Códigos confirmados pela CS ou que não precisavam ser enviados."""
+        codigos = list(codigos)
+        if not codigos:
+            return
+        self.store.confirmar_codigos(self.execucao, tipo, codigos)
+        with self._lock:
+            for codigo in codigos:
+                idx = self._pagina_de.pop((tipo, str(codigo)), None)
+                if idx is None:
+                    continue
+                self._pendentes[idx].discard((tipo, str(codigo)))
+                if not self._pendentes[idx] and idx not in self._falhas:
+                    self._concluir(idx)
+
+    def falharam(self, tipo: str, codigos: Iterable[Any], guardados: bool = False) -> None:
+        """
+        Códigos que não chegaram à CS. Com guardados=True eles já estão na fila
+        de retentativas, e a página pode ser concluída; senão, ela não conta
+        como concluída nesta execução.
+        """
+        with self._lock:
+            for codigo in codigos:
+                idx = self._pagina_de.pop((tipo, str(codigo)), None)
+                if idx is None:
+                    continue
+                self._pendentes[idx].discard((tipo, str(codigo)))
+                if not guardados:
+                    self._falhas.add(idx)
+                elif not self._pendentes[idx] and idx not in self._falhas:
+                    self._concluir(idx)
+
+    def _concluir(self, idx: int) -> None:
+        self._concluidas.add(idx)
+        avancou: Dict[str, List[Any]] = {}
+        ultima = None
+        while self._proxima in self._concluidas:
+            self._concluidas.discard(self._proxima)
+            for tipo, cods in self._codigos.pop(self._proxima, {}).items():
+                avancou.setdefault(tipo, []).extend(cods)
+            ultima = self._ultima.pop(self._proxima)
+            del self._pendentes[self._proxima]
+            self._proxima += 1
+        if ultima is not None:
+            self.ultima_chave = ultima
+            self.store.avancar(self.execucao, ultima, self._paginas_base + self._proxima, avancou)
+
+    def finalizar(self, interrompido: bool) -> None:
+        """Execução completa: descarta o checkpoint. Interrompida: mantém para --resume."""
+        if interrompido:
+            logging.warning(
+                f"💾 Checkpoint de '{self.execucao}' mantido na chave {self.ultima_chave}; "
+                f"use --resume para continuar"
+            )
+            return
+        self.store.limpar(self.execucao)
@@ -0,0 +1,101 @@
+"""
+Consultas incrementais de códigos alterados, montadas por partes.
+
+Cada consulta é um UNION de ramos, um por tabela de origem, e cada ramo
+declara a coluna que marca a alteração naquela tabela (PRO.DTALTER,
+CAB.DTALTER, DTALTER do log TSILGT...). O filtro da janela de tempo é
+aplicado dentro de cada ramo, e não só no último, para que o SQL Server
+use o índice de data de cada tabela em vez de varrer o histórico inteiro.
+"""
+from typing import Iterable, List, Optional
+
+
+class JanelaTempo:
+    """
+    Janela de alterações a enviar.
+    Com `ate` (horário do Sankhya): (desde - margem_segundos, ate], ou os
+    `minutos` anteriores a `ate` quando ainda não há watermark. Sem `ate`:
+    últimos `minutos` até GETDATE().
+    A margem sobrepõe a janela à anterior: linhas gravadas com DTALTER antigo
+    por transações que só confirmaram depois do watermark ainda entram (os
+    códigos repetidos são descartados pelo cache de payloads).
+    """
+
+    def __init__(
+        self,
+        minutos: int,
+        desde: Optional[str] = None,
+        ate: Optional[str] = None,
+        margem_segundos: int = 0
+    ):
+        self.minutos = minutos
+        self.desde = desde
+        self.ate = ate
+        self.margem_segundos = margem_segundos
+
+    def predicado(self, coluna: str) -> str:
+        if self.ate is None:
+            return f"{coluna} >= DATEADD(MINUTE, -{self.minutos}, GETDATE())"
+        if not self.desde:
+            inicio = f"DATEADD(MINUTE, -{self.minutos}, '{self.ate}')"
+        elif self.margem_segundos:
+            inicio = f"DATEADD(SECOND, -{self.margem_segundos}, '{self.desde}')"
+        else:
+            inicio = f"'{self.desde}'"
+        return f"{coluna} > {inicio} AND {coluna} <= '{self.ate}'"
+
+
+class Ramo:
+    """Um SELECT do UNION: colunas, FROM (com joins), condições fixas e a coluna de alteração."""
+
+    def __init__(self, select: str, origem: str, coluna_tempo: str, condicoes: Iterable[str] = ()):
+        self.select = select
+        self.origem = origem
+        self.coluna_tempo = coluna_tempo
+        self.condicoes = list(condicoes)
+
+    def sql(self, janela: Optional[JanelaTempo]) -> str:
+        condicoes = list(self.condicoes)
+        if janela is not None:
+            condicoes.append(janela.predicado(self.coluna_tempo))
+        where = f" WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        return f"SELECT {self.select} FROM {self.origem}{where}"
+
+
+class ConsultaIncremental:
+    """UNION dos ramos, cada um com a sua janela, ordenado pela chave."""
+
+    def __init__(self, ramos: List[Ramo], ordem: str):
+        self.ramos = ramos
+        self.ordem = ordem
+
+    def sql(self, janela: Optional[JanelaTempo] = None) -> str:
+        return " UNION ".join(r.sql(janela) for r in self.ramos) + f" ORDER BY {self.ordem}"
+
+
+# CODPROD extraído da chave do log de exclusões de estoque (TGFEXC)
+_CODPROD_TSILGT = (
+    "LTRIM(SUBSTRING(CHAVE, CHARINDEX('CODPROD=', CHAVE)+8,"
+    " CHARINDEX('CODLOCAL=', CHAVE)-(CHARINDEX('CODPROD=', CHAVE)+8))) AS CODPROD"
+)
+
+_RAMO_NOTAS = Ramo(
+    "ITE.CODPROD",
+    "TGFITE ITE INNER JOIN TGFCAB CAB ON ITE.NUNOTA = CAB.NUNOTA",
+    "CAB.DTALTER"
+)
+_RAMO_EXCLUSOES = Ramo(_CODPROD_TSILGT, "TSILGT", "DTALTER", ["NOMETAB = 'TGFEXC'"])
+
+CONSULTA_PARCEIROS = ConsultaIncremental(
+    [Ramo("CODPARC", "TGFPAR", "DTALTER")],
+    ordem="CODPARC"
+)
+
+# Cadastro, itens de notas alteradas e exclusões de estoque
+CONSULTA_PRODUTOS = ConsultaIncremental(
+    [Ramo("PRO.CODPROD", "TGFPRO PRO", "PRO.DTALTER"), _RAMO_NOTAS, _RAMO_EXCLUSOES],
+    ordem="CODPROD"
+)
+
+# Só movimentação de estoque: notas e exclusões
+CONSULTA_ESTOQUE = ConsultaIncremental([_RAMO_NOTAS, _RAMO_EXCLUSOES], ordem="CODPROD")
@@ -0,0 +1,237 @@
+"""
+Coordenador da carga completa em vários processos.
+
+Divide o intervalo de CODPARC/CODPROD em faixas de --faixa códigos e sobe
+--processos workers locais. Cada worker pega a próxima faixa livre da fila
+comum assim que termina a anterior, então um trecho lento da base não segura
+os demais: quem fica livre continua consumindo o que resta. No fim, os
+resumos de todas as faixas são somados em um resultado único.
+
+Com --resume, faixas concluídas antes de uma interrupção não são refeitas e
+cada faixa incompleta continua do seu próprio checkpoint.
+
+Para rodar em containers/máquinas separados sem coordenador, use
+`python geral.py --shard i/N` em cada um (bucket chave % N = i).
+
+Exemplo:
+    python coordenador.py --processos 4 --faixa 5000 --entidades produtos,parceiros
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from estado import CheckpointStore
+from utils import logging_config
+
+logging_config()
+
+# entidade -> (função de processamento em processamentos.py, chave)
+ENTIDADES = {
+    "produtos": ("processar_produtos", "CODPROD"),
+    "parceiros": ("processar_parceiros", "CODPARC"),
+}
+
+Faixa = Tuple[str, int, int]
+
+
+def gerar_faixas(entidade: str, minimo: Optional[int], maximo: Optional[int], tamanho: int) -> List[Faixa]:
+    """Faixas [inicio, fim) consecutivas de `tamanho` valores cobrindo minimo..maximo."""
+    if minimo is None or maximo is None:
+        return []
+    n = math.ceil((maximo - minimo + 1) / tamanho)
+    return [
+        (entidade, minimo + i * tamanho, min(minimo + (i + 1) * tamanho, maximo + 1))
+        for i in range(n)
+    ]
+
+
+def somar_resumos(resumos: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Junta os resumos das faixas: contadores são somados; interrompido e os
+    limites finais dos limitadores ficam com o maior valor visto. A duração
+    das faixas não é somada (o coordenador mede a duração total).
+    """
+    total: Dict[str, Any] = {}
+    for resumo in resumos:
+        for campo, valor in resumo.items():
+            if not isinstance(valor, (int, float)) or campo == "duracao_s":
+                continue
+            if campo == "interrompido" or campo.startswith("limite_"):
+                total[campo] = max(total.get(campo, 0), valor)
+            else:
+                total[campo] = total.get(campo, 0) + valor
+    return total
+
+
+def _worker(
+    idx: int,
+    tarefas: "multiprocessing.Queue",
+    resultados: "multiprocessing.Queue",
+    parametros: Dict[str, Any]
+) -> None:
+    """Consome faixas da fila até o sinal de fim (None) e devolve um resumo por faixa."""
+    os.environ.setdefault("METRICAS_INSTANCIA", f"w{idx}")
+    import processamentos  # pylint: disable=import-outside-toplevel
+
+    while True:
+        tarefa = tarefas.get()
+        if tarefa is None:
+            return
+        entidade, inicio, fim = tarefa
+        processar = getattr(processamentos, ENTIDADES[entidade][0])
+        try:
+            resumo = processar(faixa=(inicio, fim), **parametros)
+        except Exception as e:
+            logging.error(f"❌ Worker {idx}: falha em {entidade} [{inicio}, {fim}): {e}", exc_info=True)
+            resumo = {"faixas_com_erro": 1}
+        resultados.put((idx, tarefa, resumo))
+        if resumo.get("interrompido"):
+            # Ctrl+C/SIGTERM: para de pegar faixas novas
+            return
+
+
+def coordenar(
+    entidades: List[str],
+    processos: int,
+    tamanho_faixa: int,
+    step: int,
+    lote: int,
+    workers: int,
+    extract_workers: Optional[int] = None,
+    send_workers: Optional[int] = None,
+    forcar: bool = False,
+    retomar: bool = False
+) -> Dict[str, Any]:
+    """
+    Processa as entidades em `processos` workers locais com distribuição
+    dinâmica de faixas e retorna o resumo somado de todas elas.
+    workers/extract_workers/send_workers valem por processo.
+    retomar=True continua cada faixa do seu checkpoint.
+    """
+    from processamentos import (  # pylint: disable=import-outside-toplevel
+        QUERY_PARCEIROS_ATIVOS, QUERY_PRODUTOS_ATIVOS, intervalo_chaves,
+    )
+    queries = {"produtos": QUERY_PRODUTOS_ATIVOS, "parceiros": QUERY_PARCEIROS_ATIVOS}
+
+    # Faixas concluídas ficam registradas até a coordenação inteira terminar
+    store = CheckpointStore()
+    execucao = f"coordenador:{','.join(entidades)}:{tamanho_faixa}"
+    if not retomar:
+        store.limpar(execucao)
+    concluidas = {e: store.faixas_concluidas(execucao, e) for e in entidades}
+
+    start = time.perf_counter()
+    faixas: List[Faixa] = []
+    for entidade in entidades:
+        chave = ENTIDADES[entidade][1]
+        minimo, maximo = intervalo_chaves(queries[entidade], chave)
+        novas = gerar_faixas(entidade, minimo, maximo, tamanho_faixa)
+        pendentes = [f for f in novas if (f[1], f[2]) not in concluidas[entidade]]
+        logging.info(
+            f"🧩 {entidade}: {chave} de {minimo} a {maximo} em {len(novas)} faixas"
+            + (f", {len(novas) - len(pendentes)} já concluídas" if len(pendentes) < len(novas) else "")
+        )
+        faixas += pendentes
+
+    parametros = dict(
+        step=step,
+        lote=lote,
+        workers=workers,
+        extract_workers=extract_workers,
+        send_workers=send_workers,
+        forcar=forcar,
+        retomar=retomar
+    )
+
+    # spawn: os workers não herdam threads, sessões nem locks do coordenador
+    ctx = multiprocessing.get_context("spawn")
+    tarefas, resultados = ctx.Queue(), ctx.Queue()
+    for faixa in faixas:
+        tarefas.put(faixa)
+    processos = max(1, min(processos, len(faixas)))
+    for _ in range(processos):
+        tarefas.put(None)
+
+    procs = [
+        ctx.Process(target=_worker, args=(i, tarefas, resultados, parametros), name=f"worker-{i}")
+        for i in range(processos)
+    ]
+    for p in procs:
+        p.start()
+
+    resumos: List[Dict[str, Any]] = []
+    try:
+        while len(resumos) < len(faixas):
+            try:
+                idx, (entidade, inicio, fim), resumo = resultados.get(timeout=1)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs):
+                    break
+                continue
+            resumos.append(resumo)
+            if not (resumo.get("interrompido") or resumo.get("faixas_com_erro")):
+                store.concluir_faixa(execucao, entidade, inicio, fim)
+            logging.info(
+                f"✅ Faixa {len(resumos)}/{len(faixas)} ({entidade} [{inicio}, {fim})) "
+                f"pelo worker {idx}: {resumo.get('registros', 0)} registros"
+            )
+    except KeyboardInterrupt:
+        logging.warning("🛑 Coordenador interrompido: aguardando os workers drenarem...")
+    finally:
+        for p in procs:
+            p.join()
+
+    total = somar_resumos(resumos)
+    total["faixas"] = len(faixas)
+    total["faixas_concluidas"] = len(resumos)
+    if len(resumos) < len(faixas) or total.get("interrompido"):
+        total["interrompido"] = 1
+    else:
+        store.limpar(execucao)
+
+    elapsed = time.perf_counter() - start
+    total["duracao_s"] = round(elapsed, 3)
+    mins, secs = divmod(int(elapsed), 60)
+    logging.info(f"🏁 Coordenação concluída em {mins}m{secs:02d}s com {processos} processos: {total}")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga completa distribuída em vários processos")
+    parser.add_argument("--processos", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--faixa", type=int, default=5000, help="códigos por faixa de trabalho")
+    parser.add_argument("--entidades", default="produtos,parceiros")
+    parser.add_argument("--step", type=int, default=50)
+    parser.add_argument("--lote", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=10, help="por processo")
+    parser.add_argument("--extract-workers", type=int, default=None)
+    parser.add_argument("--send-workers", type=int, default=None)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="envia mesmo os registros cujo payload não mudou desde o último envio"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continua as faixas interrompidas a partir dos checkpoints"
+    )
+    args = parser.parse_args()
+
+    coordenar(
+        entidades=[e.strip() for e in args.entidades.split(",") if e.strip()],
+        processos=args.processos,
+        tamanho_faixa=args.faixa,
+        step=args.step,
+        lote=args.lote,
+        workers=args.workers,
+        extract_workers=args.extract_workers,
+        send_workers=args.send_workers,
+        forcar=args.force,
+        retomar=args.resume
+    )
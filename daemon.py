@@ -0,0 +1,300 @@
+"""
+Modo daemon: um processo de longa duração que agenda os envios incrementais.
+
+Em vez de um cron que sobe o interpretador a cada rodada, o daemon mantém
+aquecidos o token do Sankhya, o pool keep-alive da CS e os limitadores
+adaptativos, e roda parceiros, produtos e estoque em intervalos
+independentes:
+
+- cada tarefa roda em seu próprio thread; se ainda estiver rodando quando
+  vencer de novo, a rodada não se sobrepõe: fica marcada e roda uma única
+  vez assim que a anterior terminar;
+- o próximo horário leva um jitter de até DAEMON_JITTER x intervalo, para
+  as tarefas não baterem no Sankhya sempre no mesmo segundo;
+- o estoque tem orçamento próprio de requisições (limitadores 'sankhya:estoque'
+  e 'cs:estoque', com ESTOQUE_*_WORKERS como limite inicial), sem disputar
+  vagas com parceiros e produtos;
+- GET /health devolve o estado de cada tarefa (último início/fim, duração,
+  resultado, atraso) e responde 503 se alguma está atrasada há mais de
+  DAEMON_ATRASO_MAX intervalos; GET /metrics devolve as métricas Prometheus.
+
+SIGTERM/Ctrl+C param o agendamento e os pipelines das rodadas em andamento
+(pipeline.parar_pipelines): nenhuma página nova é listada, as filas são
+drenadas e o checkpoint fica gravado como interrompido, para o próximo
+--resume; o daemon sai quando as rodadas terminam.
+
+Exemplo:
+    python daemon.py --parceiros 900 --produtos 900 --estoque 120
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+from metricas import metricas
+from pipeline import parar_pipelines
+from telegram_notification import flush_notificacoes, notificar
+from utils import logging_config
+
+logging_config()
+
+DAEMON_PORTA = int(os.getenv("DAEMON_PORTA", os.getenv("PORT", "8080")))
+DAEMON_JITTER = float(os.getenv("DAEMON_JITTER", "0.1"))
+# Tarefa sem rodada concluída há mais que este número de intervalos = atrasada
+DAEMON_ATRASO_MAX = float(os.getenv("DAEMON_ATRASO_MAX", "3"))
+
+
+def _iso(instante: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(instante).isoformat(timespec="seconds") if instante else None
+
+
+class Tarefa:
+    """Uma execução periódica com proteção contra sobreposição."""
+
+    def __init__(self, nome: str, intervalo: float, executar: Callable[[], Dict[str, Any]], jitter: float = DAEMON_JITTER):
+        self.nome = nome
+        self.intervalo = intervalo
+        self.executar = executar
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.criada_em = time.time()
+        self.proxima_em = time.time() + random.uniform(0, jitter * intervalo)
+        self.pendente = False
+        self.execucoes = 0
+        self.falhas = 0
+        self.adiadas = 0
+        self.ultimo_inicio: Optional[float] = None
+        self.ultimo_fim: Optional[float] = None
+        self.ultimo_sucesso: Optional[float] = None
+        self.ultima_duracao: Optional[float] = None
+        self.ultimo_resumo: Optional[Dict[str, Any]] = None
+        self.ultimo_erro: Optional[str] = None
+
+    @property
+    def em_execucao(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _agendar(self, agora: float) -> None:
+        self.proxima_em = agora + self.intervalo + random.uniform(0, self.jitter * self.intervalo)
+
+    def verificar(self, agora: float) -> None:
+        """Dispara a tarefa se venceu; se a anterior ainda roda, marca para logo depois dela."""
+        with self._lock:
+            if agora < self.proxima_em and not (self.pendente and not self.em_execucao):
+                return
+            if self.em_execucao:
+                if not self.pendente:
+                    self.pendente = True
+                    self.adiadas += 1
+                    metricas.incr("daemon_rodadas_adiadas_total", tarefa=self.nome)
+                    logging.warning(f"⏳ '{self.nome}' ainda em execução: próxima rodada roda ao terminar")
+                self._agendar(agora)
+                return
+            self.pendente = False
+            self._agendar(agora)
+            self._thread = threading.Thread(target=self._rodar, name=f"daemon-{self.nome}", daemon=True)
+            self._thread.start()
+
+    def _rodar(self) -> None:
+        inicio = time.time()
+        self.ultimo_inicio = inicio
+        metricas.gauge("daemon_tarefa_em_execucao", 1, tarefa=self.nome)
+        try:
+            resumo = self.executar() or {}
+            erro = None
+        except Exception as e:
+            logging.error(f"❌ Falha na tarefa '{self.nome}': {e}", exc_info=True)
+            notificar(f"❌ Daemon: falha em '{self.nome}': {e}", agrupar=True)
+            resumo, erro = {}, str(e)
+        finally:
+            metricas.gauge("daemon_tarefa_em_execucao", -1, tarefa=self.nome)
+        fim = time.time()
+        with self._lock:
+            self.execucoes += 1
+            self.ultimo_fim = fim
+            self.ultima_duracao = round(fim - inicio, 3)
+            self.ultimo_resumo = resumo
+            self.ultimo_erro = erro
+            if erro is None:
+                self.ultimo_sucesso = fim
+            else:
+                self.falhas += 1
+        metricas.incr("daemon_rodadas_total", tarefa=self.nome, resultado="ok" if erro is None else "falha")
+        metricas.definir("daemon_ultima_rodada_timestamp", fim, tarefa=self.nome)
+
+    def aguardar(self, timeout: Optional[float] = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self, agora: float) -> Dict[str, Any]:
+        with self._lock:
+            referencia = self.ultimo_sucesso or self.criada_em
+            atraso = max(0.0, agora - referencia - self.intervalo)
+            return {
+                "intervalo_s": self.intervalo,
+                "em_execucao": self.em_execucao,
+                "pendente": self.pendente,
+                "execucoes": self.execucoes,
+                "falhas": self.falhas,
+                "adiadas": self.adiadas,
+                "ultimo_inicio": _iso(self.ultimo_inicio),
+                "ultimo_fim": _iso(self.ultimo_fim),
+                "ultimo_sucesso": _iso(self.ultimo_sucesso),
+                "ultima_duracao_s": self.ultima_duracao,
+                "ultimo_resumo": self.ultimo_resumo,
+                "ultimo_erro": self.ultimo_erro,
+                "proxima_em": _iso(self.proxima_em),
+                "atraso_s": round(atraso, 1),
+                "atrasada": atraso > (DAEMON_ATRASO_MAX - 1) * self.intervalo,
+            }
+
+
+class Daemon:
+    """Agenda as tarefas e expõe /health e /metrics."""
+
+    def __init__(self, tarefas: List[Tarefa], porta: Optional[int] = DAEMON_PORTA):
+        self.tarefas = tarefas
+        self.porta = porta
+        self.inicio = time.time()
+        self._stop = threading.Event()
+        self._servidor: Optional[ThreadingHTTPServer] = None
+
+    def status(self) -> Dict[str, Any]:
+        agora = time.time()
+        tarefas = {t.nome: t.status(agora) for t in self.tarefas}
+        return {
+            "status": "atrasado" if any(t["atrasada"] for t in tarefas.values()) else "ok",
+            "inicio": _iso(self.inicio),
+            "uptime_s": round(agora - self.inicio),
+            "tarefas": tarefas,
+        }
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):  # silencia o log padrão do http.server
+                pass
+
+            def _responder(self, status: int, corpo: bytes, tipo: str) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                caminho = self.path.split("?")[0]
+                if caminho in ("/", "/health"):
+                    status = daemon.status()
+                    corpo = json.dumps(status, ensure_ascii=False, default=str).encode("utf-8")
+                    self._responder(200 if status["status"] == "ok" else 503, corpo, "application/json")
+                elif caminho == "/metrics":
+                    self._responder(200, metricas.prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+                else:
+                    self._responder(404, b"{}", "application/json")
+
+        return Handler
+
+    def iniciar_servidor(self) -> None:
+        if self.porta is None:
+            return
+        self._servidor = ThreadingHTTPServer(("0.0.0.0", self.porta), self._handler())
+        self.porta = self._servidor.server_address[1]
+        threading.Thread(target=self._servidor.serve_forever, name="daemon-health", daemon=True).start()
+        logging.info(f"🩺 Health check em http://0.0.0.0:{self.porta}/health")
+
+    def parar(self) -> None:
+        if not self._stop.is_set():
+            logging.warning("🛑 Daemon encerrando: parando as rodadas em andamento...")
+        self._stop.set()
+        parar_pipelines()
+
+    def _aguardar_tarefas(self) -> None:
+        """Espera as rodadas em andamento, parando também os pipelines que elas abrirem depois do parar()."""
+        for tarefa in self.tarefas:
+            while tarefa.em_execucao:
+                parar_pipelines()
+                tarefa.aguardar(0.5)
+
+    def rodar(self) -> None:
+        """Agenda as tarefas até parar() (SIGTERM/Ctrl+C no thread principal)."""
+        no_main = threading.current_thread() is threading.main_thread()
+        if no_main:
+            signal.signal(signal.SIGTERM, lambda *_: self.parar())
+        self.iniciar_servidor()
+        logging.info(
+            "🤖 Daemon iniciado: " + ", ".join(f"{t.nome} a cada {t.intervalo:.0f}s" for t in self.tarefas)
+        )
+        try:
+            while not self._stop.is_set():
+                agora = time.time()
+                for tarefa in self.tarefas:
+                    tarefa.verificar(agora)
+                self._stop.wait(1)
+        except KeyboardInterrupt:
+            self.parar()
+        finally:
+            self._aguardar_tarefas()
+            if self._servidor is not None:
+                self._servidor.shutdown()
+            flush_notificacoes()
+            logging.info("🏁 Daemon encerrado")
+
+
+def criar_tarefas(args: argparse.Namespace) -> List[Tarefa]:
+    """Uma tarefa por entidade com intervalo > 0, chamando main.envio_entidade."""
+    from main import (  # pylint: disable=import-outside-toplevel
+        ESTOQUE_EXTRACT_WORKERS, ESTOQUE_SEND_WORKERS, ESTOQUE_WORKERS, envio_entidade,
+    )
+
+    def _envio(entidade: str, workers: int, extract_workers: Optional[int], send_workers: Optional[int]):
+        # Janela de folga para o primeiro ciclo sem watermark: 2x o intervalo, no mínimo 1 minuto
+        tempo = max(1, int(2 * intervalos[entidade] / 60))
+        return lambda: envio_entidade(
+            entidade, args.step, args.lote, workers, tempo,
+            extract_workers=extract_workers,
+            send_workers=send_workers,
+            forcar=args.force
+        )
+
+    intervalos = {"parceiro": args.parceiros, "produto": args.produtos, "estoque": args.estoque}
+    fabricas = {
+        "parceiro": _envio("parceiro", args.workers, args.extract_workers, args.send_workers),
+        "produto": _envio("produto", args.workers, args.extract_workers, args.send_workers),
+        "estoque": _envio("estoque", ESTOQUE_WORKERS, ESTOQUE_EXTRACT_WORKERS, ESTOQUE_SEND_WORKERS),
+    }
+    return [
+        Tarefa(entidade, intervalo, fabricas[entidade])
+        for entidade, intervalo in intervalos.items()
+        if intervalo > 0
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Envios incrementais agendados em um processo de longa duração")
+    parser.add_argument("--parceiros", type=float, default=900, help="intervalo em segundos (0 desliga)")
+    parser.add_argument("--produtos", type=float, default=900, help="intervalo em segundos (0 desliga)")
+    parser.add_argument("--estoque", type=float, default=120, help="intervalo em segundos (0 desliga)")
+    parser.add_argument("--step", type=int, default=100)
+    parser.add_argument("--lote", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--extract-workers", type=int, default=None)
+    parser.add_argument("--send-workers", type=int, default=None)
+    parser.add_argument("--porta", type=int, default=DAEMON_PORTA, help="porta do /health")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="envia mesmo os registros cujo payload não mudou desde o último envio"
+    )
+    args = parser.parse_args()
+
+    Daemon(criar_tarefas(args), porta=args.porta).rodar()
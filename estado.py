@@ -0,0 +1,466 @@
+"""
+Estado local persistente da sincronização, em um arquivo SQLite.
+
+O caminho vem de ESTADO_DB (padrão: estado_sync.db no diretório atual).
+Cada store usa uma conexão por thread sobre o mesmo arquivo, em modo WAL,
+e grava dentro de transações, então um processo interrompido nunca deixa
+um registro pela metade.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+ESTADO_DB = os.getenv("ESTADO_DB", "estado_sync.db")
+
+
+class SQLiteStore:
+    """Base dos stores: cria o schema e entrega uma conexão por thread."""
+
+    SCHEMA = ""
+
+    def __init__(self, caminho: Optional[str] = None):
+        self.caminho = caminho or ESTADO_DB
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+class WatermarkStore(SQLiteStore):
+    """
+    Maior DTALTER já confirmado pela CS, por entidade.
+    A próxima execução consulta estritamente depois dele.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS watermarks (
+            entidade TEXT PRIMARY KEY,
+            dtalter TEXT NOT NULL,
+            chave TEXT,
+            atualizado_em TEXT NOT NULL
+        );
+    """
+
+    def get(self, entidade: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT dtalter FROM watermarks WHERE entidade = ?", (entidade,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, entidade: str, dtalter: str, chave: Optional[str] = None) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO watermarks (entidade, dtalter, chave, atualizado_em) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(entidade) DO UPDATE SET "
+                "dtalter = excluded.dtalter, chave = excluded.chave, "
+                "atualizado_em = excluded.atualizado_em",
+                (entidade, dtalter, chave, datetime.now().isoformat(timespec="seconds"))
+            )
+        logging.info(f"💾 Watermark de '{entidade}' avançado para {dtalter}")
+
+
+class PayloadHashCache(SQLiteStore):
+    """
+    Hash do último payload confirmado pela CS, por (tipo, código).
+    Entradas mais velhas que max_idade_dias deixam de valer e, acima de
+    max_entradas, as mais antigas são descartadas em evict().
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS payload_hash (
+            tipo TEXT NOT NULL,
+            codigo TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            atualizado_em REAL NOT NULL,
+            PRIMARY KEY (tipo, codigo)
+        );
+        CREATE INDEX IF NOT EXISTS ix_payload_hash_idade ON payload_hash (atualizado_em);
+    """
+
+    def __init__(
+        self,
+        caminho: Optional[str] = None,
+        max_entradas: int = int(os.getenv("CACHE_MAX_ENTRADAS", "500000")),
+        max_idade_dias: float = float(os.getenv("CACHE_MAX_IDADE_DIAS", "7"))
+    ):
+        super().__init__(caminho)
+        self.max_entradas = max_entradas
+        self.max_idade = max_idade_dias * 86400
+
+    @staticmethod
+    def hash_registros(registros: List[Dict[str, Any]]) -> str:
+        texto = json.dumps(registros, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+    def get_many(self, tipo: str, codigos: Iterable[str]) -> Dict[str, str]:
+        codigos = list(codigos)
+        limite = time.time() - self.max_idade
+        resultado: Dict[str, str] = {}
+        # Respeita o limite de variáveis por consulta do SQLite
+        for i in range(0, len(codigos), 500):
+            bloco = codigos[i:i + 500]
+            marcadores = ",".join("?" * len(bloco))
+            rows = self._conn().execute(
+                f"SELECT codigo, hash FROM payload_hash "
+                f"WHERE tipo = ? AND atualizado_em >= ? AND codigo IN ({marcadores})",
+                (tipo, limite, *bloco)
+            ).fetchall()
+            resultado.update(rows)
+        return resultado
+
+    def set_many(self, tipo: str, hashes: Dict[str, str]) -> None:
+        if not hashes:
+            return
+        agora = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO payload_hash (tipo, codigo, hash, atualizado_em) "
+                "VALUES (?, ?, ?, ?)",
+                [(tipo, codigo, h, agora) for codigo, h in hashes.items()]
+            )
+
+    def evict(self) -> int:
+        """Remove entradas vencidas e o excesso acima de max_entradas; retorna quantas saíram."""
+        with self._conn() as conn:
+            removidas = conn.execute(
+                "DELETE FROM payload_hash WHERE atualizado_em < ?",
+                (time.time() - self.max_idade,)
+            ).rowcount
+            excesso = conn.execute("SELECT COUNT(*) FROM payload_hash").fetchone()[0] - self.max_entradas
+            if excesso > 0:
+                removidas += conn.execute(
+                    "DELETE FROM payload_hash WHERE rowid IN ("
+                    "SELECT rowid FROM payload_hash ORDER BY atualizado_em LIMIT ?)",
+                    (excesso,)
+                ).rowcount
+        if removidas:
+            logging.info(f"🧹 Cache de payloads: {removidas} entradas removidas")
+        return removidas
+
+
+class EstoqueSnapshot(SQLiteStore):
+    """
+    Hash da última linha de saldo confirmada pela CS, por identidade da linha
+    (ex.: CODPROD/CODLOCAL/CONTROLE). Entradas mais velhas que max_idade_horas
+    deixam de valer, e a linha volta a ser enviada inteira: assim todo saldo é
+    reenviado ao menos uma vez nesse intervalo, mesmo sem mudança.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS estoque_snapshot (
+            chave TEXT PRIMARY KEY,
+            codigo TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            atualizado_em REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_estoque_snapshot_idade ON estoque_snapshot (atualizado_em);
+    """
+
+    def __init__(
+        self,
+        caminho: Optional[str] = None,
+        max_idade_horas: float = float(os.getenv("ESTOQUE_SNAPSHOT_MAX_HORAS", "24"))
+    ):
+        super().__init__(caminho)
+        self.max_idade = max_idade_horas * 3600
+
+    def get_many(self, chaves: Iterable[str]) -> Dict[str, str]:
+        chaves = list(chaves)
+        limite = time.time() - self.max_idade
+        resultado: Dict[str, str] = {}
+        for i in range(0, len(chaves), 500):
+            bloco = chaves[i:i + 500]
+            rows = self._conn().execute(
+                f"SELECT chave, hash FROM estoque_snapshot "
+                f"WHERE atualizado_em >= ? AND chave IN ({','.join('?' * len(bloco))})",
+                (limite, *bloco)
+            ).fetchall()
+            resultado.update(rows)
+        return resultado
+
+    def set_many(self, linhas: Dict[str, Tuple[str, str]]) -> None:
+        """linhas = {chave: (código, hash)}."""
+        if not linhas:
+            return
+        agora = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO estoque_snapshot (chave, codigo, hash, atualizado_em) "
+                "VALUES (?, ?, ?, ?)",
+                [(chave, str(codigo), h, agora) for chave, (codigo, h) in linhas.items()]
+            )
+
+    def evict(self) -> int:
+        """Remove as linhas vencidas; retorna quantas saíram."""
+        with self._conn() as conn:
+            return conn.execute(
+                "DELETE FROM estoque_snapshot WHERE atualizado_em < ?",
+                (time.time() - self.max_idade,)
+            ).rowcount
+
+
+class CheckpointStore(SQLiteStore):
+    """
+    Progresso de uma execução paginada por keyset, para retomada após queda.
+
+    - checkpoints: última chave até a qual todas as páginas foram concluídas;
+    - checkpoint_codigos: códigos já confirmados (por tipo) nas páginas
+      seguintes, ainda incompletas;
+    - checkpoint_faixas: faixas [inicio, fim) de chaves já concluídas por
+      entidade (coordenador.py), até a coordenação inteira terminar.
+
+    Cada gravação é uma transação: uma queda no meio nunca deixa o
+    checkpoint inconsistente.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            execucao TEXT PRIMARY KEY,
+            ultima_chave TEXT,
+            paginas INTEGER NOT NULL DEFAULT 0,
+            atualizado_em TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS checkpoint_codigos (
+            execucao TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            codigo TEXT NOT NULL,
+            PRIMARY KEY (execucao, tipo, codigo)
+        );
+        CREATE TABLE IF NOT EXISTS checkpoint_faixas (
+            execucao TEXT NOT NULL,
+            entidade TEXT NOT NULL,
+            inicio INTEGER NOT NULL,
+            fim INTEGER NOT NULL,
+            concluida_em TEXT NOT NULL,
+            PRIMARY KEY (execucao, entidade, inicio, fim)
+        );
+    """
+
+    def carregar(self, execucao: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT ultima_chave, paginas, atualizado_em FROM checkpoints WHERE execucao = ?",
+            (execucao,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"ultima_chave": row[0], "paginas": row[1], "atualizado_em": row[2]}
+
+    def confirmados(self, execucao: str, tipo: str) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT codigo FROM checkpoint_codigos WHERE execucao = ? AND tipo = ?",
+            (execucao, tipo)
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def confirmar_codigos(self, execucao: str, tipo: str, codigos: Iterable[Any]) -> None:
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO checkpoint_codigos (execucao, tipo, codigo) VALUES (?, ?, ?)",
+                [(execucao, tipo, str(c)) for c in codigos]
+            )
+
+    def avancar(self, execucao: str, ultima_chave: Any, paginas: int, concluidos: Dict[str, List[Any]]) -> None:
+        """Avança a chave e descarta os códigos das páginas que ela passa a cobrir."""
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO checkpoints (execucao, ultima_chave, paginas, atualizado_em) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(execucao) DO UPDATE SET "
+                "ultima_chave = excluded.ultima_chave, paginas = excluded.paginas, "
+                "atualizado_em = excluded.atualizado_em",
+                (execucao, str(ultima_chave), paginas, datetime.now().isoformat(timespec="seconds"))
+            )
+            conn.executemany(
+                "DELETE FROM checkpoint_codigos WHERE execucao = ? AND tipo = ? AND codigo = ?",
+                [(execucao, tipo, str(c)) for tipo, codigos in concluidos.items() for c in codigos]
+            )
+
+    def faixas_concluidas(self, execucao: str, entidade: str) -> Set[Tuple[int, int]]:
+        rows = self._conn().execute(
+            "SELECT inicio, fim FROM checkpoint_faixas WHERE execucao = ? AND entidade = ?",
+            (execucao, entidade)
+        ).fetchall()
+        return {(r[0], r[1]) for r in rows}
+
+    def concluir_faixa(self, execucao: str, entidade: str, inicio: int, fim: int) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO checkpoint_faixas (execucao, entidade, inicio, fim, concluida_em) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (execucao, entidade, inicio, fim, datetime.now().isoformat(timespec="seconds"))
+            )
+
+    def limpar(self, execucao: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE execucao = ?", (execucao,))
+            conn.execute("DELETE FROM checkpoint_codigos WHERE execucao = ?", (execucao,))
+            conn.execute("DELETE FROM checkpoint_faixas WHERE execucao = ?", (execucao,))
+
+
+class RetryQueue(SQLiteStore):
+    """
+    Códigos que falharam (extração do JSON ou envio à CS), por (tipo, código),
+    com o último erro, o número de tentativas e quando tentar de novo.
+
+    O intervalo entre tentativas dobra a cada falha (backoff_segundos,
+    2x, 4x... até backoff_max_segundos). Ao chegar a max_tentativas a
+    entrada vai para o dead-letter (morto = 1) e só volta com reativar().
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fila_retry (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            codigo TEXT NOT NULL,
+            erro TEXT,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_em REAL NOT NULL,
+            morto INTEGER NOT NULL DEFAULT 0,
+            criado_em TEXT NOT NULL,
+            atualizado_em TEXT NOT NULL,
+            UNIQUE (tipo, codigo)
+        );
+        CREATE INDEX IF NOT EXISTS ix_fila_retry_proxima ON fila_retry (morto, proxima_em);
+    """
+
+    def __init__(
+        self,
+        caminho: Optional[str] = None,
+        max_tentativas: int = int(os.getenv("RETRY_MAX_TENTATIVAS", "5")),
+        backoff_segundos: float = float(os.getenv("RETRY_BACKOFF_SEGUNDOS", "300")),
+        backoff_max_segundos: float = float(os.getenv("RETRY_BACKOFF_MAX_SEGUNDOS", "21600"))
+    ):
+        super().__init__(caminho)
+        self.max_tentativas = max_tentativas
+        self.backoff_segundos = backoff_segundos
+        self.backoff_max_segundos = backoff_max_segundos
+
+    def registrar(self, tipo: str, codigos: Iterable[Any], erro: str) -> int:
+        """Conta mais uma falha para cada código; retorna quantos foram para o dead-letter."""
+        agora = time.time()
+        carimbo = datetime.now().isoformat(timespec="seconds")
+        mortos = 0
+        with self._conn() as conn:
+            for codigo in codigos:
+                row = conn.execute(
+                    "SELECT tentativas FROM fila_retry WHERE tipo = ? AND codigo = ?",
+                    (tipo, str(codigo))
+                ).fetchone()
+                tentativas = (row[0] if row else 0) + 1
+                espera = min(self.backoff_segundos * 2 ** (tentativas - 1), self.backoff_max_segundos)
+                morto = int(tentativas >= self.max_tentativas)
+                mortos += morto
+                conn.execute(
+                    "INSERT INTO fila_retry "
+                    "(tipo, codigo, erro, tentativas, proxima_em, morto, criado_em, atualizado_em) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(tipo, codigo) DO UPDATE SET "
+                    "erro = excluded.erro, tentativas = excluded.tentativas, "
+                    "proxima_em = excluded.proxima_em, morto = excluded.morto, "
+                    "atualizado_em = excluded.atualizado_em",
+                    (tipo, str(codigo), erro[:1000], tentativas, agora + espera, morto, carimbo, carimbo)
+                )
+        return mortos
+
+    def reservar(self, tipos: Iterable[str], limite: int = 10000, lease_segundos: float = 3600) -> Dict[str, List[str]]:
+        """
+        Entradas vencidas dos tipos, por tipo. Elas ficam reservadas por
+        lease_segundos, para que outro processo não as reprocesse ao mesmo tempo.
+        """
+        tipos = list(tipos)
+        agora = time.time()
+        marcadores = ",".join("?" * len(tipos))
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"SELECT id, tipo, codigo FROM fila_retry "
+                f"WHERE morto = 0 AND proxima_em <= ? AND tipo IN ({marcadores}) "
+                f"ORDER BY proxima_em LIMIT ?",
+                (agora, *tipos, limite)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE fila_retry SET proxima_em = ? WHERE id = ?",
+                [(agora + lease_segundos, r[0]) for r in rows]
+            )
+        reservados: Dict[str, List[str]] = {}
+        for _, tipo, codigo in rows:
+            reservados.setdefault(tipo, []).append(codigo)
+        return reservados
+
+    def codigos(self, tipos: Iterable[str]) -> Set[Tuple[str, str]]:
+        """(tipo, código) de todas as entradas dos tipos, inclusive as do dead-letter."""
+        tipos = list(tipos)
+        rows = self._conn().execute(
+            f"SELECT tipo, codigo FROM fila_retry WHERE tipo IN ({','.join('?' * len(tipos))})",
+            tipos
+        ).fetchall()
+        return {(tipo, codigo) for tipo, codigo in rows}
+
+    def liberar(self, tipo: str, codigos: Iterable[Any]) -> None:
+        """Devolve entradas reservadas e não processadas (execução interrompida)."""
+        agora = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                "UPDATE fila_retry SET proxima_em = ? WHERE tipo = ? AND codigo = ? AND morto = 0",
+                [(agora, tipo, str(c)) for c in codigos]
+            )
+
+    def remover(self, tipo: str, codigos: Iterable[Any]) -> None:
+        with self._conn() as conn:
+            conn.executemany(
+                "DELETE FROM fila_retry WHERE tipo = ? AND codigo = ?",
+                [(tipo, str(c)) for c in codigos]
+            )
+
+    def listar(self, mortos: Optional[bool] = None, tipo: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT id, tipo, codigo, erro, tentativas, proxima_em, morto, criado_em, atualizado_em FROM fila_retry"
+        condicoes, params = [], []
+        if mortos is not None:
+            condicoes.append("morto = ?")
+            params.append(int(mortos))
+        if tipo:
+            condicoes.append("tipo = ?")
+            params.append(tipo)
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        campos = ("id", "tipo", "codigo", "erro", "tentativas", "proxima_em", "morto", "criado_em", "atualizado_em")
+        return [dict(zip(campos, row)) for row in self._conn().execute(sql + " ORDER BY id", params)]
+
+    def _por_filtro(self, ids: Optional[List[int]], tipo: Optional[str], mortos: bool) -> Tuple[str, list]:
+        condicoes, params = [], []
+        if ids:
+            condicoes.append(f"id IN ({','.join('?' * len(ids))})")
+            params += ids
+        if tipo:
+            condicoes.append("tipo = ?")
+            params.append(tipo)
+        if mortos:
+            condicoes.append("morto = 1")
+        return (" WHERE " + " AND ".join(condicoes)) if condicoes else "", params
+
+    def reativar(self, ids: Optional[List[int]] = None, tipo: Optional[str] = None, mortos: bool = False) -> int:
+        """Zera as tentativas e deixa as entradas vencidas para a próxima execução."""
+        where, params = self._por_filtro(ids, tipo, mortos)
+        with self._conn() as conn:
+            return conn.execute(
+                f"UPDATE fila_retry SET morto = 0, tentativas = 0, proxima_em = ?, atualizado_em = ?{where}",
+                (time.time(), datetime.now().isoformat(timespec="seconds"), *params)
+            ).rowcount
+
+    def descartar(self, ids: Optional[List[int]] = None, tipo: Optional[str] = None, mortos: bool = False) -> int:
+        where, params = self._por_filtro(ids, tipo, mortos)
+        with self._conn() as conn:
+            return conn.execute(f"DELETE FROM fila_retry{where}", params).rowcount
@@ -0,0 +1,155 @@
+"""
+Fila persistente de retentativas (RetryQueue em estado.py).
+
+O pipeline avisa cada (tipo, código) que não chegou à CS, por falha na
+extração do JSON ou lote recusado, com o erro. A entrada volta na próxima
+execução depois de um backoff exponencial e, depois de RETRY_MAX_TENTATIVAS
+falhas, vai para o dead-letter, de onde só sai pela linha de comando.
+
+Uso:
+    python fila_retry.py listar [--mortos | --ativos] [--tipo produto]
+    python fila_retry.py reativar [--id 3 --id 7] [--tipo estoque] [--mortos]
+    python fila_retry.py descartar [--id 3] [--tipo parceiro] [--mortos]
+    python fila_retry.py processar [--tipos produto,estoque] [--lote 10] [--workers 10]
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from estado import RetryQueue
+from utils import logging_config
+
+# Máximo de códigos reprocessados no início de cada execução
+RETRY_LIMITE = int(os.getenv("RETRY_LIMITE", "10000"))
+
+
+def _codigo(valor: str) -> Any:
+    """Os códigos são gravados como texto; os numéricos voltam como int."""
+    return int(valor) if valor.isdigit() else valor
+
+
+class FilaRetry:
+    """Liga uma execução do pipeline à RetryQueue, para os tipos da execução."""
+
+    def __init__(self, store: RetryQueue, tipos: List[str], limite: int = RETRY_LIMITE):
+        self.store = store
+        self.tipos = tipos
+        self.limite = limite
+        self._lock = threading.Lock()
+        self._na_fila: Set[Tuple[str, str]] = store.codigos(tipos)
+        self._reservados: Set[Tuple[str, str]] = set()
+        self._contagem = dict.fromkeys(
+            ("retry_reprocessados", "retry_recuperados", "retry_registrados", "retry_dead_letter"), 0
+        )
+
+    def reservar(self) -> Dict[str, List[Any]]:
+        """Entradas vencidas, por tipo, para entrarem antes das páginas da execução."""
+        vencidos = self.store.reservar(self.tipos, self.limite)
+        with self._lock:
+            for tipo, codigos in vencidos.items():
+                self._reservados.update((tipo, c) for c in codigos)
+            self._contagem["retry_reprocessados"] = len(self._reservados)
+        if vencidos:
+            detalhe = ", ".join(f"{t}={len(c)}" for t, c in vencidos.items())
+            logging.info(f"🔁 Reprocessando códigos da fila de retentativas: {detalhe}")
+        return {tipo: [_codigo(c) for c in codigos] for tipo, codigos in vencidos.items()}
+
+    def concluidos(self, tipo: str, codigos: Iterable[Any]) -> None:
+        with self._lock:
+            saem = [str(c) for c in codigos if (tipo, str(c)) in self._na_fila]
+            for codigo in saem:
+                self._na_fila.discard((tipo, codigo))
+                self._reservados.discard((tipo, codigo))
+            self._contagem["retry_recuperados"] += len(saem)
+        if saem:
+            self.store.remover(tipo, saem)
+
+    def falharam(self, tipo: str, codigos: Iterable[Any], erro: str) -> None:
+        codigos = [str(c) for c in codigos]
+        with self._lock:
+            for codigo in codigos:
+                self._na_fila.add((tipo, codigo))
+                self._reservados.discard((tipo, codigo))
+        mortos = self.store.registrar(tipo, codigos, erro)
+        with self._lock:
+            self._contagem["retry_registrados"] += len(codigos)
+            self._contagem["retry_dead_letter"] += mortos
+        if mortos:
+            logging.warning(
+                f"🪦 {mortos} código(s) de '{tipo}' foram para o dead-letter depois de "
+                f"{self.store.max_tentativas} tentativas ({erro}); veja `python fila_retry.py listar --mortos`"
+            )
+
+    def finalizar(self) -> None:
+        """Reservas sem resultado (execução interrompida) voltam a valer na próxima execução."""
+        with self._lock:
+            sobras: Dict[str, List[str]] = {}
+            for tipo, codigo in self._reservados:
+                sobras.setdefault(tipo, []).append(codigo)
+            self._reservados.clear()
+        for tipo, codigos in sobras.items():
+            self.store.liberar(tipo, codigos)
+
+    def resumo(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._contagem)
+
+
+def _listar(store: RetryQueue, args: argparse.Namespace) -> None:
+    mortos = True if args.mortos else False if args.ativos else None
+    entradas = store.listar(mortos=mortos, tipo=args.tipo)
+    for e in entradas:
+        proxima = "dead-letter" if e["morto"] else datetime.fromtimestamp(e["proxima_em"]).isoformat(timespec="seconds")
+        print(
+            f"{e['id']:>6}  {e['tipo']:<10} {e['codigo']:<12} tentativas={e['tentativas']:<3} "
+            f"próxima={proxima:<19}  {e['erro']}"
+        )
+    print(f"{len(entradas)} entrada(s)")
+
+
+def main() -> None:
+    logging_config()
+    parser = argparse.ArgumentParser(description="Fila de retentativas e dead-letter dos envios à CS")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    listar = sub.add_parser("listar", help="mostra as entradas da fila")
+    grupo = listar.add_mutually_exclusive_group()
+    grupo.add_argument("--mortos", action="store_true", help="só o dead-letter")
+    grupo.add_argument("--ativos", action="store_true", help="só as que ainda serão retentadas")
+    listar.add_argument("--tipo")
+
+    for nome, ajuda in (
+        ("reativar", "zera as tentativas e reenvia na próxima execução"),
+        ("descartar", "remove as entradas da fila"),
+    ):
+        cmd = sub.add_parser(nome, help=ajuda)
+        cmd.add_argument("--id", type=int, action="append", dest="ids")
+        cmd.add_argument("--tipo")
+        cmd.add_argument("--mortos", action="store_true", help="só as entradas do dead-letter")
+
+    processar = sub.add_parser("processar", help="reenvia agora as entradas vencidas")
+    processar.add_argument("--tipos", default="parceiro,produto,estoque")
+    processar.add_argument("--lote", type=int, default=10)
+    processar.add_argument("--workers", type=int, default=10)
+
+    args = parser.parse_args()
+    store = RetryQueue()
+
+    if args.comando == "listar":
+        _listar(store, args)
+    elif args.comando in ("reativar", "descartar"):
+        if not (args.ids or args.tipo or args.mortos):
+            parser.error(f"{args.comando}: informe --id, --tipo ou --mortos")
+        n = getattr(store, args.comando)(ids=args.ids, tipo=args.tipo, mortos=args.mortos)
+        logging.info(f"✅ {n} entrada(s) afetada(s) por '{args.comando}'")
+    else:
+        from processamentos import processar_retentativas  # pylint: disable=import-outside-toplevel
+        tipos = [t.strip() for t in args.tipos.split(",") if t.strip()]
+        processar_retentativas(tipos, args.lote, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Filtros aplicados pelo pipeline entre a extração e a montagem dos lotes.
+
+Cada filtro implementa:
+- filtrar(tipo, extraidos) -> extraidos que ainda precisam ir para a CS
+- confirmar(lote) -> chamado depois que a CS aceitou o lote
+- resumo() -> contadores incluídos no resumo da execução
+"""
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+from estado import EstoqueSnapshot, PayloadHashCache
+from pipeline import ItemExtraido, LoteCS
+
+
+class FiltroInalterados:
+    """
+    Descarta os códigos cujo payload é idêntico ao último confirmado pela CS.
+    Com forcar=True nada é descartado, mas os hashes continuam sendo gravados.
+    """
+
+    def __init__(self, cache: PayloadHashCache, forcar: bool = False):
+        self.cache = cache
+        self.forcar = forcar
+        self._lock = threading.Lock()
+        self._pendentes: Dict[Tuple[str, str], str] = {}
+        self._contagem: Dict[str, List[int]] = {}
+
+    def filtrar(self, tipo: str, extraidos: List[ItemExtraido]) -> List[ItemExtraido]:
+        hashes = {str(codigo): self.cache.hash_registros(regs) for codigo, regs in extraidos}
+        anteriores = {} if self.forcar else self.cache.get_many(tipo, hashes)
+
+        mantidos: List[ItemExtraido] = []
+        with self._lock:
+            contagem = self._contagem.setdefault(tipo, [0, 0])
+            for codigo, regs in extraidos:
+                h = hashes[str(codigo)]
+                contagem[0] += 1
+                if anteriores.get(str(codigo)) == h:
+                    contagem[1] += 1
+                    continue
+                self._pendentes[(tipo, str(codigo))] = h
+                mantidos.append((codigo, regs))
+        return mantidos
+
+    def confirmar(self, lote: LoteCS) -> None:
+        with self._lock:
+            hashes = {
+                str(codigo): self._pendentes.pop((lote.tipo, str(codigo)))
+                for codigo in lote.codigos
+                if (lote.tipo, str(codigo)) in self._pendentes
+            }
+        self.cache.set_many(lote.tipo, hashes)
+
+    def resumo(self) -> Dict[str, int]:
+        verificados = inalterados = 0
+        with self._lock:
+            for tipo, (total, iguais) in self._contagem.items():
+                taxa = 100 * iguais / total if total else 0
+                logging.info(
+                    f"♻️ Cache de '{tipo}': {iguais}/{total} códigos inalterados "
+                    f"({taxa:.1f}%) não enviados à CS"
+                )
+                verificados += total
+                inalterados += iguais
+        return {"cache_verificados": verificados, "cache_inalterados": inalterados}
+
+
+# Campos que identificam uma linha de saldo (Saldos_Atualiza)
+ESTOQUE_CAMPOS_CHAVE = tuple(
+    c.strip() for c in os.getenv("ESTOQUE_CAMPOS_CHAVE", "CODPROD,CODLOCAL,CONTROLE").split(",") if c.strip()
+)
+
+
+class FiltroDeltaEstoque:
+    """
+    Envia só as linhas de saldo que mudaram desde a última confirmada pela CS.
+
+    Cada linha é identificada pelos campos de `campos`; sem algum deles, a
+    identidade é o próprio conteúdo da linha (só linhas idênticas a uma já
+    confirmada são descartadas). O snapshot expira por linha (ver
+    EstoqueSnapshot), o que força o reenvio periódico de todos os saldos.
+    Com forcar=True nada é descartado, mas o snapshot continua sendo gravado.
+    """
+
+    def __init__(
+        self,
+        snapshot: EstoqueSnapshot,
+        forcar: bool = False,
+        campos: Iterable[str] = ESTOQUE_CAMPOS_CHAVE,
+        tipos: Iterable[str] = ("estoque",)
+    ):
+        self.snapshot = snapshot
+        self.forcar = forcar
+        self.campos = tuple(campos)
+        self.tipos = set(tipos)
+        self._lock = threading.Lock()
+        self._contagem = [0, 0]
+
+    def _linha(self, codigo: Any, registro: Dict[str, Any]) -> Tuple[str, str]:
+        """(chave, hash) de uma linha de saldo."""
+        h = PayloadHashCache.hash_registros([registro])
+        if isinstance(registro, dict) and all(c in registro for c in self.campos):
+            return "|".join(f"{c}={registro[c]}" for c in self.campos), h
+        return f"{codigo}#{h}", h
+
+    def filtrar(self, tipo: str, extraidos: List[ItemExtraido]) -> List[ItemExtraido]:
+        if tipo not in self.tipos:
+            return extraidos
+        linhas = [[self._linha(codigo, r) for r in regs] for codigo, regs in extraidos]
+        anteriores = {} if self.forcar else self.snapshot.get_many(
+            chave for por_codigo in linhas for chave, _ in por_codigo
+        )
+
+        mantidos: List[ItemExtraido] = []
+        total = iguais = 0
+        for (codigo, regs), por_codigo in zip(extraidos, linhas):
+            alterados = [r for r, (chave, h) in zip(regs, por_codigo) if anteriores.get(chave) != h]
+            total += len(regs)
+            iguais += len(regs) - len(alterados)
+            mantidos.append((codigo, alterados))
+        with self._lock:
+            self._contagem[0] += total
+            self._contagem[1] += iguais
+        return mantidos
+
+    def confirmar(self, lote: LoteCS) -> None:
+        if lote.tipo not in self.tipos:
+            return
+        origem = lote.origem or [None] * len(lote.registros)
+        linhas = {}
+        for codigo, registro in zip(origem, lote.registros):
+            chave, h = self._linha(codigo, registro)
+            linhas[chave] = (codigo, h)
+        self.snapshot.set_many(linhas)
+
+    def resumo(self) -> Dict[str, int]:
+        with self._lock:
+            total, iguais = self._contagem
+        if total:
+            logging.info(
+                f"♻️ Snapshot de estoque: {iguais}/{total} linhas de saldo inalteradas "
+                f"({100 * iguais / total:.1f}%) não enviadas à CS"
+            )
+        return {"estoque_linhas_verificadas": total, "estoque_linhas_inalteradas": iguais}
@@ -1,37 +1,65 @@
+import argparse
 import time
 import logging
-from processamentos import processar_produtos, processar_parceiros
-from telegram_notification import enviar_notificacao_telegram
+from typing import Optional, Tuple
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(Y-%m-%d %H:%M:%S) - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+from processamentos import parse_shard, processar_produtos, processar_parceiros
+from telegram_notification import flush_notificacoes, notificar
+from utils import logging_config
 
+logging_config()
 
-def envio_geral(step: int, lote: int, workers: int) -> None:
+
+def envio_geral(
+    step: int,
+    lote: int,
+    workers: int,
+    extract_workers: int = None,
+    send_workers: int = None,
+    forcar: bool = False,
+    shard: Optional[Tuple[int, int]] = None,
+    retomar: bool = False
+) -> None:
     """
-    Executa o processamento de produtos e parceiros,
+    Executa o processamento de produtos e parceiros pelo pipeline,
     mede a duração total e envia notificações via Telegram.
+    forcar=True ignora o cache de payloads inalterados.
+    shard=(i, N) processa só os códigos com chave % N = i, para dividir
+    a carga entre N processos/containers independentes.
+    retomar=True continua do checkpoint de uma execução interrompida.
     """
     start_time = time.perf_counter()
-    logging.info("🚀 Iniciando atualização geral Sankhya-Icorp...")
-    enviar_notificacao_telegram("🚀 Atualização geral iniciada")
+    parte = f" (shard {shard[0]}/{shard[1]})" if shard else ""
+    logging.info(f"🚀 Iniciando atualização geral Sankhya-Icorp{parte}...")
+    notificar(f"🚀 Atualização geral iniciada{parte}")
 
     # Processar produtos
     try:
-        processar_produtos(step, lote, workers)
+        processar_produtos(
+            step, lote, workers,
+            extract_workers=extract_workers,
+            send_workers=send_workers,
+            forcar=forcar,
+            shard=shard,
+            retomar=retomar
+        )
     except Exception as e:
         logging.error(f"❌ Erro no processamento de PRODUTOS: {e}", exc_info=True)
-        enviar_notificacao_telegram(f"❌ Falha no processo de produtos: {e}")
+        notificar(f"❌ Falha no processo de produtos: {e}", agrupar=True)
 
     # Processar parceiros
     try:
-        processar_parceiros(step, lote, workers)
+        processar_parceiros(
+            step, lote, workers,
+            extract_workers=extract_workers,
+            send_workers=send_workers,
+            forcar=forcar,
+            shard=shard,
+            retomar=retomar
+        )
     except Exception as e:
         logging.error(f"❌ Erro no processamento de PARCEIROS: {e}", exc_info=True)
-        enviar_notificacao_telegram(f"❌ Falha no processo de parceiros: {e}")
+        notificar(f"❌ Falha no processo de parceiros: {e}", agrupar=True)
 
     # Finalizar e notificar
     elapsed = time.perf_counter() - start_time
@@ -39,11 +67,12 @@ def envio_geral(step: int, lote: int, workers: int) -> None:
     tempo_formatado = f"{mins}m{secs:02d}s" if mins else f"{secs}s"
 
     mensagem = (
-        f"🏁 Atualização geral finalizada\n"
+        f"🏁 Atualização geral finalizada{parte}\n"
         f"⏱️ Duração total: {tempo_formatado}"
     )
     logging.info(mensagem)
-    enviar_notificacao_telegram(mensagem)
+    notificar(mensagem)
+    flush_notificacoes()
 
 
 if __name__ == "__main__":
@@ -51,4 +80,29 @@ if __name__ == "__main__":
     STEP = 50
     LOTE = 10
     WORKERS = 35
-    envio_geral(STEP, LOTE, WORKERS)
+    EXTRACT_WORKERS = 35
+    SEND_WORKERS = 15
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="envia mesmo os registros cujo payload não mudou desde o último envio"
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="processa só a parte i de N (ex.: 0/4), pelo resto da divisão do código"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continua a última execução interrompida a partir do checkpoint"
+    )
+    args = parser.parse_args()
+
+    envio_geral(
+        STEP, LOTE, WORKERS, EXTRACT_WORKERS, SEND_WORKERS,
+        forcar=args.force, shard=args.shard, retomar=args.resume
+    )
@@ -0,0 +1,150 @@
+"""
+Cliente assíncrono da API CS e variante assíncrona de process_codigos.
+
+Um único event loop (sankhya_async.executar) mantém centenas de
+requisições em andamento sobre os pools keep-alive de AsyncSankhyaClient e
+AsyncCSClient, sem um thread por requisição. Com HTTP_ASYNC=1,
+get_cs_client devolve CSClientSincrono, e o pipeline (filtros, fila de
+retentativas, checkpoint, bissecção) roda igual sobre este transporte.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from icorp_api.cs_sender import (
+    CS_MAX_CONNECTIONS, STATUS_GZIP_RECUSADO, STATUS_RETENTATIVA, CSClient, ResultadoCS, process_codigos,
+)
+from limitador import AdaptiveLimiter, limiter_atual
+from metricas import metricas
+from sankhya_api import sankhya_async
+from sankhya_api.sankhya_async import criar_async_client, executar, httpx
+from utils import util_cs_enpoint
+
+
+class AsyncCSClient:
+    """
+    Cliente assíncrono para a API CS, com as mesmas políticas do CSClient:
+    retry com backoff em 5xx e erros de conexão (fora da vaga do limitador),
+    corpo gzip com fallback para corpo simples e as mesmas métricas.
+    """
+    def __init__(
+        self,
+        max_retries: int = 5,
+        backoff_factor: float = 0.5,
+        timeout: Optional[int] = None,
+        max_connections: int = CS_MAX_CONNECTIONS
+    ):
+        # Reaproveita tenant, URL base, montagem do corpo e estado do gzip do cliente síncrono
+        self._sync = CSClient(max_retries=max_retries, backoff_factor=backoff_factor, pool_size=1)
+        self.max_retries = max_retries
+        self.timeout = timeout or self._sync.timeout
+        self.max_connections = max_connections
+        self._client = None
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            self._client = criar_async_client(self.max_connections)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, payload: List[Dict[str, Any]], tipo: str, limiter: AdaptiveLimiter, comprimir: bool = True):
+        """Como CSClient._post: devolve (última resposta, se foi comprimida)."""
+        args = self._sync.request_args(tipo)
+        corpo, extras = self._sync.preparar_corpo(payload, tipo, comprimir)
+        args["headers"].update(extras)
+        endpoint = util_cs_enpoint(tipo)
+        resp: Optional[httpx.Response] = None
+        for tentativa in range(self.max_retries + 1):
+            if tentativa:
+                metricas.incr("cs_retries_total", endpoint=endpoint)
+                await asyncio.sleep(self._sync._espera(tentativa, resp))  # pylint: disable=protected-access
+            inicio = time.perf_counter()
+            try:
+                async with limiter.slot_async() as slot:
+                    resp = await self.client.post(**args, content=corpo, timeout=self.timeout)
+                    slot.status(resp.status_code)
+            except httpx.TransportError:
+                metricas.incr("cs_requisicoes_total", endpoint=endpoint, status="erro")
+                resp = None
+                if tentativa < self.max_retries:
+                    continue
+                raise
+            metricas.observar("cs_requisicao_segundos", time.perf_counter() - inicio, endpoint=endpoint)
+            metricas.incr("cs_requisicoes_total", endpoint=endpoint, status=resp.status_code)
+            metricas.incr("cs_bytes_enviados_total", len(corpo), endpoint=endpoint)
+            if resp.status_code not in STATUS_RETENTATIVA:
+                break
+        return resp, bool(extras)
+
+    async def send(
+        self,
+        payload: List[Dict[str, Any]],
+        tipo: str,
+        limiter: Optional[AdaptiveLimiter] = None
+    ) -> ResultadoCS:
+        """Versão assíncrona de CSClient.send, com o mesmo resultado por registro."""
+        logging.debug("📤 Enviando %d registros de '%s'", len(payload), tipo)
+        limiter = limiter or limiter_atual("cs")
+        try:
+            resp, comprimido = await self._post(payload, tipo, limiter)
+            if comprimido and resp.status_code in STATUS_GZIP_RECUSADO:
+                # Reenvio sem gzip fora das tentativas do _post
+                simples, _ = await self._post(payload, tipo, limiter, comprimir=False)
+                # Mesma recusa sem gzip: o problema é o conteúdo, não a compressão
+                if simples.status_code not in STATUS_GZIP_RECUSADO:
+                    self._sync.recusar_gzip(tipo, resp.status_code)
+                resp = simples
+        except httpx.HTTPError as e:
+            logging.error(f"❌ Falha ao enviar '{tipo}': {e}")
+            return ResultadoCS(len(payload), erro=str(e))
+        return CSClient.ler_resposta(tipo, len(payload), resp.status_code, resp.reason_phrase, resp.json)
+
+
+class CSClientSincrono:
+    """
+    Fachada síncrona do AsyncCSClient, com a interface send() do CSClient:
+    cada envio roda no loop compartilhado, no limitador do thread que chamou
+    (e, portanto, no orçamento dele).
+    """
+    def __init__(self, cliente: Optional[AsyncCSClient] = None):
+        self.cliente = cliente or AsyncCSClient()
+
+    def send(self, payload: List[Dict[str, Any]], tipo: str) -> ResultadoCS:
+        return executar(self.cliente.send(payload, tipo, limiter_atual("cs")))
+
+
+async def process_codigos_async(
+    *,
+    tipo: str,
+    codigos: Iterable[Any],
+    lote_size: int = 100,
+    max_workers: int = 5,
+    cs_client: Optional[CSClientSincrono] = None
+) -> Dict[str, int]:
+    """
+    Variante de process_codigos sobre o transporte assíncrono, para quem já
+    roda num event loop: o pipeline é o mesmo (limitadores, métricas,
+    bissecção), com extração e envio feitos pelos clientes httpx.
+    """
+    return await asyncio.to_thread(
+        process_codigos,
+        tipo=tipo,
+        codigos=list(codigos),
+        fetch_json_fn=sankhya_async.fetch_json,
+        clean_json_fn=None,
+        cs_client=cs_client or CSClientSincrono(),
+        lote_size=lote_size,
+        max_workers=max_workers,
+        fetch_lote_fn=sankhya_async.fetch_json_lote
+    )
+
+
+def process_codigos_async_run(**kwargs) -> Dict[str, int]:
+    """Executa process_codigos_async a partir de código síncrono."""
+    return asyncio.run(process_codigos_async(**kwargs))
@@ -1,79 +1,326 @@
 import os
-import time
+import gzip
 import json
 import logging
+import math
+import threading
+import time
 from typing import (
-    List, Dict, Any, Optional, Callable, Iterable
+    List, Dict, Any, Optional, Callable, Iterable, Tuple
 )
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
-from sankhya_api.sankhya_fetch import snk_fetch_data, snk_fetch_json
-from utils import logging_config, util_cs_enpoint, util_remove_brackets
+from limitador import get_limiter, limiter_atual, orcamento_limites
+from metricas import metricas
+from pipeline import ItemExtraido, LoteCS, Pipeline
+from sankhya_api.sankhya_fetch import (
+    HTTP_ASYNC, snk_fetch_data, snk_fetch_json, snk_fetch_json_lote, snk_fetch_json_multi,
+)
+from utils import logging_config, util_cs_enpoint, util_iter_json, util_json_dumps, util_query_key
 
 logging_config()
 load_dotenv()
 
+# Conexões keep-alive do CSClient compartilhado (por host)
+CS_MAX_CONNECTIONS = int(os.getenv("CS_MAX_CONNECTIONS", "50"))
+
+# Compressão gzip do corpo dos POSTs: opt-in, só para endpoints que aceitam
+# Content-Encoding (um 5xx ao corpo comprimido não tem como ser distinguido de
+# uma falha do serviço, então não há fallback automático para esse caso)
+CS_GZIP = os.getenv("CS_GZIP", "0") == "1"
+CS_GZIP_NIVEL = int(os.getenv("CS_GZIP_NIVEL", "6"))
+CS_GZIP_MIN_BYTES = int(os.getenv("CS_GZIP_MIN_BYTES", "1024"))
+
+# Respostas que indicam que o endpoint não aceita corpo comprimido
+STATUS_GZIP_RECUSADO = (400, 411, 415)
+# Respostas repetidas por CSClient._post, com backoff exponencial
+STATUS_RETENTATIVA = (500, 502, 503, 504)
+# Espera máxima entre tentativas (também para o Retry-After da CS)
+CS_BACKOFF_MAX = float(os.getenv("CS_BACKOFF_MAX", "120"))
+
+# Recusas por registro com estes trechos na mensagem são transitórias:
+# o registro é reenviado sozinho até CS_RETENTATIVAS_REGISTRO vezes
+CS_ERROS_TRANSITORIOS = tuple(
+    t.strip().lower() for t in os.getenv(
+        "CS_ERROS_TRANSITORIOS", "timeout,tempo esgotado,deadlock,bloqueio,indisponível,tente novamente"
+    ).split(",") if t.strip()
+)
+CS_RETENTATIVAS_REGISTRO = int(os.getenv("CS_RETENTATIVAS_REGISTRO", "2"))
+
+# Registros recusados que a bissecção consegue isolar por lote: cada um custa
+# 2 POSTs extras por nível de divisão (ver orcamento_bisseccao)
+CS_BISSECCAO_RECUSAS = int(os.getenv("CS_BISSECCAO_RECUSAS", "1"))
+# Só recusas do conteúdo (e Sucesso=false com 2xx) são divididas; sem resposta,
+# autenticação, endpoint errado ou 5xx, a falha não é de um registro
+STATUS_BISSECCAO = (400, 422)
+
+# Tipos da mesma tabela (produto e estoque) extraídos numa única consulta por bloco
+SNK_EXTRACAO_CONJUNTA = os.getenv("SNK_EXTRACAO_CONJUNTA", "1") == "1"
+
+# Onde procurar o retorno por registro e o status/mensagem de cada item
+_CHAVES_ITENS = ("Itens", "Items", "Resultados", "Results", "Registros", "Retorno", "Detalhes")
+_CHAVES_STATUS = ("Sucesso", "sucesso", "Success", "success", "Status", "status")
+_CHAVES_MENSAGEM = ("Mensagem", "mensagem", "Message", "message", "Erro", "erro", "Error", "error")
+_VALORES_OK = ("true", "1", "s", "sim", "ok", "sucesso", "success")
+
+
+class ResultadoCS:
+    """
+    Resultado de um POST à CS, pela posição de cada registro no payload.
+
+    Com erro preenchido o lote inteiro falhou (status é o HTTP da resposta,
+    None se não houve resposta). Senão, rejeitados tem a mensagem de cada
+    registro recusado e os demais foram aceitos.
+    """
+
+    def __init__(self, total: int, resposta: Any = None, erro: Optional[str] = None, status: Optional[int] = None):
+        self.total = total
+        self.resposta = resposta
+        self.erro = erro
+        self.status = status
+        self.rejeitados: Dict[int, str] = {}
+
+    @property
+    def ok(self) -> bool:
+        return self.erro is None and not self.rejeitados
+
+    @property
+    def aceitos(self) -> List[int]:
+        if self.erro is not None:
+            return []
+        return [i for i in range(self.total) if i not in self.rejeitados]
+
+    def __repr__(self) -> str:
+        return (
+            f"ResultadoCS(total={self.total}, aceitos={len(self.aceitos)}, "
+            f"rejeitados={len(self.rejeitados)}, erro={self.erro!r})"
+        )
+
+
+def _status_item(item: Any) -> Optional[Tuple[bool, str]]:
+    """(aceito, mensagem) de um item do retorno da CS; None se o formato for desconhecido."""
+    if not isinstance(item, dict):
+        return None
+    mensagem = next((str(item[c]) for c in _CHAVES_MENSAGEM if item.get(c)), "")
+    for chave in _CHAVES_STATUS:
+        if chave in item:
+            valor = item[chave]
+            return valor is True or str(valor).strip().lower() in _VALORES_OK, mensagem
+    if any(item.get(c) for c in ("Erro", "erro", "Error", "error")):
+        return False, mensagem
+    return None
+
+
+def interpretar_resposta(dados: Any, total: int, status: Optional[int] = 200) -> ResultadoCS:
+    """
+    Lê o retorno de Cliente/ProdutoUpdate/Saldos_Atualiza. Uma lista com um
+    status por registro (na raiz ou em Itens/Resultados/...) vira o resultado
+    por posição; sem ela, Sucesso=false ou erro vale para o lote inteiro, e
+    qualquer outra resposta 2xx conta como todos aceitos.
+    """
+    resultado = ResultadoCS(total, resposta=dados, status=status)
+    itens = dados if isinstance(dados, list) else None
+    if isinstance(dados, dict):
+        itens = next((dados[c] for c in _CHAVES_ITENS if isinstance(dados.get(c), list)), None)
+
+    if itens is not None and len(itens) == total:
+        por_item = [_status_item(item) for item in itens]
+        if all(s is not None for s in por_item):
+            for i, (aceito, mensagem) in enumerate(por_item):
+                if not aceito:
+                    resultado.rejeitados[i] = mensagem or "registro recusado pela CS"
+            return resultado
+
+    geral = _status_item(dados)
+    if geral and not geral[0]:
+        resultado.erro = geral[1] or "lote recusado pela CS"
+    return resultado
+
 
 class CSClient:
     """
     Cliente HTTP para a API CS, com Session reutilizável
-    e retry automático em erros 5xx.
+    e retry automático em erros 5xx e de conexão. Cada tentativa ocupa a sua
+    vaga no limitador; o backoff entre elas fica fora, para a espera não
+    entrar nas latências do AIMD.
+    Com compress (CS_GZIP=1), corpos a partir de compress_min_bytes vão com
+    Content-Encoding: gzip; se um endpoint recusar (STATUS_GZIP_RECUSADO),
+    ele passa a receber corpo simples.
     """
     def __init__(
         self,
         max_retries: int = 5,
         backoff_factor: float = 0.5,
-        timeout: int = 120
+        timeout: int = int(os.getenv("CS_TIMEOUT", "120")),
+        pool_size: int = 10,
+        compress: bool = CS_GZIP,
+        compress_level: int = CS_GZIP_NIVEL,
+        compress_min_bytes: int = CS_GZIP_MIN_BYTES
     ):
         self.tenant_id = os.getenv("CS_TENANT", "")
-        base = "https://cc01.csicorpnet.com.br/CS50Integracao_API/rest/CS_IntegracaoV1"
-        self.session = self._init_session(max_retries, backoff_factor)
+        base = os.getenv(
+            "CS_BASE_URL",
+            "https://cc01.csicorpnet.com.br/CS50Integracao_API/rest/CS_IntegracaoV1"
+        )
+        self.session = self._init_session(pool_size)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
         self.base_url = base
         self.timeout = timeout
+        self.compress = compress
+        self.compress_level = compress_level
+        self.compress_min_bytes = compress_min_bytes
+        self._sem_gzip: set = set()
 
-    def _init_session(self, max_retries: int, backoff_factor: float) -> requests.Session:
+    def _init_session(self, pool_size: int) -> requests.Session:
         session = requests.Session()
-        retries = Retry(
-            total=max_retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=[500, 502, 503, 504],
-            allowed_methods=["POST"]
-        )
-        adapter = HTTPAdapter(max_retries=retries)
+        # Sem retry no adapter: as tentativas ficam em _post, fora do limitador
+        adapter = HTTPAdapter(max_retries=0, pool_maxsize=pool_size)
         session.mount("https://", adapter)
         session.mount("http://", adapter)
         return session
 
+    def request_args(self, tipo: str) -> Dict[str, Any]:
+        """Monta url, params e headers do endpoint CS de cada tipo."""
+        endpoint = util_cs_enpoint(tipo)
+        return {
+            "url": f"{self.base_url}/{endpoint}",
+            "params": {"In_Tenant_ID": self.tenant_id},
+            "headers": {"Content-Type": "application/json"},
+        }
+
+    def preparar_corpo(self, payload: List[Dict[str, Any]], tipo: str, comprimir: bool = True):
+        """
+        Serializa o payload em JSON compacto e, se couber, comprime com gzip.
+        Retorna (corpo, headers extras).
+        """
+        corpo = util_json_dumps(payload)
+        if not (
+            comprimir and self.compress
+            and tipo not in self._sem_gzip
+            and len(corpo) >= self.compress_min_bytes
+        ):
+            logging.debug(f"📏 Corpo de '{tipo}': {len(corpo)} bytes")
+            return corpo, {}
+
+        comprimido = gzip.compress(corpo, compresslevel=self.compress_level)
+        logging.debug(f"🗜️ Corpo de '{tipo}': {len(corpo)} → {len(comprimido)} bytes (gzip)")
+        return comprimido, {"Content-Encoding": "gzip"}
+
+    def recusar_gzip(self, tipo: str, status_code: int) -> None:
+        """Desliga a compressão para o endpoint de `tipo` pelo resto do processo."""
+        self._sem_gzip.add(tipo)
+        logging.warning(
+            f"⚠️ Endpoint de '{tipo}' recusou corpo gzip (HTTP {status_code}); "
+            f"seguindo sem compressão"
+        )
+
+    def _espera(self, tentativa: int, resp: Optional[requests.Response]) -> float:
+        """Backoff antes da tentativa seguinte; o Retry-After da CS, se houver, prevalece."""
+        retry_after = resp.headers.get("Retry-After", "") if resp is not None else ""
+        espera = float(retry_after) if retry_after.isdigit() else self.backoff_factor * 2 ** (tentativa - 1)
+        return min(espera, CS_BACKOFF_MAX)
+
+    def _post(self, payload: List[Dict[str, Any]], tipo: str, comprimir: bool = True):
+        """
+        POST com até max_retries novas tentativas em 5xx e erros de conexão;
+        esgotadas, devolve a última resposta (o status decide a bissecção).
+        """
+        args = self.request_args(tipo)
+        corpo, extras = self.preparar_corpo(payload, tipo, comprimir)
+        args["headers"].update(extras)
+        endpoint = util_cs_enpoint(tipo)
+        resp: Optional[requests.Response] = None
+        for tentativa in range(self.max_retries + 1):
+            if tentativa:
+                metricas.incr("cs_retries_total", endpoint=endpoint)
+                time.sleep(self._espera(tentativa, resp))
+            inicio = time.perf_counter()
+            try:
+                with limiter_atual("cs").slot() as slot:
+                    resp = self.session.post(**args, data=corpo, timeout=self.timeout)
+                    slot.status(resp.status_code)
+            except (requests.ConnectionError, requests.Timeout):
+                metricas.incr("cs_requisicoes_total", endpoint=endpoint, status="erro")
+                resp = None
+                if tentativa < self.max_retries:
+                    continue
+                raise
+            except requests.RequestException:
+                metricas.incr("cs_requisicoes_total", endpoint=endpoint, status="erro")
+                raise
+            metricas.observar("cs_requisicao_segundos", time.perf_counter() - inicio, endpoint=endpoint)
+            metricas.incr("cs_requisicoes_total", endpoint=endpoint, status=resp.status_code)
+            metricas.incr("cs_bytes_enviados_total", len(corpo), endpoint=endpoint)
+            if resp.status_code not in STATUS_RETENTATIVA:
+                break
+        return resp, bool(extras)
+
     def send(
         self,
         payload: List[Dict[str, Any]],
         tipo: str
-    ) -> Dict[str, Any]:
-        endpoint = util_cs_enpoint(tipo)
-        url = f"{self.base_url}/{endpoint}"
-        params = {"In_Tenant_ID": self.tenant_id}
-        headers = {"Content-Type": "application/json"}
-
-        logging.info(f"📤 Enviando {len(payload)} registros de '{tipo}'")
+    ) -> ResultadoCS:
+        """Envia os registros e devolve o resultado por registro (ver interpretar_resposta)."""
+        logging.debug("📤 Enviando %d registros de '%s'", len(payload), tipo)
         try:
-            resp = self.session.post(
-                url,
-                headers=headers,
-                params=params,
-                json=payload,
-                timeout=self.timeout
-            )
-            resp.raise_for_status()
-            logging.info(f"✅ {tipo.capitalize()} enviado (HTTP {resp.status_code})")
-            return resp.json()
+            resp, comprimido = self._post(payload, tipo)
+            if comprimido and resp.status_code in STATUS_GZIP_RECUSADO:
+                simples, _ = self._post(payload, tipo, comprimir=False)
+                # Mesma recusa sem gzip: o problema é o conteúdo, não a compressão
+                if simples.status_code not in STATUS_GZIP_RECUSADO:
+                    self.recusar_gzip(tipo, resp.status_code)
+                resp = simples
         except requests.RequestException as e:
             logging.error(f"❌ Falha ao enviar '{tipo}': {e}")
-            return {"erro": str(e)}
+            return ResultadoCS(len(payload), erro=str(e))
+        return self.ler_resposta(tipo, len(payload), resp.status_code, resp.reason, resp.json)
+
+    @staticmethod
+    def ler_resposta(tipo: str, total: int, status_code: int, reason: str, data_fn) -> ResultadoCS:
+        """Interpreta a resposta final de um envio (ver interpretar_resposta) e registra no log."""
+        try:
+            dados = data_fn()
+        except ValueError:
+            dados = None
+        resultado = interpretar_resposta(dados, total, status_code)
+        if status_code >= 400 and (resultado.erro is None and not resultado.rejeitados):
+            # Erro HTTP sem detalhe reconhecível no corpo
+            resultado.erro = f"HTTP {status_code}: {reason}"
+        if resultado.erro is not None:
+            logging.error(f"❌ CS recusou o lote de '{tipo}' (HTTP {status_code}): {resultado.erro}")
+        elif resultado.rejeitados:
+            logging.debug(
+                f"⚠️ {tipo.capitalize()} enviado (HTTP {status_code}) com "
+                f"{len(resultado.rejeitados)} de {total} registros recusados"
+            )
+        else:
+            logging.debug(f"✅ {tipo.capitalize()} enviado (HTTP {status_code})")
+        return resultado
+
+
+_cs_client: Optional[CSClient] = None
+_cs_client_lock = threading.Lock()
+
+
+def get_cs_client() -> CSClient:
+    """
+    CSClient compartilhado pelo processo: um único pool keep-alive para a CS.
+    Com HTTP_ASYNC=1 é a fachada síncrona do AsyncCSClient (icorp_api.cs_async),
+    com a mesma interface send().
+    """
+    global _cs_client
+    with _cs_client_lock:
+        if _cs_client is None:
+            if HTTP_ASYNC:
+                from icorp_api.cs_async import CSClientSincrono  # pylint: disable=import-outside-toplevel
+                _cs_client = CSClientSincrono()
+            else:
+                _cs_client = CSClient(pool_size=CS_MAX_CONNECTIONS)
+        return _cs_client
 
 
 def chunked(iterable: Iterable, size: int) -> Iterable[List]:
@@ -91,95 +338,387 @@ def process_lotes(
     clean_json_fn: Optional[Callable[[str], str]],
     cs_client: CSClient,
     lote_size: int = 100,
-    max_workers: int = 5
-) -> None:
+    max_workers: int = 5,
+    fetch_lote_fn: Optional[Callable[[List, str], Dict[Any, str]]] = snk_fetch_json_lote
+) -> Dict[str, int]:
+    """
+    Busca os códigos de `sql` e os processa via process_codigos.
+    """
     registros = snk_fetch_data(sql)
-    total = len(registros)
-    logging.info(f"🔢 {total} registros para '{tipo}', em lotes de {lote_size}")
+    return process_codigos(
+        tipo=tipo,
+        codigos=[row[0] for row in registros],
+        fetch_json_fn=fetch_json_fn,
+        clean_json_fn=clean_json_fn,
+        cs_client=cs_client,
+        lote_size=lote_size,
+        max_workers=max_workers,
+        fetch_lote_fn=fetch_lote_fn
+    )
 
-    start = time.time()
 
-    def _worker(lote: List, idx: int):
-        batch: List[Dict[str, Any]] = []
-        for row in lote:
-            key = row[0]
-            raw = fetch_json_fn(key, tipo)
-            raw = clean_json_fn(raw) if clean_json_fn else raw
-            try:
-                data = json.loads(raw)
-            except json.JSONDecodeError as e:
-                logging.warning(f"⚠️ JSON inválido em {tipo}='{key}': {e}")
-                continue
+def extrair_registros(
+    tipo: str,
+    codigos: List[Any],
+    fetch_json_fn: Callable[[Any, str], str] = snk_fetch_json,
+    clean_json_fn: Optional[Callable[[str], str]] = None,
+    fetch_lote_fn: Optional[Callable[[List, str], Dict[Any, str]]] = snk_fetch_json_lote
+) -> List[ItemExtraido]:
+    """
+    Extrai os registros JSON de um lote de códigos, como [(codigo, registros)].
+    Por padrão o JSON do lote inteiro vem de uma única consulta (fetch_lote_fn);
+    só os códigos ausentes do resultado (sem linha ou de bloco que falhou) são
+    buscados um a um via fetch_json_fn. Nos dois caminhos, texto vazio (função
+    NULL) é código sem payload: sai com a lista vazia e conta como concluído;
+    None (busca que falhou) ou JSON inválido deixa o código de fora, como falha.
+    """
+    prefetched: Dict[Any, str] = {}
+    if fetch_lote_fn:
+        try:
+            prefetched = fetch_lote_fn(codigos, tipo)
+        except Exception as e:
+            logging.warning(f"⚠️ Falha na busca em lote de '{tipo}': {e}")
+        faltantes = sum(1 for key in codigos if key not in prefetched)
+        if faltantes:
+            logging.info(f"↪️ {faltantes} código(s) de '{tipo}' via busca individual")
+
+    extraidos: List[ItemExtraido] = []
+    for key in codigos:
+        raw = prefetched[key] if key in prefetched else fetch_json_fn(key, tipo)
+        if raw is not None and not raw.strip():
+            extraidos.append((key, []))
+            continue
+        registros = parse_registros(tipo, key, raw, clean_json_fn)
+        if registros is not None:
+            extraidos.append((key, registros))
+    return extraidos
 
-            if isinstance(data, dict):
-                batch.append(data)
-            else:
-                batch.extend(data)
 
-        # SUBSTITUIR esta linha:
-        # logging.info(f"📦 Lote {idx+1}/{(total + lote_size -1)//lote_size}: {len(batch)} items")
+def extrair_registros_grupo(
+    tipos: List[str],
+    codigos: List[Any],
+    fetch_json_fn: Callable[[Any, str], str] = snk_fetch_json,
+    clean_json_fn: Optional[Callable[[str], str]] = None,
+    fetch_multi_fn: Callable[[List, List[str]], Dict[str, Dict[Any, str]]] = snk_fetch_json_multi
+) -> Dict[str, List[ItemExtraido]]:
+    """
+    Extrai vários tipos da mesma tabela numa passada só: uma consulta por bloco
+    traz uma coluna CC_CS_JSON_X por tipo (fetch_multi_fn), e cada tipo é
+    decodificado como em extrair_registros, com fallback individual.
+    Retorna {tipo: [(codigo, registros)]}.
+    """
+    prefetched: Dict[str, Dict[Any, str]] = {}
+    try:
+        prefetched = fetch_multi_fn(codigos, tipos)
+    except Exception as e:
+        logging.warning(f"⚠️ Falha na busca conjunta de {'+'.join(tipos)}: {e}")
 
-        # POR esta:
-        logging.info(
-            f"📦 Lote {idx + 1}/{(total + lote_size - 1) // lote_size}: "
-            f"{len(lote)} códigos → {len(batch)} registros JSON"
+    return {
+        tipo: extrair_registros(
+            tipo,
+            codigos,
+            fetch_json_fn=fetch_json_fn,
+            clean_json_fn=clean_json_fn,
+            fetch_lote_fn=lambda _codigos, _tipo, m=prefetched.get(tipo, {}): m
         )
+        for tipo in tipos
+    }
 
-        resp = cs_client.send(batch, tipo)
-        logging.debug(f"↩️ Resposta CS (lote {idx + 1}): {resp}")
 
-    # Paraleliza os lotes
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(_worker, lote, i)
-            for i, lote in enumerate(chunked(registros, lote_size))
-        ]
-        for f in as_completed(futures):
-            if exc := f.exception():
-                logging.error(f"❌ Erro em lote: {exc}")
+def grupos_extracao(tipos: List[str]) -> List[List[str]]:
+    """Agrupa os tipos que saem da mesma tabela e chave (util_query_key)."""
+    grupos: Dict[Tuple[str, str], List[str]] = {}
+    for tipo in tipos:
+        grupos.setdefault(util_query_key(tipo), []).append(tipo)
+    return list(grupos.values())
 
-    elapsed = time.time() - start
-    mins, secs = divmod(int(elapsed), 60)
-    logging.info(f"🏁 '{tipo}' completo em {mins}m{secs:02d}s")
 
+def parse_registros(
+    tipo: str,
+    key: Any,
+    raw: Optional[str],
+    clean_json_fn: Optional[Callable[[str], str]] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Decodifica os registros do texto de um código numa passada (util_iter_json),
+    depois de clean_json_fn, se houver; None se o JSON for inválido ou ausente
+    (busca que falhou), para o código ir à fila de retentativas. O texto vazio
+    de um código sem payload é tratado antes, em extrair_registros.
+    """
+    inicio = time.perf_counter()
+    try:
+        if raw is None or not raw.strip():
+            raise json.JSONDecodeError("JSON ausente ou vazio", raw or "", 0)
+        raw = clean_json_fn(raw) if clean_json_fn else raw
+        return list(util_iter_json(raw))
+    except json.JSONDecodeError as e:
+        metricas.incr("json_invalido_total", tipo=tipo)
+        logging.warning(f"⚠️ JSON inválido em {tipo}='{key}': {e}")
+        return None
+    finally:
+        metricas.observar("json_parse_segundos", time.perf_counter() - inicio, tipo=tipo)
 
-def cs_processar_envio_parceiro(
-    sql: str,
-    tamanho_lote: int = 100,
-    max_workers: int = 5
-):
+
+def orcamento_bisseccao(total: int) -> int:
+    """POSTs extras para isolar CS_BISSECCAO_RECUSAS registros num lote de `total`: 2*ceil(log2(total)) cada."""
+    if total < 2:
+        return 0
+    return 2 * math.ceil(math.log2(total)) * CS_BISSECCAO_RECUSAS
+
+
+def _bisseccionavel(resultado: ResultadoCS) -> bool:
+    """Recusa do lote inteiro que pode vir de um registro ruim (ver STATUS_BISSECCAO)."""
+    return resultado.status is not None and (resultado.status < 300 or resultado.status in STATUS_BISSECCAO)
+
+
+def _transitorio(mensagem: str) -> bool:
+    mensagem = mensagem.lower()
+    return any(t in mensagem for t in CS_ERROS_TRANSITORIOS)
+
+
+def _bissectar(
+    cs_client: CSClient,
+    registros: List[Dict[str, Any]],
+    tipo: str,
+    falha: ResultadoCS,
+    orcamento: List[int]
+) -> ResultadoCS:
+    """Reenvia as duas metades de um lote recusado por inteiro e junta os resultados."""
+    meio = len(registros) // 2
+    metades = (registros[:meio], registros[meio:])
+    orcamento[0] -= 2
+    metricas.incr("cs_bisseccoes_total", endpoint=util_cs_enpoint(tipo))
+    logging.warning(
+        f"✂️ Lote de '{tipo}' recusado por inteiro (HTTP {falha.status}): "
+        f"reenviando {len(registros)} registros em metades de {meio} e {len(registros) - meio}"
+    )
+    parciais = [cs_client.send(metade, tipo) for metade in metades]
+
+    combinado = ResultadoCS(len(registros), resposta=falha.resposta, status=falha.status)
+    inicio = 0
+    for metade, parcial in zip(metades, parciais):
+        parcial = enviar_registros(cs_client, metade, tipo, _orcamento=orcamento, _resultado=parcial)
+        for i in range(len(metade)):
+            if parcial.erro is not None:
+                combinado.rejeitados[inicio + i] = parcial.erro
+            elif i in parcial.rejeitados:
+                combinado.rejeitados[inicio + i] = parcial.rejeitados[i]
+        inicio += len(metade)
+    return combinado
+
+
+def enviar_registros(
+    cs_client: CSClient,
+    registros: List[Dict[str, Any]],
+    tipo: str,
+    _orcamento: Optional[List[int]] = None,
+    _resultado: Optional[ResultadoCS] = None
+) -> ResultadoCS:
     """
-    Processa os parceiros em lotes, limpando os colchetes
-    extraídos via snk_fetch_json.
+    Envia registros à CS e resolve o resultado de cada um:
+    - lote recusado por inteiro pelo conteúdo, sem retorno por registro
+      (HTTP 400/422 ou Sucesso=false): é dividido ao meio e as metades
+      reenviadas até isolar os registros recusados, com até
+      orcamento_bisseccao(len(registros)) POSTs extras;
+    - registros recusados por erro transitório (CS_ERROS_TRANSITORIOS) são
+      reenviados sem os demais, até CS_RETENTATIVAS_REGISTRO vezes.
     """
-    cs = CSClient()
-    process_lotes(
-        tipo="parceiro",
-        sql=sql,
+    orcamento = _orcamento if _orcamento is not None else [orcamento_bisseccao(len(registros))]
+    resultado = _resultado or cs_client.send(registros, tipo)
+
+    if resultado.erro is not None:
+        if len(registros) > 1 and orcamento[0] >= 2 and _bisseccionavel(resultado):
+            return _bissectar(cs_client, registros, tipo, resultado, orcamento)
+        return resultado
+
+    for _ in range(CS_RETENTATIVAS_REGISTRO):
+        transitorios = [i for i, mensagem in resultado.rejeitados.items() if _transitorio(mensagem)]
+        if not transitorios:
+            break
+        metricas.incr("cs_registros_retentados_total", len(transitorios), endpoint=util_cs_enpoint(tipo))
+        logging.info(f"🔁 Reenviando {len(transitorios)} registro(s) de '{tipo}' recusados por erro transitório")
+        parcial = cs_client.send([registros[i] for i in transitorios], tipo)
+        for j, i in enumerate(transitorios):
+            if parcial.erro is not None:
+                resultado.rejeitados[i] = parcial.erro
+            elif j in parcial.rejeitados:
+                resultado.rejeitados[i] = parcial.rejeitados[j]
+            else:
+                del resultado.rejeitados[i]
+        if parcial.erro is not None:
+            break
+    return resultado
+
+
+def enviar_lote(cs_client: CSClient, lote: LoteCS) -> bool:
+    """
+    Envia um lote montado pelo pipeline; True se a CS processou o lote.
+    Registros recusados individualmente ficam em lote.recusados.
+    """
+    resultado = enviar_registros(cs_client, lote.registros, lote.tipo)
+    # Formatação adiada: a resposta inteira só vira texto se o DEBUG estiver ligado
+    logging.debug("↩️ Resposta CS (lote %s de '%s'): %s", lote.numero, lote.tipo, resultado.resposta)
+    if resultado.erro is not None:
+        lote.erro = resultado.erro
+        return False
+    lote.recusados = resultado.rejeitados
+    return True
+
+
+def criar_pipeline(
+    *,
+    nome: str,
+    tipos: List[str],
+    cs_client: CSClient,
+    lote_size: int = 100,
+    extract_workers: int = 5,
+    send_workers: int = 5,
+    fetch_json_fn: Callable[[Any, str], str] = snk_fetch_json,
+    clean_json_fn: Optional[Callable[[str], str]] = None,
+    fetch_lote_fn: Optional[Callable[[List, str], Dict[Any, str]]] = snk_fetch_json_lote,
+    filtros: Optional[List[Any]] = None,
+    checkpoint: Optional[Any] = None,
+    fila_retry: Optional[Any] = None,
+    orcamento: Optional[str] = None
+) -> Pipeline:
+    """
+    Monta o pipeline Sankhya → CS para os tipos informados.
+    clean_json_fn é opcional: o texto de CC_CS_JSON_* é lido direto por util_iter_json.
+    extract_workers/send_workers são os limites iniciais dos limitadores
+    adaptativos de Sankhya e CS; cada estágio recebe threads até o máximo
+    do limitador, e o limite atual decide quantas requisições andam juntas.
+    Com SNK_EXTRACAO_CONJUNTA e a busca em lote padrão, tipos da mesma tabela
+    (produto e estoque) são extraídos juntos, uma consulta por bloco de códigos.
+    Com `orcamento` (ex.: 'estoque'), extração e envio usam limitadores próprios
+    ('sankhya:estoque', 'cs:estoque'), sem disputar vagas com outros pipelines
+    do processo; a listagem de páginas segue no limitador do host.
+    """
+    sufixo = f":{orcamento}" if orcamento else ""
+    snk_limiter = get_limiter(f"sankhya{sufixo}", extract_workers)
+    cs_limiter = get_limiter(f"cs{sufixo}", send_workers)
+
+    def _extrair(tipo: str, codigos: List[Any]) -> List[ItemExtraido]:
+        with orcamento_limites(orcamento):
+            return extrair_registros(
+                tipo,
+                codigos,
+                fetch_json_fn=fetch_json_fn,
+                clean_json_fn=clean_json_fn,
+                fetch_lote_fn=fetch_lote_fn
+            )
+
+    def _extrair_grupo(tipos_grupo: List[str], codigos: List[Any]) -> Dict[str, List[ItemExtraido]]:
+        with orcamento_limites(orcamento):
+            return extrair_registros_grupo(
+                tipos_grupo,
+                codigos,
+                fetch_json_fn=fetch_json_fn,
+                clean_json_fn=clean_json_fn
+            )
+
+    def _enviar(lote: LoteCS) -> bool:
+        with orcamento_limites(orcamento):
+            return enviar_lote(cs_client, lote)
+
+    conjunta = SNK_EXTRACAO_CONJUNTA and fetch_lote_fn is snk_fetch_json_lote
+
+    return Pipeline(
+        nome=nome,
+        tipos=tipos,
+        extrair_fn=_extrair,
+        extrair_grupo_fn=_extrair_grupo if conjunta else None,
+        grupos=grupos_extracao(tipos) if conjunta else None,
+        enviar_fn=_enviar,
+        lote_size=lote_size,
+        extract_workers=snk_limiter.maximo,
+        send_workers=cs_limiter.maximo,
+        filtros=filtros,
+        limiters={"sankhya": snk_limiter, "cs": cs_limiter},
+        checkpoint=checkpoint,
+        fila_retry=fila_retry
+    )
+
+
+def process_codigos(
+    *,
+    tipo: str,
+    codigos: Iterable[Any],
+    fetch_json_fn: Callable[[Any, str], str],
+    clean_json_fn: Optional[Callable[[str], str]],
+    cs_client: CSClient,
+    lote_size: int = 100,
+    max_workers: int = 5,
+    fetch_lote_fn: Optional[Callable[[List, str], Dict[Any, str]]] = snk_fetch_json_lote
+) -> Dict[str, int]:
+    """
+    Extrai o JSON de cada lote de códigos já conhecidos e envia à CS,
+    rodando uma única página pelo pipeline.
+    """
+    codigos = list(codigos)
+    logging.info(f"🔢 {len(codigos)} registros para '{tipo}', em lotes de {lote_size}")
+
+    pipeline = criar_pipeline(
+        nome=tipo,
+        tipos=[tipo],
+        cs_client=cs_client,
+        lote_size=lote_size,
+        extract_workers=max_workers,
+        send_workers=max_workers,
+        fetch_json_fn=fetch_json_fn,
+        clean_json_fn=clean_json_fn,
+        fetch_lote_fn=fetch_lote_fn
+    )
+    return pipeline.run([codigos])
+
+
+def _processar_envio(
+    tipo: str,
+    sql: Optional[str],
+    codigos: Optional[Iterable[Any]],
+    tamanho_lote: int,
+    max_workers: int
+) -> None:
+    """Encaminha para process_codigos quando os códigos já vêm prontos, senão para process_lotes."""
+    cs = get_cs_client()
+    kwargs = dict(
+        tipo=tipo,
         fetch_json_fn=snk_fetch_json,
-        clean_json_fn=util_remove_brackets,
+        clean_json_fn=None,
         cs_client=cs,
         lote_size=tamanho_lote,
         max_workers=max_workers
     )
+    if codigos is not None:
+        process_codigos(codigos=codigos, **kwargs)
+    else:
+        process_lotes(sql=sql, **kwargs)
+
+
+def cs_processar_envio_parceiro(
+    sql: Optional[str] = None,
+    tamanho_lote: int = 100,
+    max_workers: int = 5,
+    codigos: Optional[Iterable[Any]] = None
+):
+    """
+    Envia os parceiros à CS pelo pipeline: JSON extraído em lote
+    (snk_fetch_json_lote, com fallback por código) e lido direto por
+    util_iter_json. Aceita a query dos códigos ou a lista de códigos já buscada.
+    """
+    _processar_envio("parceiro", sql, codigos, tamanho_lote, max_workers)
 
 
 def cs_processar_envio_generico(
     tipo: str,
-    sql: str,
+    sql: Optional[str] = None,
     tamanho_lote: int = 100,
-    max_workers: int = 5
+    max_workers: int = 5,
+    codigos: Optional[Iterable[Any]] = None
 ):
     """
-    Processa qualquer tipo genérico, encapsulando em lista JSON válida.
+    Envia qualquer tipo à CS pelo mesmo pipeline de cs_processar_envio_parceiro;
+    os registros de cada código (um objeto, uma lista ou objetos seguidos) são
+    separados por util_iter_json. Aceita a query dos códigos ou a lista de
+    códigos já buscada.
     """
-    cs = CSClient()
-    process_lotes(
-        tipo=tipo,
-        sql=sql,
-        fetch_json_fn=snk_fetch_json,
-        clean_json_fn=lambda raw: f"[{raw}]".replace("}{", "},{"),
-        cs_client=cs,
-        lote_size=tamanho_lote,
-        max_workers=max_workers
-    )
+    _processar_envio(tipo, sql, codigos, tamanho_lote, max_workers)
@@ -0,0 +1,223 @@
+"""
+Limite adaptativo de requisições simultâneas por host (AIMD).
+
+Cada host (Sankhya, CS) tem um AdaptiveLimiter. Toda requisição HTTP ocupa
+uma vaga enquanto está em andamento:
+
+- a cada janela de `limite` respostas saudáveis (sem erro e com latência
+  média até `tolerancia` vezes a latência de base), o limite sobe 1;
+- timeout, HTTP 429 ou 5xx cortam o limite pela metade, no máximo uma vez
+  por janela (erros de requisições iniciadas antes do corte são ignorados);
+- latência média acima da tolerância reduz o limite em 25%.
+
+Os workers do pipeline são dimensionados pelo máximo; quem controla quantas
+requisições ficam de fato em andamento é o limite atual. Cada mudança de
+limite é registrada no log com o motivo.
+
+Um fluxo com orçamento próprio (ex.: a faixa de estoque do daemon, que roda
+junto com produtos) usa limitadores separados, 'cs:estoque' e
+'sankhya:estoque': as requisições feitas dentro de orcamento_limites('estoque')
+ocupam vagas só deles.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from metricas import metricas
+
+
+class SlotRequisicao:
+    """Vaga ocupada por uma requisição; o chamador informa o status HTTP."""
+
+    def __init__(self, geracao: int):
+        self.geracao = geracao
+        self.erro: Optional[str] = None
+
+    def status(self, status_code: int) -> None:
+        if status_code == 429:
+            self.erro = "HTTP 429"
+        elif status_code >= 500:
+            self.erro = f"HTTP {status_code}"
+
+
+class AdaptiveLimiter:
+    """Limitador AIMD de requisições simultâneas."""
+
+    def __init__(
+        self,
+        nome: str,
+        inicial: int,
+        minimo: int = 1,
+        maximo: int = 50,
+        tolerancia: float = 2.0
+    ):
+        self.nome = nome
+        self.minimo = max(1, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.tolerancia = tolerancia
+        self._limite = min(max(inicial, self.minimo), self.maximo)
+        self._em_uso = 0
+        self._cond = threading.Condition()
+        self._geracao = 0
+        self._janela_n = 0
+        self._janela_latencia = 0.0
+        self._janela_erros = 0
+        self._latencia_base: Optional[float] = None
+        metricas.definir("limite_requisicoes", self._limite, host=nome)
+
+    @property
+    def limite(self) -> int:
+        return self._limite
+
+    @property
+    def em_uso(self) -> int:
+        return self._em_uso
+
+    def _mudar(self, novo: int, motivo: str) -> None:
+        novo = min(max(novo, self.minimo), self.maximo)
+        if novo != self._limite:
+            logging.info(f"🎚️ Limite '{self.nome}': {self._limite} → {novo} ({motivo})")
+            self._limite = novo
+            self._cond.notify_all()
+            metricas.definir("limite_requisicoes", novo, host=self.nome)
+        self._geracao += 1
+        self._janela_n = 0
+        self._janela_latencia = 0.0
+        self._janela_erros = 0
+
+    def acquire(self) -> SlotRequisicao:
+        with self._cond:
+            while self._em_uso >= self._limite:
+                self._cond.wait()
+            self._em_uso += 1
+            return SlotRequisicao(self._geracao)
+
+    async def acquire_async(self) -> SlotRequisicao:
+        """Como acquire, sem bloquear o event loop: aguarda a vaga em intervalos crescentes."""
+        espera = 0.005
+        while True:
+            with self._cond:
+                if self._em_uso < self._limite:
+                    self._em_uso += 1
+                    return SlotRequisicao(self._geracao)
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, 0.1)
+
+    def release(self, slot: SlotRequisicao, latencia: float) -> None:
+        with self._cond:
+            self._em_uso -= 1
+            self._cond.notify()
+
+            if slot.erro:
+                self._janela_erros += 1
+                # Um único corte por janela: erros de antes do corte não contam de novo
+                if slot.geracao == self._geracao:
+                    self._mudar(self._limite // 2, f"{slot.erro}, corte pela metade")
+                return
+
+            self._janela_n += 1
+            self._janela_latencia += latencia
+            if self._janela_n < max(self._limite, 5):
+                return
+
+            media = self._janela_latencia / self._janela_n
+            if self._latencia_base is None or media < self._latencia_base:
+                self._latencia_base = media
+            else:
+                # Deixa a base acompanhar mudanças lentas do servidor
+                self._latencia_base *= 1.05
+
+            if media > self.tolerancia * self._latencia_base:
+                self._mudar(
+                    int(self._limite * 0.75),
+                    f"latência média {media:.2f}s > {self.tolerancia:.1f}x base {self._latencia_base:.2f}s"
+                )
+            elif self._janela_erros == 0 and self._limite < self.maximo:
+                self._mudar(self._limite + 1, f"saudável, latência média {media:.2f}s")
+            else:
+                self._mudar(self._limite, "janela com erros, limite mantido")
+
+    @contextmanager
+    def slot(self) -> Iterator[SlotRequisicao]:
+        """Ocupa uma vaga durante a requisição; exceções de timeout/conexão contam como erro."""
+        vaga = self.acquire()
+        metricas.gauge("requisicoes_em_andamento", 1, host=self.nome)
+        inicio = time.perf_counter()
+        try:
+            yield vaga
+        except Exception as e:
+            if vaga.erro is None:
+                vaga.erro = "timeout" if "timeout" in type(e).__name__.lower() else type(e).__name__
+            raise
+        finally:
+            metricas.gauge("requisicoes_em_andamento", -1, host=self.nome)
+            self.release(vaga, time.perf_counter() - inicio)
+
+    @asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[SlotRequisicao]:
+        """slot() para o transporte assíncrono: mesmas vagas, métricas e tratamento de erro."""
+        vaga = await self.acquire_async()
+        metricas.gauge("requisicoes_em_andamento", 1, host=self.nome)
+        inicio = time.perf_counter()
+        try:
+            yield vaga
+        except Exception as e:
+            if vaga.erro is None:
+                vaga.erro = "timeout" if "timeout" in type(e).__name__.lower() else type(e).__name__
+            raise
+        finally:
+            metricas.gauge("requisicoes_em_andamento", -1, host=self.nome)
+            self.release(vaga, time.perf_counter() - inicio)
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+# Orçamento do thread atual (ver orcamento_limites)
+_orcamento = threading.local()
+
+# Configuração por host: (variável de prefixo, limite inicial, máximo padrão)
+_CONFIG = {
+    "sankhya": ("SNK", 10, 50),
+    "cs": ("CS", 5, 50),
+}
+
+
+def get_limiter(nome: str, inicial: Optional[int] = None) -> AdaptiveLimiter:
+    """
+    Limitador compartilhado de um host ('sankhya' ou 'cs') ou de um orçamento
+    próprio dentro dele ('cs:estoque'), com vagas e limite independentes.
+    `inicial` só vale na criação; depois o limite aprendido é mantido.
+    Variáveis (valem também para os orçamentos do host):
+    {SNK,CS}_LIMITE_INICIAL, {SNK,CS}_LIMITE_MIN, {SNK,CS}_LIMITE_MAX.
+    """
+    with _limiters_lock:
+        if nome not in _limiters:
+            prefixo, padrao_inicial, padrao_max = _CONFIG[nome.split(":", 1)[0]]
+            _limiters[nome] = AdaptiveLimiter(
+                nome,
+                inicial=inicial or int(os.getenv(f"{prefixo}_LIMITE_INICIAL", str(padrao_inicial))),
+                minimo=int(os.getenv(f"{prefixo}_LIMITE_MIN", "1")),
+                maximo=int(os.getenv(f"{prefixo}_LIMITE_MAX", str(padrao_max)))
+            )
+        return _limiters[nome]
+
+
+@contextmanager
+def orcamento_limites(orcamento: Optional[str]) -> Iterator[None]:
+    """Dentro do bloco, as requisições do thread usam os limitadores 'host:orcamento'."""
+    anterior = getattr(_orcamento, "nome", None)
+    _orcamento.nome = orcamento
+    try:
+        yield
+    finally:
+        _orcamento.nome = anterior
+
+
+def limiter_atual(host: str) -> AdaptiveLimiter:
+    """Limitador do host no orçamento do thread atual (o do host, fora de orcamento_limites)."""
+    orcamento = getattr(_orcamento, "nome", None)
+    return get_limiter(f"{host}:{orcamento}" if orcamento else host)
@@ -1,126 +1,146 @@
 import argparse
+import os
 import time
 import logging
-import re
+from typing import Dict, Optional, Tuple
 
-from processamentos import processar_parceiros, processar_produtos
+from consultas import CONSULTA_ESTOQUE, CONSULTA_PARCEIROS, CONSULTA_PRODUTOS, JanelaTempo
+from estado import WatermarkStore
+from pipeline import execucao_confirmada
+from processamentos import processar_estoque, processar_parceiros, processar_produtos
+from sankhya_api.sankhya_fetch import snk_fetch_data
 from utils import logging_config
-from telegram_notification import enviar_notificacao_telegram
+from telegram_notification import flush_notificacoes, notificar
 
 logging_config()
 
+# Concorrência da faixa de estoque, separada da do ciclo de produtos
+ESTOQUE_WORKERS = int(os.getenv("ESTOQUE_WORKERS", "8"))
+ESTOQUE_EXTRACT_WORKERS = int(os.getenv("ESTOQUE_EXTRACT_WORKERS", str(ESTOQUE_WORKERS)))
+ESTOQUE_SEND_WORKERS = int(os.getenv("ESTOQUE_SEND_WORKERS", "4"))
 
-def build_time_window_sql(query: str, tempo: int) -> str:
+# Sobreposição de cada janela com a anterior (ver JanelaTempo)
+JANELA_MARGEM_SEGUNDOS = int(os.getenv("JANELA_MARGEM_SEGUNDOS", "300"))
+
+
+def agora_sankhya() -> str:
+    """Data/hora atual do servidor Sankhya, em ISO 8601 (independe de DATEFORMAT)."""
+    rows = snk_fetch_data("SELECT CONVERT(VARCHAR(23), GETDATE(), 126)")
+    return rows[0][0]
+
+
+def gerar_query_parceiros(tempo: int, janela: Optional[JanelaTempo] = None) -> str:
     """
-    Adiciona filtro de janela de tempo em minutos à query base,
-    posicionando o WHERE antes do ORDER BY (se houver) e evitando typos.
+    Retorna a query de códigos de parceiros alterados na janela
+    (padrão: últimos `tempo` minutos).
     """
-    time_filter = f"DTALTER >= DATEADD(MINUTE, -{tempo}, GETDATE())"
-
-    # procura por ORDER BY
-    order_by_match = re.search(r'\bORDER\s+BY\b', query, flags=re.IGNORECASE)
-    if order_by_match:
-        idx = order_by_match.start()
-        before = query[:idx].rstrip()
-        after = query[idx:].lstrip()
-
-        # se já existe WHERE, insere AND; senão, adiciona WHERE
-        if re.search(r'\bWHERE\b', before, flags=re.IGNORECASE):
-            before = re.sub(
-                r'\bWHERE\b',
-                f"WHERE {time_filter} AND",
-                before,
-                count=1,
-                flags=re.IGNORECASE
-            )
-        else:
-            before = f"{before} WHERE {time_filter}"
-
-        return f"{before} {after}"
-
-    # não há ORDER BY
-    if re.search(r'\bWHERE\b', query, flags=re.IGNORECASE):
-        return re.sub(
-            r'\bWHERE\b',
-            f"WHERE {time_filter} AND",
-            query,
-            count=1,
-            flags=re.IGNORECASE
-        )
+    return CONSULTA_PARCEIROS.sql(janela or JanelaTempo(tempo))
 
-    return f"{query.rstrip()} WHERE {time_filter}"
 
+def gerar_query_produtos(tempo: int, janela: Optional[JanelaTempo] = None) -> str:
+    """
+    Retorna a query de códigos de produtos alterados na janela: cadastro,
+    itens de notas alteradas e exclusões de estoque, com a janela em cada ramo.
+    """
+    return CONSULTA_PRODUTOS.sql(janela or JanelaTempo(tempo))
 
-def gerar_query_parceiros(tempo: int) -> tuple[str, str]:
+
+def gerar_query_estoque(tempo: int, janela: Optional[JanelaTempo] = None) -> str:
     """
-    Retorna tupla (query_total, query_detalhe) para parceiros filtrados por tempo.
+    Retorna a query dos produtos com movimentação de estoque recente: itens de
+    notas alteradas (TGFCAB/TGFITE) e exclusões registradas em TSILGT (TGFEXC).
     """
-    base_total = "SELECT COUNT(CODPARC) AS TOTAL FROM TGFPAR"
-    base_detalhe = "SELECT CODPARC FROM TGFPAR ORDER BY CODPARC"
-    return (
-        build_time_window_sql(base_total, tempo),
-        build_time_window_sql(base_detalhe, tempo)
-    )
+    return CONSULTA_ESTOQUE.sql(janela or JanelaTempo(tempo))
 
 
-def gerar_query_produtos(tempo: int) -> tuple[str, str]:
+def _abrir_watermark(usar_watermark: bool, tempo: int) -> Tuple[Optional[WatermarkStore], Optional[str]]:
+    """Store de watermark e horário atual do Sankhya; (None, None) para usar só a janela de minutos."""
+    if not usar_watermark:
+        return None, None
+    try:
+        return WatermarkStore(), agora_sankhya()
+    except Exception as e:
+        logging.error(f"❌ Watermark indisponível, usando janela de {tempo}m: {e}")
+        return None, None
+
+
+def _processar_entidade(
+    entidade: str,
+    gerar_query,
+    processar,
+    estado: Optional[WatermarkStore],
+    ate: Optional[str],
+    tempo: int,
+    **kwargs
+) -> Dict[str, int]:
     """
-    Retorna tupla (query_total, query_detalhe) para produtos filtrados por tempo.
+    Processa uma entidade na janela do watermark (ou dos últimos `tempo` minutos),
+    recuando JANELA_MARGEM_SEGUNDOS antes do watermark.
+    O watermark avança quando a execução termina e cada código foi confirmado
+    pela CS ou guardado na fila de retentativas; uma execução interrompida ou
+    com falha na listagem o mantém (ver execucao_confirmada).
+    Retorna os contadores da execução.
     """
-    total_sql = (
-        "SELECT COUNT(CODPROD) AS TOTAL FROM ("
-        "    SELECT CODPROD FROM TGFPRO "
-        "    UNION "
-        "    SELECT CODPROD FROM TGFITE ITE INNER JOIN TGFCAB CAB ON ITE.NUNOTA = CAB.NUNOTA "
-        "    UNION "
-        "    SELECT LTRIM(SUBSTRING(CHAVE, CHARINDEX('CODPROD=', CHAVE)+8,"
-        "           CHARINDEX('CODLOCAL=', CHAVE)-(CHARINDEX('CODPROD=', CHAVE)+8))) AS CODPROD "
-        "    FROM TSILGT WHERE NOMETAB='TGFEXC'"
-        ") AS P"
-    )
-    detalhe_sql = (
-        "SELECT CODPROD FROM TGFPRO "
-        "UNION "
-        "SELECT CODPROD FROM TGFITE ITE INNER JOIN TGFCAB CAB ON ITE.NUNOTA = CAB.NUNOTA "
-        "UNION "
-        "SELECT LTRIM(SUBSTRING(CHAVE, CHARINDEX('CODPROD=', CHAVE)+8,"
-        "           CHARINDEX('CODLOCAL=', CHAVE)-(CHARINDEX('CODPROD=', CHAVE)+8))) AS CODPROD "
-        "FROM TSILGT WHERE NOMETAB='TGFEXC' "
-        "ORDER BY CODPROD"
-    )
-    return (
-        build_time_window_sql(total_sql, tempo),
-        build_time_window_sql(detalhe_sql, tempo)
-    )
+    janela = None
+    if estado:
+        desde = estado.get(entidade)
+        janela = JanelaTempo(tempo, desde, ate, JANELA_MARGEM_SEGUNDOS)
+        inicio = f"{desde} - {JANELA_MARGEM_SEGUNDOS}s" if desde else f"últimos {tempo}m"
+        logging.info(f"🕒 Janela de '{entidade}': ({inicio}, {ate}]")
+
+    detalhe_sql = gerar_query(tempo, janela)
+    logging.debug(f"SQL Detalhe {entidade}: {detalhe_sql}")
+    resumo = processar(query_base=detalhe_sql, **kwargs)
+
+    if estado:
+        if execucao_confirmada(resumo):
+            estado.set(entidade, ate)
+        else:
+            logging.warning(
+                f"⚠️ Watermark de '{entidade}' mantido: execução incompleta ou com falhas não guardadas {resumo}"
+            )
+    return resumo
 
 
 def envio_fragmentado(
     step: int,
     lote: int,
     workers: int,
-    tempo: int
+    tempo: int,
+    extract_workers: int = None,
+    send_workers: int = None,
+    usar_watermark: bool = True,
+    forcar: bool = False
 ) -> None:
     """
-    Executa o processamento fragmentado de parceiros e produtos
-    dentro de uma janela de tempo especificada.
+    Executa o processamento fragmentado de parceiros e produtos pelo pipeline
+    (extract_workers/send_workers são os limites iniciais de Sankhya e CS; padrão: workers).
+    Com usar_watermark, cada entidade segue do último DTALTER confirmado
+    até o horário atual do Sankhya; senão, usa os últimos `tempo` minutos.
+    forcar=True ignora o cache de payloads e reenvia tudo o que mudou na janela.
     """
     start = time.perf_counter()
     msg = f"🚀 Início envio fragmentado últimos {tempo}m"
     logging.info(msg)
-    enviar_notificacao_telegram(msg)
+    notificar(msg)
+
+    estado, ate = _abrir_watermark(usar_watermark, tempo)
+
+    kwargs = dict(
+        step=step,
+        lote=lote,
+        workers=workers,
+        extract_workers=extract_workers,
+        send_workers=send_workers,
+        forcar=forcar
+    )
 
     # Processa parceiros
-    total_sql, detalhe_sql = gerar_query_parceiros(tempo)
-    logging.debug(f"SQL Total Parceiros: {total_sql}")
-    logging.debug(f"SQL Detalhe Parceiros: {detalhe_sql}")
-    processar_parceiros(step, lote, workers, total_sql, detalhe_sql)
+    _processar_entidade("parceiro", gerar_query_parceiros, processar_parceiros, estado, ate, tempo, **kwargs)
     logging.info("✅ Parceiros fragmentados completos")
 
     # Processa produtos
-    total_sql, detalhe_sql = gerar_query_produtos(tempo)
-    logging.debug(f"SQL Total Produtos: {total_sql}")
-    logging.debug(f"SQL Detalhe Produtos: {detalhe_sql}")
-    processar_produtos(step, lote, workers, total_sql, detalhe_sql)
+    _processar_entidade("produto", gerar_query_produtos, processar_produtos, estado, ate, tempo, **kwargs)
     logging.info("✅ Produtos fragmentados completos")
 
     # Tempo total
@@ -128,19 +148,122 @@ def envio_fragmentado(
     mins, secs = divmod(int(elapsed), 60)
     msg = f"🏁 Fragmentado concluído em {mins}m{secs:02d}s"
     logging.info(msg)
-    enviar_notificacao_telegram(msg)
+    notificar(msg)
+    flush_notificacoes()
+
+
+# entidade -> (query da janela de alterações, processamento)
+ENTIDADES_INCREMENTAIS = {
+    "parceiro": (gerar_query_parceiros, processar_parceiros),
+    "produto": (gerar_query_produtos, processar_produtos),
+    "estoque": (gerar_query_estoque, processar_estoque),
+}
+
+
+def envio_entidade(
+    entidade: str,
+    step: int,
+    lote: int,
+    workers: int,
+    tempo: int,
+    extract_workers: int = None,
+    send_workers: int = None,
+    usar_watermark: bool = True,
+    forcar: bool = False
+) -> Dict[str, int]:
+    """
+    Envio incremental de uma única entidade (parceiro, produto ou estoque)
+    pela janela do seu watermark. Retorna os contadores da execução.
+    """
+    gerar_query, processar = ENTIDADES_INCREMENTAIS[entidade]
+    estado, ate = _abrir_watermark(usar_watermark, tempo)
+    return _processar_entidade(
+        entidade, gerar_query, processar, estado, ate, tempo,
+        step=step,
+        lote=lote,
+        workers=workers,
+        extract_workers=extract_workers,
+        send_workers=send_workers,
+        forcar=forcar
+    )
+
+
+def envio_estoque(
+    step: int,
+    lote: int,
+    tempo: int,
+    workers: int = ESTOQUE_WORKERS,
+    extract_workers: int = ESTOQUE_EXTRACT_WORKERS,
+    send_workers: int = ESTOQUE_SEND_WORKERS,
+    usar_watermark: bool = True,
+    forcar: bool = False
+) -> None:
+    """
+    Faixa rápida só de estoque, para rodar a cada 1-2 minutos: envia apenas
+    Saldos_Atualiza dos produtos com movimentação recente, sem ProdutoUpdate.
+    Tem watermark próprio ('estoque') e concorrência própria (ESTOQUE_*),
+    independentes do ciclo de produtos. Não notifica o Telegram a cada rodada.
+    """
+    start = time.perf_counter()
+    logging.info(f"🚀 Início envio de estoque últimos {tempo}m")
+
+    envio_entidade(
+        "estoque", step, lote, workers, tempo,
+        extract_workers=extract_workers,
+        send_workers=send_workers,
+        usar_watermark=usar_watermark,
+        forcar=forcar
+    )
+
+    elapsed = time.perf_counter() - start
+    mins, secs = divmod(int(elapsed), 60)
+    logging.info(f"🏁 Estoque concluído em {mins}m{secs:02d}s")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--step", type=int, default=100)
     parser.add_argument("--lote", type=int, default=100)
-    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None, help="padrão: 20 (ESTOQUE_WORKERS com --estoque)")
     parser.add_argument("--tempo", type=int, default=15)
+    parser.add_argument("--extract-workers", type=int, default=None)
+    parser.add_argument("--send-workers", type=int, default=None)
+    parser.add_argument(
+        "--sem-watermark",
+        action="store_true",
+        help="ignora o watermark salvo e usa apenas a janela de --tempo minutos"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="envia mesmo os registros cujo payload não mudou desde o último envio"
+    )
+    parser.add_argument(
+        "--estoque",
+        action="store_true",
+        help="envia só os saldos (Saldos_Atualiza) dos produtos com movimentação recente"
+    )
     args = parser.parse_args()
 
-    envio_fragmentado(
-        step=args.step,
-        lote=args.lote,
-        workers=args.workers,
-        tempo=args.tempo
-    )
+    if args.estoque:
+        envio_estoque(
+            step=args.step,
+            lote=args.lote,
+            tempo=args.tempo,
+            workers=args.workers or ESTOQUE_WORKERS,
+            extract_workers=args.extract_workers or ESTOQUE_EXTRACT_WORKERS,
+            send_workers=args.send_workers or ESTOQUE_SEND_WORKERS,
+            usar_watermark=not args.sem_watermark,
+            forcar=args.force
+        )
+    else:
+        envio_fragmentado(
+            step=args.step,
+            lote=args.lote,
+            workers=args.workers or 20,
+            tempo=args.tempo,
+            extract_workers=args.extract_workers,
+            send_workers=args.send_workers,
+            usar_watermark=not args.sem_watermark,
+            forcar=args.force
+        )
@@ -0,0 +1,212 @@
+"""
+Métricas de execução: contadores, histogramas de latência e gauges.
+
+Os valores ficam em memória no processo, identificados por nome + labels
+(ex.: etapa, tipo, endpoint). Cada operação é um incremento sob um único
+lock, barato o bastante para ficar ligado em produção.
+
+No fim de cada execução do pipeline, exportar() grava em METRICAS_DIR
+(padrão: ./metricas; METRICAS=0 desliga):
+- atualiza_cs.prom: formato texto do Prometheus (para o textfile collector
+  do node_exporter), com os valores acumulados do processo;
+- execucao_<nome>.json: resumo da execução com os mesmos valores.
+
+Com vários processos no mesmo diretório (coordenador.py), cada um define
+METRICAS_INSTANCIA: os arquivos ganham o sufixo e as séries o label
+instancia, sem colisão entre processos.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+METRICAS_ATIVAS = os.getenv("METRICAS", "1") == "1"
+METRICAS_DIR = os.getenv("METRICAS_DIR", "metricas")
+METRICAS_INSTANCIA = os.getenv("METRICAS_INSTANCIA", "")
+PREFIXO = "atualiza_cs_"
+
+# Limites superiores (segundos) dos buckets dos histogramas
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histograma:
+    """Contagem por bucket, soma e total de observações."""
+
+    __slots__ = ("buckets", "soma", "total")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float) -> None:
+        i = 0
+        while i < len(BUCKETS) and valor > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.soma += valor
+        self.total += 1
+
+    def quantil(self, q: float) -> Optional[float]:
+        """Limite superior do bucket que contém o quantil q (None se acima do último)."""
+        alvo = q * self.total
+        acumulado = 0
+        for limite, n in zip(BUCKETS, self.buckets):
+            acumulado += n
+            if acumulado >= alvo:
+                return limite
+        return None
+
+
+class Metricas:
+    """Registro thread-safe de contadores, histogramas e gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores: Dict[str, Dict[Labels, float]] = {}
+        self._histogramas: Dict[str, Dict[Labels, Histograma]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+
+    def incr(self, nome: str, valor: float = 1, **labels) -> None:
+        chave = _labels(labels)
+        with self._lock:
+            serie = self._contadores.setdefault(nome, {})
+            serie[chave] = serie.get(chave, 0) + valor
+
+    def observar(self, nome: str, segundos: float, **labels) -> None:
+        chave = _labels(labels)
+        with self._lock:
+            serie = self._histogramas.setdefault(nome, {})
+            hist = serie.get(chave)
+            if hist is None:
+                hist = serie[chave] = Histograma()
+            hist.observar(segundos)
+
+    def gauge(self, nome: str, delta: float, **labels) -> None:
+        """Soma delta ao gauge (use +1/-1 para itens em andamento)."""
+        chave = _labels(labels)
+        with self._lock:
+            serie = self._gauges.setdefault(nome, {})
+            serie[chave] = serie.get(chave, 0) + delta
+
+    def definir(self, nome: str, valor: float, **labels) -> None:
+        """Fixa o valor do gauge."""
+        chave = _labels(labels)
+        with self._lock:
+            self._gauges.setdefault(nome, {})[chave] = valor
+
+    @contextmanager
+    def medir(self, nome: str, **labels) -> Iterator[None]:
+        """Observa a duração do bloco no histograma `nome`."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **labels)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+            self._gauges.clear()
+
+    # Exportação
+
+    def prometheus(self) -> str:
+        """Todos os valores no formato texto do Prometheus."""
+        def _fmt(labels: Labels, extra: str = "") -> str:
+            partes = [f'{k}="{v}"' for k, v in labels]
+            if METRICAS_INSTANCIA:
+                partes.append(f'instancia="{METRICAS_INSTANCIA}"')
+            if extra:
+                partes.append(extra)
+            return "{" + ",".join(partes) + "}" if partes else ""
+
+        linhas: List[str] = []
+        with self._lock:
+            for nome, serie in sorted(self._contadores.items()):
+                linhas.append(f"# TYPE {PREFIXO}{nome} counter")
+                linhas += [f"{PREFIXO}{nome}{_fmt(l)} {v:g}" for l, v in sorted(serie.items())]
+            for nome, serie in sorted(self._gauges.items()):
+                linhas.append(f"# TYPE {PREFIXO}{nome} gauge")
+                linhas += [f"{PREFIXO}{nome}{_fmt(l)} {v:g}" for l, v in sorted(serie.items())]
+            for nome, serie in sorted(self._histogramas.items()):
+                linhas.append(f"# TYPE {PREFIXO}{nome} histogram")
+                for l, hist in sorted(serie.items()):
+                    acumulado = 0
+                    for limite, n in zip(BUCKETS, hist.buckets):
+                        acumulado += n
+                        le = f'le="{limite:g}"'
+                        linhas.append(f"{PREFIXO}{nome}_bucket{_fmt(l, le)} {acumulado}")
+                    le = 'le="+Inf"'
+                    linhas.append(f"{PREFIXO}{nome}_bucket{_fmt(l, le)} {hist.total}")
+                    linhas.append(f"{PREFIXO}{nome}_sum{_fmt(l)} {hist.soma:.6f}")
+                    linhas.append(f"{PREFIXO}{nome}_count{_fmt(l)} {hist.total}")
+        return "\n".join(linhas) + "\n"
+
+    def resumo(self) -> Dict[str, Any]:
+        """Valores atuais como dicionário serializável em JSON."""
+        def _nome(nome: str, labels: Labels) -> str:
+            return nome + "".join(f"[{k}={v}]" for k, v in labels)
+
+        with self._lock:
+            return {
+                "contadores": {
+                    _nome(n, l): v for n, s in self._contadores.items() for l, v in s.items()
+                },
+                "gauges": {
+                    _nome(n, l): v for n, s in self._gauges.items() for l, v in s.items()
+                },
+                "latencias": {
+                    _nome(n, l): {
+                        "n": h.total,
+                        "total_s": round(h.soma, 3),
+                        "media_ms": round(1000 * h.soma / h.total, 1) if h.total else 0.0,
+                        "p50_s": h.quantil(0.5),
+                        "p99_s": h.quantil(0.99),
+                    }
+                    for n, s in self._histogramas.items() for l, h in s.items()
+                },
+            }
+
+
+metricas = Metricas()
+
+
+def _gravar(caminho: str, conteudo: str) -> None:
+    # Escreve em arquivo temporário e troca, para o coletor nunca ler pela metade
+    tmp = f"{caminho}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(conteudo)
+    os.replace(tmp, caminho)
+
+
+def exportar(nome: str, resumo_execucao: Dict[str, Any], diretorio: Optional[str] = None) -> None:
+    """Grava o textfile do Prometheus e o resumo JSON da execução `nome`."""
+    if not METRICAS_ATIVAS:
+        return
+    diretorio = diretorio or METRICAS_DIR
+    try:
+        os.makedirs(diretorio, exist_ok=True)
+        sufixo = f"_{METRICAS_INSTANCIA}" if METRICAS_INSTANCIA else ""
+        _gravar(os.path.join(diretorio, f"atualiza_cs{sufixo}.prom"), metricas.prometheus())
+        arquivo = "execucao_" + "".join(c if c.isalnum() else "_" for c in nome) + f"{sufixo}.json"
+        _gravar(os.path.join(diretorio, arquivo), json.dumps({
+            "execucao": nome,
+            "instancia": METRICAS_INSTANCIA or None,
+            "finalizado_em": datetime.now().isoformat(timespec="seconds"),
+            "resumo": resumo_execucao,
+            **metricas.resumo(),
+        }, indent=2, ensure_ascii=False, default=str))
+    except OSError as e:
+        logging.warning(f"⚠️ Falha ao exportar métricas em '{diretorio}': {e}")
@@ -0,0 +1,664 @@
+"""
+Motor em pipeline para os envios Sankhya → CS.
+
+Os estágios rodam em paralelo, ligados por filas limitadas:
+
+    listagem de páginas → extração de JSON → montagem de lotes → envio CS
+
+Cada estágio tem o seu próprio limite de concorrência e as filas limitadas
+dão backpressure: se a CS fica lenta, a extração para de puxar códigos, e a
+listagem para de buscar páginas. No encerramento (fim das páginas, stop(),
+Ctrl+C ou SIGTERM) nenhuma página nova é buscada e o que já está nas filas
+é drenado até o fim.
+"""
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from metricas import exportar, metricas
+from utils import util_json_dumps, util_log_contexto
+
+# Sinaliza aos workers de um estágio que não há mais trabalho
+_FIM = object()
+
+# (código, registros JSON extraídos desse código)
+ItemExtraido = Tuple[Any, List[Dict[str, Any]]]
+
+# Limites de cada POST à CS
+CS_LOTE_MAX_BYTES = int(os.getenv("CS_LOTE_MAX_BYTES", "1000000"))
+CS_LOTE_MAX_REGISTROS = int(os.getenv("CS_LOTE_MAX_REGISTROS", "500"))
+
+# Pipelines rodando no processo, para parar_pipelines() (SIGTERM do daemon)
+_em_execucao: Set["Pipeline"] = set()
+_em_execucao_lock = threading.Lock()
+
+
+class LoteCS:
+    """Lote de registros de um tipo, pronto para envio à CS."""
+
+    def __init__(
+        self,
+        tipo: str,
+        numero: int,
+        codigos: List[Any],
+        registros: List[Dict[str, Any]],
+        origem: Optional[List[Any]] = None
+    ):
+        self.tipo = tipo
+        self.numero = numero
+        self.codigos = codigos
+        self.registros = registros
+        # Código de cada registro, na mesma ordem de registros
+        self.origem = origem if origem is not None else []
+        self.bytes = 0
+        # Preenchidos por enviar_fn: motivo da recusa do lote inteiro e
+        # {posição do registro: mensagem} dos registros recusados um a um
+        self.erro: Optional[str] = None
+        self.recusados: Dict[int, str] = {}
+
+
+def tamanho_registro(registro: Dict[str, Any]) -> int:
+    """Bytes do registro serializado em JSON compacto (UTF-8), como vai no POST."""
+    return len(util_json_dumps(registro))
+
+
+class BatchAssembler:
+    """
+    Empacota registros de um tipo em lotes CS limitados por bytes serializados
+    e por quantidade de registros, independente de quantos códigos os geraram.
+    Um código pode ser dividido entre lotes; um registro maior que max_bytes
+    segue sozinho.
+    """
+
+    def __init__(self, tipo: str, max_bytes: int, max_registros: int):
+        self.tipo = tipo
+        self.max_bytes = max_bytes
+        self.max_registros = max_registros
+        self._numero = 0
+        self._novo_lote()
+
+    def _novo_lote(self) -> None:
+        self._codigos: List[Any] = []
+        self._registros: List[Dict[str, Any]] = []
+        self._origem: List[Any] = []
+        self._bytes = 2  # colchetes da lista
+
+    def _fechar(self) -> LoteCS:
+        self._numero += 1
+        lote = LoteCS(self.tipo, self._numero, self._codigos, self._registros, self._origem)
+        lote.bytes = self._bytes
+        self._novo_lote()
+        return lote
+
+    @property
+    def vazio(self) -> bool:
+        return not self._registros
+
+    def adicionar(self, codigo: Any, registros: List[Dict[str, Any]], ao_incluir: Callable[[Any], None]) -> List[LoteCS]:
+        """
+        Adiciona os registros de um código e devolve os lotes que encheram.
+        ao_incluir(codigo) é chamado sempre que o código entra em um lote novo.
+        """
+        prontos: List[LoteCS] = []
+        for registro in registros:
+            tamanho = tamanho_registro(registro) + 1
+            if self._registros and (
+                self._bytes + tamanho > self.max_bytes or len(self._registros) >= self.max_registros
+            ):
+                prontos.append(self._fechar())
+            if not self._codigos or self._codigos[-1] != codigo:
+                self._codigos.append(codigo)
+                ao_incluir(codigo)
+            self._registros.append(registro)
+            self._origem.append(codigo)
+            self._bytes += tamanho
+        return prontos
+
+    def finalizar(self) -> Optional[LoteCS]:
+        """Fecha o lote parcial, se houver."""
+        return None if self.vazio else self._fechar()
+
+
+class PipelineStats:
+    """Contadores thread-safe de uma execução do pipeline."""
+
+    CAMPOS = (
+        "paginas", "codigos", "registros",
+        "lotes_enviados", "lotes_com_falha", "registros_recusados", "erros_extracao",
+        "erros_listagem",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valores = dict.fromkeys(self.CAMPOS, 0)
+
+    def incr(self, campo: str, valor: int = 1) -> None:
+        with self._lock:
+            self._valores[campo] += valor
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._valores)
+
+
+class Pipeline:
+    """
+    Executa extrair_fn e enviar_fn sobre páginas de códigos, para cada tipo.
+
+    lote_size é o número de códigos por extração; os POSTs à CS são montados
+    por BatchAssembler (lote_max_bytes / lote_max_registros).
+
+    - extrair_fn(tipo, codigos) -> [(codigo, registros), ...]
+    - extrair_grupo_fn(tipos, codigos) -> {tipo: [(codigo, registros), ...]}:
+      extrai numa passada só os tipos de cada grupo de `grupos` (ex.: produto
+      e estoque, da mesma tabela); cada tipo segue para o seu montador
+    - enviar_fn(lote) -> True se a CS processou o lote; registros recusados
+      um a um vão em lote.recusados
+    - filtros: objetos com filtrar(tipo, extraidos), confirmar(lote) e resumo(),
+      aplicados entre a extração e a montagem (ver filtros.py)
+    - limiters: limitadores adaptativos por host, cujo limite final entra no resumo
+    - checkpoint: recebe o andamento de cada página e código (ver checkpoint.py)
+    - fila_retry: recebe os códigos concluídos e os que falharam, com o erro
+      (ver fila_retry.py)
+    """
+
+    def __init__(
+        self,
+        *,
+        nome: str,
+        tipos: List[str],
+        extrair_fn: Callable[[str, List[Any]], List[ItemExtraido]],
+        enviar_fn: Callable[[LoteCS], bool],
+        lote_size: int = 100,
+        extract_workers: int = 5,
+        send_workers: int = 5,
+        queue_size: Optional[int] = None,
+        filtros: Optional[List[Any]] = None,
+        limiters: Optional[Dict[str, Any]] = None,
+        lote_max_bytes: int = CS_LOTE_MAX_BYTES,
+        lote_max_registros: int = CS_LOTE_MAX_REGISTROS,
+        flush_segundos: float = 2.0,
+        checkpoint: Optional[Any] = None,
+        fila_retry: Optional[Any] = None,
+        extrair_grupo_fn: Optional[Callable[[List[str], List[Any]], Dict[str, List[ItemExtraido]]]] = None,
+        grupos: Optional[List[List[str]]] = None
+    ):
+        self.nome = nome
+        self.tipos = tipos
+        self.extrair_fn = extrair_fn
+        self.extrair_grupo_fn = extrair_grupo_fn
+        # Tipos extraídos juntos; sem extrair_grupo_fn, cada tipo sozinho
+        agrupados = [
+            [t for t in grupo if t in tipos] for grupo in (grupos or []) if extrair_grupo_fn
+        ]
+        agrupados = [g for g in agrupados if len(g) > 1]
+        soltos = [[t] for t in tipos if not any(t in g for g in agrupados)]
+        self.grupos = agrupados + soltos
+        self.enviar_fn = enviar_fn
+        self.lote_size = lote_size
+        self.extract_workers = max(1, extract_workers)
+        self.send_workers = max(1, send_workers)
+        self.filtros = filtros or []
+        self.limiters = limiters or {}
+        self.lote_max_bytes = lote_max_bytes
+        self.lote_max_registros = lote_max_registros
+        self.flush_segundos = flush_segundos
+        self.checkpoint = checkpoint
+        self.fila_retry = fila_retry
+
+        self._extract_q: queue.Queue = queue.Queue(maxsize=queue_size or 2 * self.extract_workers)
+        self._assemble_q: queue.Queue = queue.Queue(maxsize=queue_size or 2 * self.extract_workers)
+        self._send_q: queue.Queue = queue.Queue(maxsize=queue_size or 2 * self.send_workers)
+        self._stop = threading.Event()
+        self.stats = PipelineStats()
+
+        # Quantos lotes ainda não confirmados contêm cada (tipo, código)
+        self._ack_lock = threading.Lock()
+        self._partes: Dict[Tuple[str, Any], int] = {}
+        self._com_falha: Dict[Tuple[str, Any], str] = {}
+
+    def stop(self) -> None:
+        """Para de listar páginas novas; o que já está em andamento é drenado."""
+        if not self._stop.is_set():
+            logging.warning(f"🛑 Encerrando pipeline '{self.nome}': drenando filas...")
+        self._stop.set()
+
+    # Estágios
+
+    def _enfileirar(self, codigos_por_tipo: Dict[str, List[Any]]) -> None:
+        """
+        Enfileira os códigos pendentes de cada tipo em itens de até lote_size
+        códigos. Os tipos de um mesmo grupo dividem o item: cada código é
+        extraído uma vez só para todos os tipos do grupo que o aguardam.
+        """
+        for grupo in self.grupos:
+            pendentes = {t: codigos_por_tipo[t] for t in grupo if codigos_por_tipo.get(t)}
+            if len(pendentes) == 1:
+                tipo, codigos = next(iter(pendentes.items()))
+                for i in range(0, len(codigos), self.lote_size):
+                    self._extract_q.put({tipo: codigos[i:i + self.lote_size]})
+                continue
+            # União na ordem em que os códigos aparecem
+            uniao = list(dict.fromkeys(c for codigos in pendentes.values() for c in codigos))
+            conjuntos = {t: set(codigos) for t, codigos in pendentes.items()}
+            for i in range(0, len(uniao), self.lote_size):
+                bloco = uniao[i:i + self.lote_size]
+                self._extract_q.put({
+                    t: [c for c in bloco if c in conjunto] for t, conjunto in conjuntos.items()
+                })
+
+    def _listar(self, paginas: Iterable[List[Any]], reprocessar: Dict[str, List[Any]]) -> None:
+        try:
+            # Códigos da fila de retentativas vão antes das páginas
+            for tipo, codigos in reprocessar.items():
+                if tipo not in self.tipos or self._stop.is_set():
+                    continue
+                self.stats.incr("codigos", len(codigos))
+                for i in range(0, len(codigos), self.lote_size):
+                    self._extract_q.put({tipo: codigos[i:i + self.lote_size]})
+            ja = {t: {str(c) for c in cods} for t, cods in reprocessar.items() if cods}
+
+            paginas = iter(paginas)
+            while True:
+                with metricas.medir("etapa_segundos", etapa="listagem", pipeline=self.nome):
+                    pagina = next(paginas, _FIM)
+                if pagina is _FIM or self._stop.is_set():
+                    break
+                idx = self.stats.as_dict()["paginas"]
+                self.stats.incr("paginas")
+                self.stats.incr("codigos", len(pagina))
+                enfileirar = {
+                    tipo: self.checkpoint.pendentes(tipo, pagina) if self.checkpoint else pagina
+                    for tipo in self.tipos
+                }
+                for tipo, reprocessados in ja.items():
+                    if tipo in enfileirar:
+                        enfileirar[tipo] = [c for c in enfileirar[tipo] if str(c) not in reprocessados]
+                if self.checkpoint:
+                    self.checkpoint.pagina_listada(idx, pagina, enfileirar)
+                self._enfileirar(enfileirar)
+        except Exception as e:
+            logging.error(f"❌ Falha na listagem de páginas de '{self.nome}': {e}", exc_info=True)
+            self.stats.incr("erros_listagem")
+            self.stop()
+
+    def _erro_estagio(self, etapa: str, e: Exception) -> None:
+        """
+        Erro inesperado num estágio: encerra a execução, mas o worker continua
+        consumindo a fila até o _FIM, para os outros estágios não travarem.
+        """
+        logging.error(f"❌ Erro inesperado na {etapa} de '{self.nome}': {e}", exc_info=True)
+        metricas.incr("erros_estagio_total", etapa=etapa)
+        self.stop()
+
+    def _extrair(self) -> None:
+        while True:
+            item = self._extract_q.get()
+            if item is _FIM:
+                return
+            try:
+                with util_log_contexto(tipo="+".join(item)):
+                    self._extrair_item(item)
+            except Exception as e:
+                self._erro_estagio("extração", e)
+
+    def _extrair_item(self, item: Dict[str, List[Any]]) -> None:
+        """Extrai um item {tipo: códigos} e entrega cada tipo à montagem."""
+        tipos = list(item)
+        rotulo = "+".join(tipos)
+        metricas.gauge("etapa_em_andamento", 1, etapa="extracao")
+        try:
+            with metricas.medir("etapa_segundos", etapa="extracao", tipo=rotulo):
+                if len(tipos) == 1:
+                    resultado = {rotulo: self.extrair_fn(rotulo, item[rotulo])}
+                else:
+                    uniao = list(dict.fromkeys(c for codigos in item.values() for c in codigos))
+                    resultado = self.extrair_grupo_fn(tipos, uniao)
+        except Exception as e:
+            n = len({c for codigos in item.values() for c in codigos})
+            logging.error(f"❌ Erro na extração de '{rotulo}' ({n} códigos): {e}")
+            self.stats.incr("erros_extracao")
+            metricas.incr("erros_extracao_total", tipo=rotulo)
+            for tipo, codigos in item.items():
+                self._falharam(tipo, codigos, f"extração: {e}")
+            return
+        finally:
+            metricas.gauge("etapa_em_andamento", -1, etapa="extracao")
+        for tipo, codigos in item.items():
+            # No grupo, cada tipo fica só com os códigos que ele aguardava
+            pedidos = set(codigos)
+            extraidos = [(c, regs) for c, regs in resultado.get(tipo, []) if c in pedidos]
+            metricas.incr("codigos_extraidos_total", len(extraidos), tipo=tipo)
+            self._assemble_q.put((tipo, codigos, extraidos))
+
+    def _incluir(self, tipo: str, codigo: Any) -> None:
+        with self._ack_lock:
+            chave = (tipo, codigo)
+            self._partes[chave] = self._partes.get(chave, 0) + 1
+
+    def _confirmados(self, lote: LoteCS, ok: bool) -> Tuple[List[Any], Dict[str, List[Any]]]:
+        """
+        Registra o resultado de um lote e devolve os códigos finalizados:
+        (com todas as partes aceitas, {erro: códigos com alguma parte recusada}).
+        """
+        prontos: List[Any] = []
+        falhos: Dict[str, List[Any]] = {}
+        recusados: Dict[Any, str] = {}
+        for i, mensagem in lote.recusados.items():
+            recusados.setdefault(lote.origem[i], f"registro recusado: {mensagem}")
+        with self._ack_lock:
+            for codigo in lote.codigos:
+                chave = (lote.tipo, codigo)
+                if not ok:
+                    self._com_falha[chave] = lote.erro or "lote recusado pela CS"
+                elif codigo in recusados:
+                    self._com_falha[chave] = recusados[codigo]
+                self._partes[chave] -= 1
+                if self._partes[chave] == 0:
+                    del self._partes[chave]
+                    if chave in self._com_falha:
+                        falhos.setdefault(self._com_falha.pop(chave), []).append(codigo)
+                    else:
+                        prontos.append(codigo)
+        return prontos, falhos
+
+    def _gravar_estado(self, gravar: Callable, tipo: str, *args) -> bool:
+        """
+        Grava o andamento no checkpoint ou na fila de retentativas; False se
+        falhou. Nesse caso a execução é encerrada (sem avançar watermark nem
+        checkpoint) e o estágio segue drenando a fila, para os demais não travarem.
+        """
+        try:
+            gravar(tipo, *args)
+            return True
+        except Exception as e:
+            logging.error(
+                f"❌ Falha ao gravar o estado de '{tipo}' ({type(gravar.__self__).__name__}."
+                f"{gravar.__name__}): {e}",
+                exc_info=True
+            )
+            metricas.incr("erros_estado_total", tipo=tipo)
+            self.stop()
+            return False
+
+    def _concluidos(self, tipo: str, codigos: List[Any]) -> None:
+        """Códigos confirmados pela CS ou que não precisavam ser enviados."""
+        if not codigos:
+            return
+        if self.checkpoint:
+            self._gravar_estado(self.checkpoint.concluidos, tipo, codigos)
+        if self.fila_retry:
+            self._gravar_estado(self.fila_retry.concluidos, tipo, codigos)
+
+    def _falharam(self, tipo: str, codigos: List[Any], erro: str) -> None:
+        """Códigos que não chegaram à CS, com o motivo."""
+        if not codigos:
+            return
+        # Guardados na fila, não seguram a página do checkpoint
+        guardados = bool(self.fila_retry) and self._gravar_estado(self.fila_retry.falharam, tipo, codigos, erro)
+        if self.checkpoint:
+            self._gravar_estado(self.checkpoint.falharam, tipo, codigos, guardados)
+
+    def _emitir(self, lote: LoteCS) -> None:
+        self.stats.incr("registros", len(lote.registros))
+        self._send_q.put(lote)
+
+    def _fechar_parciais(self, montadores: Dict[str, BatchAssembler]) -> None:
+        for montador in montadores.values():
+            if (lote := montador.finalizar()) is not None:
+                self._emitir(lote)
+
+    def _montar(self) -> None:
+        montadores: Dict[str, BatchAssembler] = {}
+        while True:
+            try:
+                item = self._assemble_q.get(timeout=self.flush_segundos)
+            except queue.Empty:
+                # Sem novidades: não segura lotes parciais esperando encher
+                item = None
+            try:
+                if item is None or item is _FIM:
+                    self._fechar_parciais(montadores)
+                else:
+                    self._montar_item(item, montadores)
+            except Exception as e:
+                self._erro_estagio("montagem", e)
+            if item is _FIM:
+                return
+
+    def _montar_item(
+        self,
+        item: Tuple[str, List[Any], List[ItemExtraido]],
+        montadores: Dict[str, BatchAssembler]
+    ) -> None:
+        """Aplica os filtros aos códigos extraídos e empacota os registros nos lotes do tipo."""
+        tipo, codigos, extraidos = item
+        extraidos_ok = {c for c, _ in extraidos}
+        for filtro in self.filtros:
+            try:
+                with metricas.medir("etapa_segundos", etapa=f"filtro_{type(filtro).__name__}", tipo=tipo):
+                    extraidos = filtro.filtrar(tipo, extraidos)
+            except Exception as e:
+                logging.error(f"❌ Erro no filtro {type(filtro).__name__} de '{tipo}': {e}")
+        extraidos = [(c, regs) for c, regs in extraidos if regs]
+        # Sem JSON válido: falha; descartados pelos filtros ou vazios: concluídos
+        enviados = {c for c, _ in extraidos}
+        self._falharam(tipo, [c for c in codigos if c not in extraidos_ok], "JSON ausente ou inválido")
+        self._concluidos(tipo, [c for c in extraidos_ok if c not in enviados])
+        if not extraidos:
+            logging.debug(f"ℹ️ Nenhum registro JSON a enviar de '{tipo}' em {len(codigos)} códigos.")
+            return
+
+        montador = montadores.get(tipo)
+        if montador is None:
+            montador = montadores[tipo] = BatchAssembler(
+                tipo, self.lote_max_bytes, self.lote_max_registros
+            )
+        for codigo, registros in extraidos:
+            for lote in montador.adicionar(codigo, registros, lambda c, t=tipo: self._incluir(t, c)):
+                self._emitir(lote)
+
+    def _enviar(self) -> None:
+        while True:
+            lote = self._send_q.get()
+            if lote is _FIM:
+                return
+            try:
+                with util_log_contexto(tipo=lote.tipo, lote=lote.numero):
+                    self._enviar_lote(lote)
+            except Exception as e:
+                self._erro_estagio("envio", e)
+
+    def _enviar_lote(self, lote: LoteCS) -> None:
+        """Envia um lote e registra o resultado numa única linha de log."""
+        metricas.gauge("etapa_em_andamento", 1, etapa="envio")
+        inicio = time.perf_counter()
+        try:
+            ok = self.enviar_fn(lote)
+        except Exception as e:
+            lote.erro = str(e)
+            ok = False
+        finally:
+            metricas.gauge("etapa_em_andamento", -1, etapa="envio")
+        duracao = time.perf_counter() - inicio
+        metricas.observar("etapa_segundos", duracao, etapa="envio", tipo=lote.tipo)
+        self.stats.incr("lotes_enviados" if ok else "lotes_com_falha")
+        metricas.incr("lotes_total", tipo=lote.tipo, resultado="ok" if ok else "falha")
+        linha = (
+            f"Lote {lote.numero} de '{lote.tipo}': {len(lote.codigos)} códigos → "
+            f"{len(lote.registros)} registros ({lote.bytes / 1024:.0f} KB) em {duracao:.2f}s"
+        )
+        if not ok:
+            logging.error(f"❌ {linha}: falhou ({lote.erro or 'lote recusado pela CS'})")
+        elif lote.recusados:
+            recusados = len(lote.recusados)
+            metricas.incr("registros_enviados_total", len(lote.registros) - recusados, tipo=lote.tipo)
+            self.stats.incr("registros_recusados", recusados)
+            metricas.incr("registros_recusados_total", recusados, tipo=lote.tipo)
+            exemplo = next(iter(lote.recusados.values()))
+            logging.warning(f"⚠️ {linha}: {recusados} registros recusados pela CS (ex.: {exemplo})")
+        else:
+            metricas.incr("registros_enviados_total", len(lote.registros), tipo=lote.tipo)
+            logging.info(f"📦 {linha}: ok")
+
+        try:
+            confirmados, falhos = self._confirmados(lote, ok)
+        except Exception as e:
+            logging.error(f"❌ Erro ao registrar o resultado do lote {lote.numero} de '{lote.tipo}': {e}", exc_info=True)
+            self.stop()
+            return
+        self._concluidos(lote.tipo, confirmados)
+        for erro, codigos in falhos.items():
+            self._falharam(lote.tipo, codigos, f"envio: {erro}")
+        # Os filtros recebem os códigos finalizados com sucesso (cache por código) e
+        # os registros que a CS aceitou, um a um (snapshot por linha de saldo)
+        aceitos = [i for i in range(len(lote.registros)) if i not in lote.recusados] if ok else []
+        if confirmados or aceitos:
+            parcial = LoteCS(
+                lote.tipo, lote.numero, confirmados,
+                [lote.registros[i] for i in aceitos],
+                [lote.origem[i] for i in aceitos] if lote.origem else []
+            )
+            for filtro in self.filtros:
+                try:
+                    filtro.confirmar(parcial)
+                except Exception as e:
+                    logging.error(f"❌ Erro ao confirmar lote {lote.numero} em {type(filtro).__name__}: {e}")
+
+    # Execução
+
+    def _aguardar(self, threads: List[threading.Thread]) -> None:
+        for t in threads:
+            while t.is_alive():
+                try:
+                    t.join(0.5)
+                except KeyboardInterrupt:
+                    self.stop()
+
+    def _iniciar(self, alvo: Callable, n: int, etapa: str, *args) -> List[threading.Thread]:
+        def _rodar():
+            with util_log_contexto(execucao=self.execucao):
+                alvo(*args)
+
+        threads = [
+            threading.Thread(target=_rodar, name=f"{self.nome}-{etapa}-{i}", daemon=True)
+            for i in range(n)
+        ]
+        for t in threads:
+            t.start()
+        return threads
+
+    def run(
+        self,
+        paginas: Iterable[List[Any]],
+        reprocessar: Optional[Dict[str, List[Any]]] = None
+    ) -> Dict[str, int]:
+        """
+        Processa todas as páginas e retorna os contadores da execução.
+        reprocessar={tipo: códigos} entra antes da primeira página (retentativas);
+        esses códigos são retirados das páginas em que aparecerem.
+        """
+        start = time.perf_counter()
+        # Id desta execução nos logs estruturados de todos os estágios
+        self.execucao = f"{self.nome}-{uuid.uuid4().hex[:8]}"
+        no_main = threading.current_thread() is threading.main_thread()
+        if no_main:
+            sigterm_anterior = signal.signal(signal.SIGTERM, lambda *_: self.stop())
+
+        limites = " ".join(f"limite {n}={l.limite}" for n, l in self.limiters.items())
+        logging.info(
+            f"🚚 Pipeline '{self.nome}': tipos={['+'.join(g) for g in self.grupos]}, lote={self.lote_size}, "
+            f"extração={self.extract_workers}, envio={self.send_workers} {limites}",
+            extra={"execucao": self.execucao}
+        )
+        with _em_execucao_lock:
+            _em_execucao.add(self)
+        try:
+            senders = self._iniciar(self._enviar, self.send_workers, "envio")
+            montador = self._iniciar(self._montar, 1, "montagem")
+            extratores = self._iniciar(self._extrair, self.extract_workers, "extracao")
+            listagem = self._iniciar(self._listar, 1, "listagem", paginas, reprocessar or {})
+
+            # Drena estágio por estágio, na ordem do fluxo
+            self._aguardar(listagem)
+            for _ in extratores:
+                self._extract_q.put(_FIM)
+            self._aguardar(extratores)
+            self._assemble_q.put(_FIM)
+            self._aguardar(montador)
+            for _ in senders:
+                self._send_q.put(_FIM)
+            self._aguardar(senders)
+        finally:
+            with _em_execucao_lock:
+                _em_execucao.discard(self)
+            if no_main:
+                signal.signal(signal.SIGTERM, sigterm_anterior or signal.SIG_DFL)
+
+        resumo = self.stats.as_dict()
+        resumo["interrompido"] = int(self._stop.is_set())
+        try:
+            if self.checkpoint:
+                self.checkpoint.finalizar(bool(resumo["interrompido"]))
+            if self.fila_retry:
+                self.fila_retry.finalizar()
+        except Exception as e:
+            logging.error(f"❌ Falha ao finalizar o estado de '{self.nome}': {e}", exc_info=True)
+            resumo["interrompido"] = 1
+        if self.fila_retry:
+            resumo.update(self.fila_retry.resumo())
+        for nome, limiter in self.limiters.items():
+            resumo[f"limite_{nome}"] = limiter.limite
+        for filtro in self.filtros:
+            resumo.update(filtro.resumo())
+        elapsed = time.perf_counter() - start
+        mins, secs = divmod(int(elapsed), 60)
+        logging.info(
+            f"🏁 Pipeline '{self.nome}' completo em {mins}m{secs:02d}s | "
+            f"páginas={resumo['paginas']} códigos={resumo['codigos']} "
+            f"registros={resumo['registros']} lotes ok={resumo['lotes_enviados']} "
+            f"falhas={resumo['lotes_com_falha']} recusados={resumo['registros_recusados']} "
+            f"erros extração={resumo['erros_extracao']}",
+            extra={"execucao": self.execucao}
+        )
+        metricas.observar("execucao_segundos", elapsed, pipeline=self.nome)
+        resumo["duracao_s"] = round(elapsed, 3)
+        exportar(self.nome, resumo)
+        return resumo
+
+
+def parar_pipelines() -> int:
+    """
+    Chama stop() em todos os pipelines rodando no processo, inclusive os de
+    threads que não recebem sinais (tarefas do daemon): cada um drena as
+    filas e finaliza o checkpoint como interrompido. Retorna quantos parou.
+    """
+    with _em_execucao_lock:
+        ativos = list(_em_execucao)
+    for pipeline in ativos:
+        pipeline.stop()
+    return len(ativos)
+
+
+def execucao_confirmada(resumo: Dict[str, int]) -> bool:
+    """
+    True se o watermark pode avançar: todas as páginas foram listadas e a
+    execução chegou ao fim (em todas as faixas, no coordenador). Códigos que falharam na extração ou no envio não
+    seguram o watermark quando a execução tem fila de retentativas (resumo com
+    retry_*): eles já estão gravados lá e voltam por ela ou pelo dead-letter.
+    Sem a fila, qualquer falha mantém o watermark.
+    """
+    if resumo.get("interrompido") or resumo.get("erros_listagem") or resumo.get("faixas_com_erro"):
+        return False
+    if "retry_registrados" in resumo:
+        return True
+    return not (
+        resumo.get("lotes_com_falha")
+        or resumo.get("registros_recusados")
+        or resumo.get("erros_extracao")
+    )
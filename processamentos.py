@@ -1,26 +1,165 @@
 import logging
 import time
 import math
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from icorp_api.cs_sender import cs_processar_envio_parceiro, cs_processar_envio_generico
+from checkpoint import Checkpoint, chave_execucao
+from estado import CheckpointStore, EstoqueSnapshot, PayloadHashCache, RetryQueue
+from fila_retry import FilaRetry
+from filtros import FiltroDeltaEstoque, FiltroInalterados
+from icorp_api.cs_sender import criar_pipeline, get_cs_client
 from sankhya_api.sankhya_fetch import snk_fetch_data
 from utils import logging_config
 
 logging_config()
 
-def process_batches(
-    query_total: str,
+# Queries padrão da carga completa (códigos ativos de cada entidade)
+QUERY_PARCEIROS_ATIVOS = (
+    "SELECT CODPARC "
+    "FROM TGFPAR "
+    "WHERE ATIVO = 'S' "
+    "AND CGC_CPF IS NOT NULL "
+    "AND CLIENTE = 'S' "
+    "ORDER BY CODPARC"
+)
+QUERY_PRODUTOS_ATIVOS = (
+    "SELECT DISTINCT ITE.CODPROD "
+    "FROM TGFITE ITE "
+    "INNER JOIN TGFCAB CAB ON ITE.NUNOTA = CAB.NUNOTA "
+    "INNER JOIN TGFPRO PRO ON ITE.CODPROD = PRO.CODPROD "
+    "WHERE PRO.ATIVO = 'S' "
+    "AND PRO.USOPROD = 'R' "
+    "ORDER BY ITE.CODPROD"
+)
+
+
+def _strip_order_by(query: str) -> str:
+    """Remove o ORDER BY final da query base (não é permitido em subconsultas)."""
+    matches = list(re.finditer(r'\bORDER\s+BY\b', query, flags=re.IGNORECASE))
+    if not matches:
+        return query.strip()
+    return query[:matches[-1].start()].strip()
+
+
+def _sql_literal(valor) -> str:
+    """Formata a última chave vista como literal SQL."""
+    try:
+        return str(int(valor))
+    except (TypeError, ValueError):
+        texto = str(valor).replace("'", "''")
+        return f"'{texto}'"
+
+
+def parse_shard(texto: str) -> Tuple[int, int]:
+    """Converte 'i/N' (0 <= i < N) em (i, N)."""
+    try:
+        i, n = (int(v) for v in texto.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard inválido '{texto}': use i/N, ex.: 0/4") from None
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"Shard inválido '{texto}': é preciso 0 <= i < N")
+    return i, n
+
+
+def filtro_chave(
+    chave: str,
+    shard: Optional[Tuple[int, int]] = None,
+    faixa: Optional[Tuple[int, int]] = None
+) -> Optional[str]:
+    """
+    Predicado sobre K.chave que restringe a execução a uma parte dos códigos:
+    shard=(i, N) fica com o bucket chave % N = i; faixa=(inicio, fim) com
+    inicio <= chave < fim. Partes diferentes nunca compartilham códigos.
+    """
+    partes = []
+    if shard:
+        i, n = shard
+        partes.append(f"K.{chave} % {n} = {i}")
+    if faixa:
+        inicio, fim = faixa
+        partes.append(f"K.{chave} >= {int(inicio)} AND K.{chave} < {int(fim)}")
+    return " AND ".join(partes) or None
+
+
+def intervalo_chaves(query_base: str, chave: str) -> Tuple[Optional[int], Optional[int]]:
+    """Menor e maior valor de `chave` na query base (None, None se vazia)."""
+    base = _strip_order_by(query_base)
+    rows = snk_fetch_data(f"SELECT MIN(K.{chave}), MAX(K.{chave}) FROM (\n{base}\n) AS K")
+    if not rows or not rows[0] or rows[0][0] is None:
+        return None, None
+    return int(rows[0][0]), int(rows[0][1])
+
+
+def build_keyset_page_sql(
     query_base: str,
+    chave: str,
     step: int,
-    lote: int,
-    workers: int,
-    tipos: list[str]
-) -> None:
+    ultima_chave=None,
+    filtro: Optional[str] = None
+) -> str:
+    """
+    Monta a página seguinte por keyset: os `step` primeiros códigos
+    maiores que a última chave vista, em ordem de chave.
+    `filtro` é um predicado extra sobre K.chave (ver filtro_chave).
+    """
+    base = _strip_order_by(query_base)
+    condicoes = []
+    if ultima_chave is not None:
+        condicoes.append(f"K.{chave} > {_sql_literal(ultima_chave)}")
+    if filtro:
+        condicoes.append(filtro)
+    where = f" WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    return (
+        f"SELECT TOP {step} K.{chave} FROM (\n{base}\n) AS K"
+        f"{where} ORDER BY K.{chave}"
+    )
+
+
+def iter_paginas_keyset(
+    query_base: str,
+    chave: str,
+    step: int,
+    filtro: Optional[str] = None,
+    ultima_chave=None
+) -> Iterator[list]:
+    """
+    Percorre a query base por keyset, levando a última chave de página em página.
+    Cada página é uma lista de códigos; para na primeira página incompleta.
+    Com ultima_chave, começa logo depois dela (retomada de checkpoint).
+    """
+    start = time.perf_counter()
+    processados = 0
+    idx = 0
+
+    while True:
+        paged_query = build_keyset_page_sql(query_base, chave, step, ultima_chave, filtro)
+        codes = snk_fetch_data(paged_query)
+        if not codes:
+            return
+
+        elapsed = time.perf_counter() - start
+        mins, secs = divmod(int(elapsed), 60)
+        logging.info("=" * 42)
+        logging.info(
+            f"🔄 Página {idx + 1} | Tempo decorrido: {mins}m{secs:02d}s | "
+            f"Processados: {processados} | {chave} > {ultima_chave}"
+        )
+
+        yield [row[0] for row in codes]
+
+        processados += len(codes)
+        ultima_chave = codes[-1][0]
+        idx += 1
+        if len(codes) < step:
+            return
+
+
+def iter_paginas_offset(query_total: str, query_base: str, step: int) -> Iterator[list]:
     """
-    Processa registros em lotes baseado em queries, executando envios CS para cada tipo.
-    Se não houver registros ou ocorrer falha na consulta, retorna sem erro.
+    Percorre a query base com OFFSET/FETCH, usando query_total para saber
+    quantas páginas existem. Páginas com falha na consulta são puladas.
     """
-    # Obtém total de registros
     try:
         result = snk_fetch_data(query_total)
         total = result[0][0] if result and result[0] else 0
@@ -29,7 +168,6 @@ def process_batches(
         return
 
     if total == 0:
-        logging.info("ℹ️ Nenhuma atualização encontrada. Nada a processar.")
         return
 
     n_batches = math.ceil(total / step)
@@ -50,80 +188,142 @@ def process_batches(
         )
 
         paged_query = f"{query_base.strip()}\nOFFSET {offset} ROWS FETCH NEXT {step} ROWS ONLY"
+        try:
+            codes = snk_fetch_data(paged_query)
+        except Exception as e:
+            logging.warning(f"⚠️ Falha ao buscar códigos do lote {idx + 1}: {e}")
+            continue
+
+        if not codes:
+            logging.info(f"ℹ️ Sem códigos no lote {idx+1}. Pulando.")
+            continue
+
+        yield [row[0] for row in codes]
+
 
-        for tipo in tipos:
-            logging.info(f"➡️ Processando tipo '{tipo}'")
-            # Verifica códigos antes de chamar o sender
-            try:
-                codes = snk_fetch_data(paged_query)
-            except Exception as e:
-                logging.warning(f"⚠️ Falha ao buscar códigos de '{tipo}': {e}")
-                continue
-
-            if not codes:
-                logging.info(f"ℹ️ Sem códigos de '{tipo}' no lote {idx+1}. Pulando.")
-                continue
-
-            # Envia lote
-            try:
-                if tipo == "parceiro":
-                    cs_processar_envio_parceiro(
-                        paged_query,
-                        tamanho_lote=lote,
-                        max_workers=workers
-                    )
-                else:
-                    cs_processar_envio_generico(
-                        tipo,
-                        paged_query,
-                        tamanho_lote=lote,
-                        max_workers=workers
-                    )
-            except Exception as e:
-                logging.error(f"❌ Erro no envio de '{tipo}' no lote {idx+1}: {e}", exc_info=True)
-                continue
-
-    total_elapsed = time.perf_counter() - start
-    mins, secs = divmod(int(total_elapsed), 60)
-    logging.info(f"🏁 Processamento completo em {mins}m{secs:02d}s")
+def _filtros(usar_cache: bool, forcar: bool, tipos: List[str]) -> list:
+    """
+    Filtros do pipeline: descarta payloads inalterados e, no estoque, as
+    linhas de saldo inalteradas; com forcar, só atualizam o estado.
+    """
+    if not usar_cache:
+        return []
+    cache = PayloadHashCache()
+    cache.evict()
+    filtros = [FiltroInalterados(cache, forcar=forcar)]
+    if "estoque" in tipos:
+        snapshot = EstoqueSnapshot()
+        snapshot.evict()
+        filtros.append(FiltroDeltaEstoque(snapshot, forcar=forcar))
+    return filtros
+
+
+def process_batches(
+    query_total: Optional[str],
+    query_base: str,
+    step: int,
+    lote: int,
+    workers: int,
+    tipos: list[str],
+    chave: Optional[str] = None,
+    extract_workers: Optional[int] = None,
+    send_workers: Optional[int] = None,
+    usar_cache: bool = True,
+    forcar: bool = False,
+    filtro: Optional[str] = None,
+    retomar: bool = False,
+    usar_retry: bool = True,
+    orcamento: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Processa registros em páginas baseado em queries, executando envios CS para cada tipo
+    pelo pipeline (listagem → extração → montagem → envio), que sobrepõe as páginas.
+    Com `chave` (ex.: 'CODPARC'), pagina por keyset (WHERE chave > última ORDER BY chave)
+    sem a consulta de COUNT; sem ela, usa OFFSET/FETCH com o total de `query_total`.
+    extract_workers e send_workers são os limites iniciais de requisições simultâneas
+    ao Sankhya e à CS (padrão: workers), ajustados depois pelos limitadores adaptativos.
+    Com usar_cache, códigos cujo payload não mudou desde o último envio confirmado
+    não são reenviados, e do estoque vão só as linhas de saldo alteradas;
+    forcar=True envia tudo e apenas atualiza o cache e o snapshot.
+    `filtro` restringe a paginação por keyset a um shard/faixa de chaves.
+    Execuções por keyset gravam checkpoint; com retomar=True, uma execução
+    interrompida continua da última página concluída, sem reenviar os
+    códigos já confirmados.
+    Com usar_retry, os códigos que falharem vão para a fila de retentativas, e
+    os vencidos da fila são reprocessados antes da primeira página.
+    `orcamento` dá à extração e ao envio limitadores próprios (ver criar_pipeline).
+    Retorna os contadores da execução.
+    """
+    checkpoint = None
+    if chave:
+        checkpoint = Checkpoint(
+            CheckpointStore(), chave_execucao(tipos, query_base, chave, filtro), retomar=retomar
+        )
+        paginas = iter_paginas_keyset(query_base, chave, step, filtro, checkpoint.ultima_chave)
+    else:
+        paginas = iter_paginas_offset(query_total, query_base, step)
+
+    filtros = _filtros(usar_cache, forcar, tipos)
+    fila = FilaRetry(RetryQueue(), tipos) if usar_retry else None
+
+    if filtro:
+        logging.info(f"🧩 Parte de {'/'.join(tipos)}: {filtro}")
+
+    pipeline = criar_pipeline(
+        nome="/".join(tipos),
+        tipos=tipos,
+        cs_client=get_cs_client(),
+        lote_size=lote,
+        extract_workers=extract_workers or workers,
+        send_workers=send_workers or workers,
+        filtros=filtros,
+        checkpoint=checkpoint,
+        fila_retry=fila,
+        orcamento=orcamento
+    )
+    resumo = pipeline.run(paginas, fila.reservar() if fila else None)
+
+    if resumo["paginas"] == 0:
+        logging.info("ℹ️ Nenhuma atualização encontrada. Nada a processar.")
+    return resumo
 
 
 def processar_parceiros(
     step: int,
     lote: int,
     workers: int,
-    query_total: str = None,
-    query_base: str = None
-) -> None:
+    query_base: str = None,
+    extract_workers: Optional[int] = None,
+    send_workers: Optional[int] = None,
+    forcar: bool = False,
+    shard: Optional[Tuple[int, int]] = None,
+    faixa: Optional[Tuple[int, int]] = None,
+    retomar: bool = False
+) -> Dict[str, int]:
     """
     Atualização de parceiros.
-    Se query_total e query_base forem fornecidos, executa envio fragmentado,
-    senão usa queries padrão semanal.
-    """
-    if not query_total or not query_base:
-        query_total = (
-            "SELECT COUNT(CODPARC) "
-            "FROM TGFPAR "
-            "WHERE ATIVO = 'S' "
-            "AND CGC_CPF IS NOT NULL "
-            "AND CLIENTE = 'S'"
-        )
-        query_base = (
-            "SELECT CODPARC "
-            "FROM TGFPAR "
-            "WHERE ATIVO = 'S' "
-            "AND CGC_CPF IS NOT NULL "
-            "AND CLIENTE = 'S' "
-            "ORDER BY CODPARC"
-        )
+    Se query_base for fornecida, executa envio fragmentado,
+    senão usa a query padrão semanal. Paginação por keyset em CODPARC.
+    forcar=True reenvia também os parceiros inalterados.
+    shard=(i, N) / faixa=(inicio, fim) processam só uma parte dos CODPARC.
+    retomar=True continua do checkpoint de uma execução interrompida.
+    """
+    if not query_base:
+        query_base = QUERY_PARCEIROS_ATIVOS
 
-    process_batches(
-        query_total=query_total,
+    return process_batches(
+        query_total=None,
         query_base=query_base,
         step=step,
         lote=lote,
         workers=workers,
-        tipos=['parceiro']
+        tipos=['parceiro'],
+        chave="CODPARC",
+        extract_workers=extract_workers,
+        send_workers=send_workers,
+        forcar=forcar,
+        filtro=filtro_chave("CODPARC", shard, faixa),
+        retomar=retomar
     )
 
 
@@ -131,38 +331,101 @@ def processar_produtos(
     step: int,
     lote: int,
     workers: int,
-    query_total: str = None,
-    query_base: str = None
-) -> None:
+    query_base: str = None,
+    extract_workers: Optional[int] = None,
+    send_workers: Optional[int] = None,
+    forcar: bool = False,
+    shard: Optional[Tuple[int, int]] = None,
+    faixa: Optional[Tuple[int, int]] = None,
+    retomar: bool = False
+) -> Dict[str, int]:
     """
     Atualização de produtos.
-    Se query_total e query_base forem fornecidos, executa envio fragmentado,
-    senão usa queries padrão semanal para dados e estoque.
-    """
-    if not query_total or not query_base:
-        query_total = (
-            "SELECT COUNT(DISTINCT ITE.CODPROD) "
-            "FROM TGFITE ITE "
-            "INNER JOIN TGFCAB CAB ON ITE.NUNOTA = CAB.NUNOTA "
-            "INNER JOIN TGFPRO PRO ON ITE.CODPROD = PRO.CODPROD "
-            "WHERE PRO.ATIVO = 'S' "
-            "AND PRO.USOPROD = 'R'"
-        )
-        query_base = (
-            "SELECT DISTINCT ITE.CODPROD "
-            "FROM TGFITE ITE "
-            "INNER JOIN TGFCAB CAB ON ITE.NUNOTA = CAB.NUNOTA "
-            "INNER JOIN TGFPRO PRO ON ITE.CODPROD = PRO.CODPROD "
-            "WHERE PRO.ATIVO = 'S' "
-            "AND PRO.USOPROD = 'R' "
-            "ORDER BY ITE.CODPROD"
-        )
+    Se query_base for fornecida, executa envio fragmentado,
+    senão usa a query padrão semanal para dados e estoque.
+    Paginação por keyset em CODPROD.
+    forcar=True reenvia também os produtos inalterados.
+    shard=(i, N) / faixa=(inicio, fim) processam só uma parte dos CODPROD.
+    retomar=True continua do checkpoint de uma execução interrompida.
+    """
+    if not query_base:
+        query_base = QUERY_PRODUTOS_ATIVOS
+
+    return process_batches(
+        query_total=None,
+        query_base=query_base,
+        step=step,
+        lote=lote,
+        workers=workers,
+        tipos=['produto', 'estoque'],
+        chave="CODPROD",
+        extract_workers=extract_workers,
+        send_workers=send_workers,
+        forcar=forcar,
+        filtro=filtro_chave("CODPROD", shard, faixa),
+        retomar=retomar
+    )
+
+
+def processar_estoque(
+    step: int,
+    lote: int,
+    workers: int,
+    query_base: str = None,
+    extract_workers: Optional[int] = None,
+    send_workers: Optional[int] = None,
+    forcar: bool = False,
+    retomar: bool = False
+) -> Dict[str, int]:
+    """
+    Atualização só de saldos (Saldos_Atualiza), sem ProdutoUpdate.
+    query_base lista os CODPROD a atualizar (padrão: todos os produtos ativos).
+    Paginação por keyset em CODPROD.
+    forcar=True reenvia também os saldos inalterados.
+    Usa o orçamento de requisições 'estoque' (limitadores 'sankhya:estoque' e
+    'cs:estoque'), separado do ciclo de produtos que roda no mesmo processo.
+    """
+    if not query_base:
+        query_base = QUERY_PRODUTOS_ATIVOS
 
-    process_batches(
-        query_total=query_total,
+    return process_batches(
+        query_total=None,
         query_base=query_base,
         step=step,
         lote=lote,
         workers=workers,
-        tipos=['produto', 'estoque']
+        tipos=['estoque'],
+        chave="CODPROD",
+        extract_workers=extract_workers,
+        send_workers=send_workers,
+        forcar=forcar,
+        retomar=retomar,
+        orcamento="estoque"
+    )
+
+
+def processar_retentativas(
+    tipos: List[str],
+    lote: int,
+    workers: int,
+    forcar: bool = False
+) -> Dict[str, int]:
+    """
+    Reenvia só as entradas vencidas da fila de retentativas, sem listar páginas.
+    Quem falhar de novo volta para a fila com mais uma tentativa.
+    """
+    fila = FilaRetry(RetryQueue(), tipos)
+    reprocessar = fila.reservar()
+    if not reprocessar:
+        logging.info("ℹ️ Nenhuma retentativa vencida na fila.")
+    pipeline = criar_pipeline(
+        nome="retentativas",
+        tipos=tipos,
+        cs_client=get_cs_client(),
+        lote_size=lote,
+        extract_workers=workers,
+        send_workers=workers,
+        filtros=_filtros(True, forcar, tipos),
+        fila_retry=fila
     )
+    return pipeline.run([], reprocessar)
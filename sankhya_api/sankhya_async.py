@@ -0,0 +1,193 @@
+"""
+Transporte assíncrono para o DbExplorer do Sankhya (HTTP_ASYNC=1).
+
+Um único httpx.AsyncClient por processo mantém as conexões keep-alive
+(HTTP/2 quando o pacote h2 estiver instalado e o servidor aceitar), com
+limite de conexões por host configurável. As requisições rodam num event
+loop compartilhado, num thread próprio; os workers do pipeline chamam as
+versões síncronas (fetch_data, fetch_json_lote), que esperam o resultado.
+
+Cada requisição ocupa uma vaga do mesmo AdaptiveLimiter do caminho
+síncrono (o do orçamento do thread que chamou) e alimenta as mesmas
+métricas; montagem da requisição e leitura da resposta são as de
+sankhya_fetch.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, TypeVar
+
+from limitador import AdaptiveLimiter, limiter_atual
+from metricas import metricas
+from sankhya_api import sankhya_fetch
+from sankhya_api.sankhya_fetch import (
+    SNK_MAX_CONNECTIONS, SNK_TIMEOUTS, snk_json_lote_sqls, snk_map_json_rows,
+    snk_parse_rows, snk_request_args, snk_tipo_consulta,
+)
+from utils import util_query_name
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - dependência opcional
+    httpx = None
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _http2_disponivel() -> bool:
+    if os.getenv("HTTP2", "1") != "1":
+        return False
+    try:
+        import h2  # noqa: F401  pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def criar_async_client(max_connections: int, keepalive: Optional[int] = None) -> "httpx.AsyncClient":
+    """Cria um AsyncClient com pool keep-alive limitado a max_connections por host."""
+    if httpx is None:
+        raise RuntimeError("❌ O transporte assíncrono requer o pacote httpx (pip install httpx[http2])")
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=keepalive or max_connections
+    )
+    return httpx.AsyncClient(http2=_http2_disponivel(), limits=limits)
+
+
+def executar(coro: Awaitable[T]) -> T:
+    """Roda a corrotina no event loop compartilhado e espera o resultado no thread atual."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="http-async", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+class AsyncSankhyaClient:
+    """Consultas DbExplorerSP.executeQuery sobre um pool assíncrono compartilhado."""
+
+    def __init__(self, max_connections: int = SNK_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self._client = None
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            self._client = criar_async_client(self.max_connections)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get(self, args: Dict[str, Any], timeout: int, limiter: AdaptiveLimiter) -> "httpx.Response":
+        async with limiter.slot_async() as slot:
+            response = await self.client.request("GET", **args, timeout=timeout)
+            slot.status(response.status_code)
+        return response
+
+    async def fetch_data(self, sql: str, limiter: Optional[AdaptiveLimiter] = None) -> List[list]:
+        """Versão assíncrona de snk_fetch_data, com as mesmas tentativas, timeouts, renovação de token e métricas."""
+        limiter = limiter or limiter_atual("sankhya")
+        snk = sankhya_fetch.snk
+        consulta = snk_tipo_consulta(sql)
+        reautenticou = False
+
+        tentativas = len(SNK_TIMEOUTS)
+        for tentativa in range(1, tentativas + 1):
+            token = await asyncio.to_thread(snk.gerar_token)
+            args = snk_request_args(sql, token)
+            inicio = time.perf_counter()
+            try:
+                response = await self._get(args, SNK_TIMEOUTS[tentativa - 1], limiter)
+                if response.status_code == 401 and not reautenticou:
+                    # Token recusado pelo servidor: repete uma única vez com token novo
+                    metricas.incr("sankhya_requisicoes_total", consulta=consulta, status=401)
+                    reautenticou = True
+                    await asyncio.to_thread(snk.invalidar, token)
+                    args = snk_request_args(sql, await asyncio.to_thread(snk.gerar_token))
+                    response = await self._get(args, SNK_TIMEOUTS[tentativa - 1], limiter)
+                metricas.observar("sankhya_requisicao_segundos", time.perf_counter() - inicio, consulta=consulta)
+                metricas.incr("sankhya_requisicoes_total", consulta=consulta, status=response.status_code)
+                return snk_parse_rows(response.status_code, response.text, response.json)
+
+            except httpx.TimeoutException:
+                metricas.incr("sankhya_requisicoes_total", consulta=consulta, status="timeout")
+                logging.warning(f"⏱️ Timeout na tentativa {tentativa}/{tentativas}")
+            except httpx.HTTPError as e:
+                metricas.incr("sankhya_requisicoes_total", consulta=consulta, status="erro")
+                logging.warning(f"⚠️ Erro de requisição na tentativa {tentativa}/{tentativas}: {e}")
+
+            if tentativa < tentativas:
+                metricas.incr("sankhya_retries_total", consulta=consulta)
+            await asyncio.sleep(tentativa * 2)
+
+        raise Exception(f"❌ Todas as {tentativas} tentativas de consulta falharam.")
+
+    async def fetch_json(self, codigo: Any, tipo: str, limiter: Optional[AdaptiveLimiter] = None) -> Optional[str]:
+        """Versão assíncrona de snk_fetch_json (um código por consulta)."""
+        sql = f"SELECT sankhya.CC_CS_JSON_{util_query_name(tipo)}({codigo})"
+        try:
+            data = await self.fetch_data(sql, limiter)
+            if not data or not data[0]:
+                raise ValueError(f"Nenhum dado retornado para o {tipo} {codigo}")
+            return data[0][0] or ""
+        except Exception as e:
+            logging.error(f"❌ Erro ao buscar JSON do {tipo} {codigo}: {e}")
+            return None
+
+    async def fetch_json_lote(
+        self,
+        codigos: Iterable[Any],
+        tipo: str,
+        limiter: Optional[AdaptiveLimiter] = None
+    ) -> Dict[Any, str]:
+        """Versão assíncrona de snk_fetch_json_lote; os blocos são consultados em paralelo."""
+        originais, blocos = snk_json_lote_sqls(codigos, tipo)
+
+        async def _bloco(n_codigos: int, sql: str):
+            try:
+                return await self.fetch_data(sql, limiter)
+            except Exception as e:
+                logging.error(f"❌ Erro ao buscar JSON em lote de {tipo} ({n_codigos} códigos): {e}")
+                return []
+
+        resultado: Dict[Any, str] = {}
+        for rows in await asyncio.gather(*(_bloco(n, sql) for n, sql in blocos)):
+            snk_map_json_rows(rows, originais, resultado)
+        return resultado
+
+
+_cliente: Optional[AsyncSankhyaClient] = None
+
+
+def get_async_client() -> AsyncSankhyaClient:
+    """AsyncSankhyaClient compartilhado pelo processo (usado só dentro do loop de executar)."""
+    global _cliente
+    with _loop_lock:
+        if _cliente is None:
+            _cliente = AsyncSankhyaClient()
+        return _cliente
+
+
+def fetch_data(sql: str) -> List[list]:
+    """snk_fetch_data pelo transporte assíncrono, no limitador do thread que chamou."""
+    return executar(get_async_client().fetch_data(sql, limiter_atual("sankhya")))
+
+
+def fetch_json(codigo: Any, tipo: str) -> Optional[str]:
+    """snk_fetch_json pelo transporte assíncrono."""
+    return executar(get_async_client().fetch_json(codigo, tipo, limiter_atual("sankhya")))
+
+
+def fetch_json_lote(codigos: Iterable[Any], tipo: str) -> Dict[Any, str]:
+    """snk_fetch_json_lote pelo transporte assíncrono, com os blocos em paralelo."""
+    return executar(get_async_client().fetch_json_lote(codigos, tipo, limiter_atual("sankhya")))
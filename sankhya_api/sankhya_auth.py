@@ -1,18 +1,93 @@
 import os
+import json
+import time
 import requests
 import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: cache em arquivo sem lock
+    fcntl = None
+
 load_dotenv()
 
+# Validade assumida do token quando o /login não informa (segundos)
+SNK_TOKEN_TTL = int(os.getenv("SNK_TOKEN_TTL", "1800"))
+# Antecedência com que o token é renovado antes de vencer
+SNK_TOKEN_MARGEM = int(os.getenv("SNK_TOKEN_MARGEM", "120"))
+# Arquivo compartilhado entre processos ("" desliga)
+SNK_TOKEN_ARQUIVO = os.getenv("SNK_TOKEN_ARQUIVO", ".sankhya_token.json")
+# Timeout do /login (segundos): o login roda com os locks do token, entre threads e processos
+SNK_LOGIN_TIMEOUT = int(os.getenv("SNK_LOGIN_TIMEOUT", "30"))
+
+
 class SankhyaClient:
-    def __init__(self):
+    """
+    Gerencia o bearer token do Sankhya.
+
+    - O token é renovado SNK_TOKEN_MARGEM segundos antes de vencer
+      (expires_in do /login, ou SNK_TOKEN_TTL).
+    - Só um thread faz login por vez; os demais esperam e usam o token novo.
+    - O token fica em SNK_TOKEN_ARQUIVO, sob lock de arquivo, para que
+      processos simultâneos e as próximas execuções reaproveitem a sessão.
+    - invalidar(token) descarta um token recusado (HTTP 401).
+    """
+
+    def __init__(self, arquivo: Optional[str] = None):
         self.token = None
+        self.expira_em = 0.0
+        self.arquivo = SNK_TOKEN_ARQUIVO if arquivo is None else arquivo
+        self._lock = threading.Lock()
 
-    def gerar_token(self):
-        if self.token:
-            return self.token
+    def _valido(self, expira_em: float) -> bool:
+        return time.time() < expira_em - SNK_TOKEN_MARGEM
+
+    @contextmanager
+    def _lock_arquivo(self):
+        """Lock exclusivo entre processos enquanto o cache em arquivo é lido/renovado."""
+        if not self.arquivo or fcntl is None:
+            yield
+            return
+        with open(f"{self.arquivo}.lock", "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _ler_arquivo(self) -> Optional[Dict[str, Any]]:
+        if not self.arquivo:
+            return None
+        try:
+            with open(self.arquivo, encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if dados.get("base_url") != os.getenv("SANKHYA_BASE_URL"):
+            return None
+        return dados
 
+    def _gravar_arquivo(self) -> None:
+        if not self.arquivo:
+            return
+        tmp = f"{self.arquivo}.tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({
+                    "token": self.token,
+                    "expira_em": self.expira_em,
+                    "base_url": os.getenv("SANKHYA_BASE_URL"),
+                }, f)
+            os.replace(tmp, self.arquivo)
+        except OSError as e:
+            logging.warning(f"⚠️ Não foi possível gravar o cache do token em '{self.arquivo}': {e}")
+
+    def _login(self) -> None:
         url = f"{os.getenv('SANKHYA_BASE_URL')}/login"
 
         headers = {
@@ -22,12 +97,53 @@ class SankhyaClient:
             "password": os.getenv("SANKHYA_PASSWORD"),
         }
 
-        response = requests.post(url, headers=headers)
+        try:
+            response = requests.post(url, headers=headers, timeout=SNK_LOGIN_TIMEOUT)
+        except requests.Timeout:
+            # A exceção sai por _lock_arquivo e pelo lock do thread, liberando os dois
+            logging.error(f"⏱️ Login no Sankhya sem resposta em {SNK_LOGIN_TIMEOUT}s")
+            raise
 
         if response.status_code != 200:
             raise Exception(f"Erro ao autenticar: {response.status_code} - {response.text}")
 
         data = response.json()
         self.token = data['bearerToken']
+        self.expira_em = time.time() + int(data.get("expires_in") or SNK_TOKEN_TTL)
         logging.debug("🔐 Token gerado com sucesso.")
-        return self.token
\ No newline at end of file
+
+    def gerar_token(self):
+        if self.token and self._valido(self.expira_em):
+            return self.token
+
+        with self._lock:
+            # Outro thread pode ter renovado enquanto este esperava
+            if self.token and self._valido(self.expira_em):
+                return self.token
+
+            with self._lock_arquivo():
+                dados = self._ler_arquivo()
+                if dados and self._valido(dados.get("expira_em", 0)):
+                    self.token, self.expira_em = dados["token"], dados["expira_em"]
+                    logging.debug("🔐 Token reaproveitado do cache em arquivo.")
+                    return self.token
+
+                self._login()
+                self._gravar_arquivo()
+            return self.token
+
+    def invalidar(self, token: str) -> None:
+        """Descarta o token recusado pelo Sankhya, se ainda for o atual."""
+        with self._lock:
+            if token != self.token:
+                return
+            logging.warning("🔐 Token recusado pelo Sankhya; será gerado um novo.")
+            self.token = None
+            self.expira_em = 0.0
+            with self._lock_arquivo():
+                dados = self._ler_arquivo()
+                if dados and dados.get("token") == token and self.arquivo:
+                    try:
+                        os.remove(self.arquivo)
+                    except OSError:
+                        pass
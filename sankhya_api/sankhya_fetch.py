@@ -1,71 +1,271 @@
 import logging
 import os
 import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 import requests
 from requests import RequestException, Timeout
+from requests.adapters import HTTPAdapter
+from limitador import limiter_atual
+from metricas import metricas
 from sankhya_api.sankhya_auth import SankhyaClient
-from utils import util_query_name
+from utils import util_query_name, util_query_key
 
 snk = SankhyaClient()
 
+# Conexões keep-alive reaproveitadas por todas as consultas (por host)
+SNK_MAX_CONNECTIONS = int(os.getenv("SNK_MAX_CONNECTIONS", "50"))
+SNK_TIMEOUTS = [int(t) for t in os.getenv("SNK_TIMEOUTS", "60,90,120,150,180").split(",")]
 
-def snk_fetch_data(sql):
-    url = f"{os.getenv('SANKHYA_BASE_URL')}/gateway/v1/mge/service.sbr"
-    token = snk.gerar_token()
+# Limites de cada consulta em lote (tamanho do texto SQL e quantidade de códigos)
+SNK_MAX_SQL_CHARS = int(os.getenv("SNK_MAX_SQL_CHARS", "4000"))
+SNK_MAX_CODIGOS_LOTE = int(os.getenv("SNK_MAX_CODIGOS_LOTE", "200"))
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
+# Transporte assíncrono (httpx, HTTP/2 se disponível) para Sankhya e CS: ver sankhya_async
+HTTP_ASYNC = os.getenv("HTTP_ASYNC", "0") == "1"
 
-    params = {
-        "serviceName": "DbExplorerSP.executeQuery",
-        "outputType": "json"
-    }
 
-    payload = {
-        "serviceName": "DbExplorerSP.executeQuery",
-        "requestBody": {
-            "sql": sql
-        }
+def _init_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SNK_MAX_CONNECTIONS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = _init_session()
+
+
+def snk_request_args(sql: str, token: str) -> Dict[str, Any]:
+    """Monta url, headers, params e corpo de uma DbExplorerSP.executeQuery."""
+    return {
+        "url": f"{os.getenv('SANKHYA_BASE_URL')}/gateway/v1/mge/service.sbr",
+        "headers": {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token}"
+        },
+        "params": {
+            "serviceName": "DbExplorerSP.executeQuery",
+            "outputType": "json"
+        },
+        "json": {
+            "serviceName": "DbExplorerSP.executeQuery",
+            "requestBody": {
+                "sql": sql
+            }
+        },
     }
 
-    tentativas = 5
-    timeout = [60, 90, 120, 150, 180]
-    for tentativa in range(1, tentativas + 1):
-        try:
-            response = requests.get(url, headers=headers, params=params, json=payload, timeout=timeout[tentativa-1])
 
-            if response.status_code != 200:
-                raise Exception(f"Erro ao consultar parceiros: {response.status_code} - {response.text}")
+def snk_parse_rows(status_code: int, text: str, data_fn) -> List[list]:
+    """Valida a resposta do DbExplorer e devolve as linhas."""
+    if status_code != 200:
+        raise Exception(f"Erro ao consultar parceiros: {status_code} - {text}")
+    data = data_fn()
+    return data['responseBody']['rows']
+
+
+def snk_tipo_consulta(sql: str) -> str:
+    """Classifica a consulta para as métricas: json_lote, json, contagem ou listagem."""
+    if "CC_CS_JSON_" in sql:
+        return "json_lote" if " IN (" in sql else "json"
+    if "COUNT(" in sql.upper():
+        return "contagem"
+    return "listagem"
 
-            data = response.json()
-            return data['responseBody']['rows']
+
+def _snk_get(args: Dict[str, Any], timeout: int) -> requests.Response:
+    with limiter_atual("sankhya").slot() as slot:
+        response = _session.get(**args, timeout=timeout)
+        slot.status(response.status_code)
+    return response
+
+
+def snk_fetch_data(sql):
+    if HTTP_ASYNC:
+        from sankhya_api.sankhya_async import fetch_data  # pylint: disable=import-outside-toplevel
+        return fetch_data(sql)
+
+    consulta = snk_tipo_consulta(sql)
+    reautenticou = False
+
+    tentativas = len(SNK_TIMEOUTS)
+    for tentativa in range(1, tentativas + 1):
+        # Token obtido a cada tentativa: renovações feitas no meio do caminho valem
+        token = snk.gerar_token()
+        args = snk_request_args(sql, token)
+        inicio = time.perf_counter()
+        try:
+            response = _snk_get(args, SNK_TIMEOUTS[tentativa-1])
+            if response.status_code == 401 and not reautenticou:
+                # Token recusado pelo servidor: repete uma única vez com token novo
+                metricas.incr("sankhya_requisicoes_total", consulta=consulta, status=401)
+                reautenticou = True
+                snk.invalidar(token)
+                args = snk_request_args(sql, snk.gerar_token())
+                response = _snk_get(args, SNK_TIMEOUTS[tentativa-1])
+            metricas.observar("sankhya_requisicao_segundos", time.perf_counter() - inicio, consulta=consulta)
+            metricas.incr("sankhya_requisicoes_total", consulta=consulta, status=response.status_code)
+            return snk_parse_rows(response.status_code, response.text, response.json)
 
         except Timeout:
+            metricas.incr("sankhya_requisicoes_total", consulta=consulta, status="timeout")
             logging.warning(f"⏱️ Timeout na tentativa {tentativa}/{tentativas}")
         except RequestException as e:
+            metricas.incr("sankhya_requisicoes_total", consulta=consulta, status="erro")
             logging.warning(f"⚠️ Erro de requisição na tentativa {tentativa}/{tentativas}: {e}")
 
+        if tentativa < tentativas:
+            metricas.incr("sankhya_retries_total", consulta=consulta)
         time.sleep(tentativa * 2)
 
     raise Exception(f"❌ Todas as {tentativas} tentativas de consulta falharam.")
 
 
-def snk_fetch_json(codigo: int, tipo: str) -> str:
+def snk_fetch_json(codigo: int, tipo: str) -> Optional[str]:
+    """
+    JSON de um código; "" se a função devolver NULL ou vazio (o código não
+    tem o que enviar, como no lote) e None se a consulta falhar ou não
+    trouxer linha.
+    """
     # Define que tipo de consulta será feito no banco
     query = util_query_name(tipo)
-    logging.info(f"🔍 Buscando dados do {tipo} {codigo}")
+    logging.debug("🔍 Buscando dados do %s %s", tipo, codigo)
     sql = f"SELECT sankhya.CC_CS_JSON_{query}({codigo})"
     try:
         data = snk_fetch_data(sql)
 
         if not data or not data[0]:
             raise ValueError(f"Nenhum dado retornado para o {tipo} {codigo}")
-        row = data[0][0]
+        row = data[0][0] or ""
         # logging.debug(f"🔹 Json do {tipo} {codigo}: {row}")
         return row
     except Exception as e:
         logging.error(f"❌ Erro ao buscar JSON do {tipo} {codigo}: {e}")
-        return ""
+        return None
+
+
+def _chunk_codigos(codigos: List[int], max_chars: int, max_codigos: int) -> Iterable[List[int]]:
+    """Agrupa códigos em blocos cuja lista IN (...) cabe no limite da requisição."""
+    bloco: List[int] = []
+    tamanho = 0
+    for codigo in codigos:
+        item = len(str(codigo)) + 1
+        if bloco and (tamanho + item > max_chars or len(bloco) >= max_codigos):
+            yield bloco
+            bloco, tamanho = [], 0
+        bloco.append(codigo)
+        tamanho += item
+    if bloco:
+        yield bloco
+
+
+def snk_fetch_json_lote(codigos: Iterable[Any], tipo: str) -> Dict[Any, str]:
+    """
+    Busca o JSON de vários códigos com uma consulta por bloco
+    (SELECT CHAVE, sankhya.CC_CS_JSON_X(CHAVE) ... WHERE CHAVE IN (...)).
+    Retorna {codigo: json}, com "" para os códigos cuja função não trouxe
+    nada; códigos de blocos que falharam, ou sem linha no resultado, ficam
+    fora do mapa para que o chamador use snk_fetch_json como fallback.
+    Com HTTP_ASYNC, os blocos são consultados em paralelo (sankhya_async).
+    """
+    if HTTP_ASYNC:
+        from sankhya_api.sankhya_async import fetch_json_lote  # pylint: disable=import-outside-toplevel
+        return fetch_json_lote(codigos, tipo)
+
+    originais, blocos = snk_json_lote_sqls(codigos, tipo)
+
+    resultado: Dict[Any, str] = {}
+    for n_codigos, sql in blocos:
+        logging.debug(f"🔍 Buscando dados de {n_codigos} {tipo}(s) em lote")
+        try:
+            rows = snk_fetch_data(sql)
+        except Exception as e:
+            logging.error(f"❌ Erro ao buscar JSON em lote de {tipo} ({n_codigos} códigos): {e}")
+            continue
+        snk_map_json_rows(rows, originais, resultado)
+
+    return resultado
+
+
+def snk_fetch_json_multi(codigos: Iterable[Any], tipos: List[str]) -> Dict[str, Dict[Any, str]]:
+    """
+    Busca os JSON de vários tipos da mesma tabela (ex.: produto e estoque)
+    numa única consulta por bloco, uma coluna CC_CS_JSON_X por tipo.
+    Retorna {tipo: {codigo: json}}; como em snk_fetch_json_lote, coluna
+    NULL vira "" e o que faltar fica fora do mapa para o fallback individual.
+    """
+    originais, blocos = snk_json_lote_sqls(codigos, tipos)
+
+    resultado: Dict[str, Dict[Any, str]] = {tipo: {} for tipo in tipos}
+    for n_codigos, sql in blocos:
+        logging.debug(f"🔍 Buscando {'+'.join(tipos)} de {n_codigos} código(s) em lote")
+        try:
+            rows = snk_fetch_data(sql)
+        except Exception as e:
+            logging.error(f"❌ Erro ao buscar JSON em lote de {'+'.join(tipos)} ({n_codigos} códigos): {e}")
+            continue
+        for i, tipo in enumerate(tipos):
+            snk_map_json_rows(rows, originais, resultado[tipo], coluna=i + 1)
+
+    return resultado
+
+
+def snk_json_lote_sqls(
+    codigos: Iterable[Any],
+    tipos: Union[str, List[str]]
+) -> Tuple[Dict[int, Any], List[Tuple[int, str]]]:
+    """
+    Monta as consultas em bloco de snk_fetch_json_lote / snk_fetch_json_multi:
+    uma coluna CC_CS_JSON_X por tipo, todos da mesma tabela e chave.
+    Retorna o mapa {código numérico: código original} e [(n_codigos, sql)].
+    """
+    tipos = [tipos] if isinstance(tipos, str) else list(tipos)
+    tabela, chave = util_query_key(tipos[0])
+    if any(util_query_key(t) != (tabela, chave) for t in tipos):
+        raise ValueError(f"Tipos de tabelas diferentes não podem ser buscados juntos: {tipos}")
+    colunas = ", ".join(f"sankhya.CC_CS_JSON_{util_query_name(t)}({chave})" for t in tipos)
+    tipo = "+".join(tipos)
+
+    # Mapeia o código numérico de volta para o valor original recebido
+    originais: Dict[int, Any] = {}
+    for codigo in codigos:
+        try:
+            originais.setdefault(int(codigo), codigo)
+        except (TypeError, ValueError):
+            logging.warning(f"⚠️ Código inválido de {tipo} ignorado no lote: {codigo!r}")
+
+    # Reserva espaço para o restante do SELECT dentro do limite
+    sql_base = f"SELECT {chave}, {colunas} FROM {tabela} WHERE {chave} IN ()"
+    max_chars = max(SNK_MAX_SQL_CHARS - len(sql_base), 1)
+
+    blocos = []
+    for bloco in _chunk_codigos(list(originais), max_chars, SNK_MAX_CODIGOS_LOTE):
+        lista = ",".join(str(c) for c in bloco)
+        blocos.append((
+            len(bloco),
+            f"SELECT {chave}, {colunas} "
+            f"FROM {tabela} WHERE {chave} IN ({lista})"
+        ))
+    return originais, blocos
+
+
+def snk_map_json_rows(
+    rows: List[list],
+    originais: Dict[int, Any],
+    resultado: Dict[Any, str],
+    coluna: int = 1
+) -> None:
+    """
+    Copia o json da `coluna` de cada linha (código, json...) para o resultado,
+    pelo código original. Coluna NULL vira "": o código existe, mas não tem o
+    que enviar (o mesmo que snk_fetch_json devolve nesse caso).
+    """
+    for row in rows or []:
+        if not row or len(row) <= coluna:
+            continue
+        try:
+            original = originais[int(row[0])]
+        except (TypeError, ValueError, KeyError):
+            continue
+        resultado[original] = row[coluna] or ""
@@ -1,15 +1,58 @@
+"""
+Notificações para o Telegram.
+
+enviar_notificacao_telegram envia na hora, com timeout. Para não travar as
+execuções, os fluxos usam notificar(), que só enfileira a mensagem: um
+thread em segundo plano envia respeitando o intervalo mínimo entre mensagens
+(TELEGRAM_INTERVALO) e o retry_after de uma resposta 429. Alertas enfileirados
+com agrupar=True dentro de TELEGRAM_JANELA segundos viram um único resumo, com
+as contagens e a vazão de extração e envio no período. flush_notificacoes()
+(chamado também na saída do processo) espera a fila esvaziar, para a
+mensagem final chegar.
+"""
+import atexit
 import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 
 import requests
-import os
 from dotenv import load_dotenv
 
+from metricas import metricas
+
 # Carregar variáveis de ambiente do arquivo .env
 load_dotenv()
 
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "10"))
+# Mensagens aguardando envio; cheia, a mais antiga é descartada
+TELEGRAM_FILA_MAX = int(os.getenv("TELEGRAM_FILA_MAX", "100"))
+# Intervalo mínimo entre mensagens (o Telegram limita ~20 mensagens/min por grupo)
+TELEGRAM_INTERVALO = float(os.getenv("TELEGRAM_INTERVALO", "3"))
+# Alertas agrupáveis dentro desta janela viram um resumo só
+TELEGRAM_JANELA = float(os.getenv("TELEGRAM_JANELA", "30"))
+# Espera máxima por flush_notificacoes (e na saída do processo)
+TELEGRAM_FLUSH_SEGUNDOS = float(os.getenv("TELEGRAM_FLUSH_SEGUNDOS", "20"))
 
-# Função para enviar notificação para o Telegram
-def enviar_notificacao_telegram(mensagem):
+# Limite de caracteres de uma mensagem do Telegram
+TELEGRAM_MAX_CHARS = 4096
+# Alertas distintos listados no resumo
+RESUMO_MAX_LINHAS = 10
+
+# Contadores usados na vazão do resumo: (rótulo, métrica, unidade)
+_VAZAO = (
+    ("extração", "codigos_extraidos_total", "códigos"),
+    ("envio", "registros_enviados_total", "registros"),
+)
+
+
+def _post_telegram(mensagem: str, timeout: float = TELEGRAM_TIMEOUT) -> Tuple[Optional[bool], float]:
+    """
+    Envia a mensagem; retorna (sucesso, segundos a esperar antes de tentar de novo).
+    sucesso é None em erro de rede e o retry_after só vem em HTTP 429.
+    """
     token = os.getenv('BOTTOKEN')  # Seu Token do Bot
     chat_id = os.getenv('CHATID')  # O chat_id do destinatário
     url = f"https://api.telegram.org/bot{token}/sendMessage"
@@ -17,19 +60,199 @@ def enviar_notificacao_telegram(mensagem):
     # Dados a serem enviados
     payload = {
         'chat_id': chat_id,
-        'text': mensagem,
+        'text': mensagem[:TELEGRAM_MAX_CHARS],
         "parse_mode": "HTML"
     }
 
     # Enviar a requisição para o Telegram
     try:
-        response = requests.post(url, data=payload)
-        if response.status_code == 200:
-            logging.info("Notificação enviada com sucesso!")
-            return True
-        else:
-            logging.warning(f"Falha ao enviar notificação: {response.status_code}")
-            return False
+        response = requests.post(url, data=payload, timeout=timeout)
     except requests.exceptions.RequestException as e:
         logging.error(f"Ocorreu um erro: {e}")
-        return None
+        return None, 0.0
+    if response.status_code == 200:
+        logging.info("Notificação enviada com sucesso!")
+        return True, 0.0
+    espera = 0.0
+    if response.status_code == 429:
+        try:
+            espera = float(response.json().get("parameters", {}).get("retry_after", 1))
+        except (ValueError, AttributeError):
+            espera = 1.0
+    logging.warning(f"Falha ao enviar notificação: {response.status_code}")
+    return False, espera
+
+
+# Função para enviar notificação para o Telegram
+def enviar_notificacao_telegram(mensagem, timeout: float = TELEGRAM_TIMEOUT):
+    """Envia na hora (bloqueia até `timeout`); True/False pelo status, None em erro de rede."""
+    return _post_telegram(mensagem, timeout)[0]
+
+
+def _contadores_vazao() -> Dict[str, float]:
+    contadores = metricas.resumo()["contadores"]
+    return {
+        metrica: sum(v for nome, v in contadores.items() if nome.split("[")[0] == metrica)
+        for _, metrica, _ in _VAZAO
+    }
+
+
+class NotificadorTelegram:
+    """Fila de notificações enviada por um thread em segundo plano."""
+
+    def __init__(
+        self,
+        enviar_fn: Callable[[str], Tuple[Optional[bool], float]] = _post_telegram,
+        intervalo: float = TELEGRAM_INTERVALO,
+        janela: float = TELEGRAM_JANELA,
+        fila_max: int = TELEGRAM_FILA_MAX
+    ):
+        self.enviar_fn = enviar_fn
+        self.intervalo = intervalo
+        self.janela = janela
+        self.fila_max = max(1, fila_max)
+        self._cond = threading.Condition()
+        # (instante, texto) das mensagens avulsas e dos alertas que aguardam o resumo
+        self._mensagens: Deque[Tuple[float, str]] = deque()
+        self._alertas: List[Tuple[float, str]] = []
+        self._enviando = False
+        self._drenar = False
+        self._ativo = False
+        self._ultimo_envio = 0.0
+        self._base_vazao = (time.time(), _contadores_vazao())
+        self.enviadas = 0
+        self.descartadas = 0
+
+    def notificar(self, mensagem: str, agrupar: bool = False) -> None:
+        """Enfileira sem bloquear; agrupar=True junta o alerta aos da mesma janela."""
+        with self._cond:
+            if len(self._mensagens) + len(self._alertas) >= self.fila_max:
+                self.descartadas += 1
+                metricas.incr("telegram_descartadas_total")
+                if self._alertas:
+                    self._alertas.pop(0)
+                else:
+                    self._mensagens.popleft()
+            (self._alertas if agrupar else self._mensagens).append((time.time(), mensagem))
+            if not self._ativo:
+                self._ativo = True
+                threading.Thread(target=self._rodar, name="telegram", daemon=True).start()
+            self._cond.notify_all()
+
+    def _resumo_alertas(self) -> str:
+        """Junta os alertas pendentes num resumo, com a vazão desde o último resumo."""
+        alertas, self._alertas = self._alertas, []
+        if len(alertas) == 1:
+            return alertas[0][1]
+
+        agora = time.time()
+        inicio, base = self._base_vazao
+        atual = _contadores_vazao()
+        self._base_vazao = (agora, atual)
+        periodo = max(agora - inicio, 1e-3)
+
+        contagem = Counter(texto for _, texto in alertas)
+        linhas = [f"⚠️ {len(alertas)} alertas em {agora - alertas[0][0]:.0f}s:"]
+        for texto, n in contagem.most_common(RESUMO_MAX_LINHAS):
+            linhas.append(f"• {texto}" + (f" (x{n})" if n > 1 else ""))
+        if len(contagem) > RESUMO_MAX_LINHAS:
+            linhas.append(f"… e mais {len(contagem) - RESUMO_MAX_LINHAS} alerta(s) diferentes")
+        vazao = [
+            f"{rotulo}: {atual[metrica] - base[metrica]:.0f} {unidade} "
+            f"({(atual[metrica] - base[metrica]) / periodo:.1f}/s)"
+            for rotulo, metrica, unidade in _VAZAO
+        ]
+        linhas.append("📈 " + " | ".join(vazao))
+        return "\n".join(linhas)
+
+    def _proxima(self) -> Tuple[Optional[str], float]:
+        """
+        (mensagem pronta para envio, segundos até haver uma), na ordem de chegada:
+        o resumo dos alertas sai quando a janela fecha (ou no flush). Chamar com o lock.
+        """
+        falta = 60.0
+        if self._alertas:
+            falta = 0.0 if self._drenar else self._alertas[0][0] + self.janela - time.time()
+            if falta <= 0 and not (self._mensagens and self._mensagens[0][0] < self._alertas[0][0]):
+                return self._resumo_alertas(), 0.0
+        if self._mensagens:
+            return self._mensagens.popleft()[1], 0.0
+        return None, falta
+
+    def _rodar(self) -> None:
+        while True:
+            with self._cond:
+                mensagem, espera = self._proxima()
+                while mensagem is None:
+                    if not self._cond.wait(espera) and not self._mensagens and not self._alertas:
+                        # Ocioso por um tempo: o thread termina e volta no próximo notificar()
+                        self._ativo = False
+                        return
+                    mensagem, espera = self._proxima()
+                self._enviando = True
+
+            try:
+                pausa = self._ultimo_envio + self.intervalo - time.time()
+                if pausa > 0:
+                    time.sleep(pausa)
+                ok, retry_after = self.enviar_fn(mensagem)
+                self._ultimo_envio = time.time()
+                if retry_after:
+                    # Limite do Telegram: volta para o início da fila e espera o pedido
+                    with self._cond:
+                        self._mensagens.appendleft((0.0, mensagem))
+                    time.sleep(min(retry_after, TELEGRAM_FLUSH_SEGUNDOS))
+                elif ok:
+                    self.enviadas += 1
+                resultado = "ok" if ok else ("limite" if retry_after else "falha")
+                metricas.incr("telegram_mensagens_total", resultado=resultado)
+            except Exception as e:
+                logging.error(f"❌ Erro no envio de notificação: {e}")
+            finally:
+                with self._cond:
+                    self._enviando = False
+                    self._cond.notify_all()
+
+    def flush(self, timeout: float = TELEGRAM_FLUSH_SEGUNDOS) -> bool:
+        """Envia já os alertas da janela e espera a fila esvaziar; False se estourou o timeout."""
+        limite = time.time() + timeout
+        with self._cond:
+            self._drenar = True
+            self._cond.notify_all()
+            try:
+                while self._mensagens or self._alertas or self._enviando:
+                    falta = limite - time.time()
+                    if falta <= 0:
+                        pendentes = len(self._mensagens) + len(self._alertas)
+                        logging.warning(f"⚠️ {pendentes} notificação(ões) não enviadas a tempo")
+                        return False
+                    self._cond.wait(min(falta, 0.5))
+                return True
+            finally:
+                self._drenar = False
+
+
+_notificador: Optional[NotificadorTelegram] = None
+_notificador_lock = threading.Lock()
+
+
+def get_notificador() -> NotificadorTelegram:
+    """Notificador compartilhado do processo, drenado na saída (atexit)."""
+    global _notificador
+    with _notificador_lock:
+        if _notificador is None:
+            _notificador = NotificadorTelegram()
+            atexit.register(flush_notificacoes)
+        return _notificador
+
+
+def notificar(mensagem: str, agrupar: bool = False) -> None:
+    """Enfileira a notificação no notificador compartilhado (não bloqueia)."""
+    get_notificador().notificar(mensagem, agrupar=agrupar)
+
+
+def flush_notificacoes(timeout: float = TELEGRAM_FLUSH_SEGUNDOS) -> bool:
+    """Espera as notificações pendentes serem enviadas, até `timeout` segundos."""
+    if _notificador is None:
+        return True
+    return _notificador.flush(timeout)
@@ -0,0 +1,40 @@
+import sys
+import os
+
+import pytest
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import estado
+import metricas
+from benchmarks.fake_servers import FakeServers
+from icorp_api import cs_sender
+from sankhya_api import sankhya_fetch
+from sankhya_api.sankhya_auth import SankhyaClient
+
+
+@pytest.fixture
+def fake_servers(monkeypatch, tmp_path):
+    """
+    Sobe Sankhya e CS locais (FakeServers) com a FakeConfig recebida e isola o
+    teste: URLs via monkeypatch.setenv, estado e métricas em tmp_path, token
+    sem cache em arquivo e CSClient compartilhado recriado para o servidor local.
+    Tudo é desfeito ao fim do teste.
+    """
+    servidores = []
+
+    def _subir(config=None) -> FakeServers:
+        fake = FakeServers(config).start()
+        servidores.append(fake)
+        for nome, valor in fake.env().items():
+            monkeypatch.setenv(nome, valor)
+        monkeypatch.setattr(estado, "ESTADO_DB", str(tmp_path / "estado.db"))
+        monkeypatch.setattr(metricas, "METRICAS_DIR", str(tmp_path / "metricas"))
+        monkeypatch.setattr(sankhya_fetch, "snk", SankhyaClient(arquivo=""))
+        monkeypatch.setattr(cs_sender, "_cs_client", None)
+        return fake
+
+    yield _subir
+    for fake in servidores:
+        fake.stop()
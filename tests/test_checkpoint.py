@@ -0,0 +1,89 @@
+import sys
+import os
+import tempfile
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import estado
+import processamentos
+from benchmarks.fake_servers import FakeConfig
+
+
+def test_resume_continua_da_ultima_pagina_concluida(fake_servers, monkeypatch):
+    config = FakeConfig(n_parceiros=100, latencia_sankhya=0, latencia_cs=0)
+    fake = fake_servers(config)
+
+    original = processamentos.iter_paginas_keyset
+
+    def _cai_na_terceira_pagina(*args, **kwargs):
+        for i, pagina in enumerate(original(*args, **kwargs)):
+            if i == 2:
+                raise RuntimeError("queda simulada")
+            yield pagina
+
+    monkeypatch.setattr(processamentos, "iter_paginas_keyset", _cai_na_terceira_pagina)
+    resumo = processamentos.processar_parceiros(20, 10, 2, forcar=True)
+    assert resumo["interrompido"] == 1
+    assert resumo["registros"] == 40
+
+    monkeypatch.setattr(processamentos, "iter_paginas_keyset", original)
+    resumo = processamentos.processar_parceiros(20, 10, 2, forcar=True, retomar=True)
+    assert resumo["interrompido"] == 0
+    assert resumo["registros"] == 60
+    assert fake.stats.resumo()["Cliente"]["registros"] == 100
+
+    # Execução completa: o próximo --resume começa do início
+    resumo = processamentos.processar_parceiros(20, 10, 2, forcar=True, retomar=True)
+    assert resumo["registros"] == 100
+
+
+def test_codigos_confirmados_de_pagina_incompleta_sao_pulados():
+    from checkpoint import Checkpoint
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = estado.CheckpointStore(os.path.join(tmp, "estado.db"))
+        cp = Checkpoint(store, "parceiro:abc")
+        cp.pagina_listada(0, [1, 2], {"parceiro": [1, 2]})
+        cp.pagina_listada(1, [3, 4], {"parceiro": [3, 4]})
+        cp.concluidos("parceiro", [3])
+        cp.concluidos("parceiro", [1, 2])
+        cp.falharam("parceiro", [4])
+        cp.finalizar(interrompido=True)
+
+        retomado = Checkpoint(store, "parceiro:abc", retomar=True)
+        assert retomado.ultima_chave == "2"
+        assert retomado.pendentes("parceiro", [3, 4]) == [4]
+
+
+def test_falha_na_primeira_pagina_nao_perde_o_progresso_na_retomada():
+    from checkpoint import Checkpoint
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = estado.CheckpointStore(os.path.join(tmp, "estado.db"))
+        cp = Checkpoint(store, "parceiro:abc")
+        cp.pagina_listada(0, [1, 2, 3], {"parceiro": [1, 2, 3]})
+        cp.pagina_listada(1, [4, 5, 6], {"parceiro": [4, 5, 6]})
+        cp.concluidos("parceiro", [1, 3, 4, 5, 6])
+        cp.falharam("parceiro", [2])  # sem fila de retentativas: segura a página 0
+        cp.finalizar(interrompido=True)
+        assert store.carregar("parceiro:abc") is None
+
+        # Sem linha no checkpoint, a retomada ainda pula os confirmados
+        retomado = Checkpoint(store, "parceiro:abc", retomar=True)
+        assert retomado.ultima_chave is None
+        assert retomado.pendentes("parceiro", [1, 2, 3, 4, 5, 6]) == [2]
+
+
+def test_falha_guardada_na_fila_nao_segura_a_pagina():
+    from checkpoint import Checkpoint
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = estado.CheckpointStore(os.path.join(tmp, "estado.db"))
+        cp = Checkpoint(store, "parceiro:abc")
+        cp.pagina_listada(0, [1, 2], {"parceiro": [1, 2]})
+        cp.pagina_listada(1, [3, 4], {"parceiro": [3, 4]})
+        cp.falharam("parceiro", [2], guardados=True)
+        cp.concluidos("parceiro", [1, 3, 4])
+        assert cp.ultima_chave == 4
+        assert store.carregar("parceiro:abc")["paginas"] == 2
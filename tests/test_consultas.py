@@ -0,0 +1,65 @@
+import sys
+import os
+import re
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from consultas import CONSULTA_ESTOQUE, CONSULTA_PARCEIROS, CONSULTA_PRODUTOS, JanelaTempo, Ramo
+
+JANELA = JanelaTempo(15, desde="2026-01-01T10:00:00", ate="2026-01-01T10:15:00")
+
+
+def _ramos(sql):
+    assert sql.count("ORDER BY") == 1
+    return re.sub(r" ORDER BY \w+$", "", sql).split(" UNION ")
+
+
+def test_janela_com_e_sem_watermark():
+    assert JanelaTempo(15).predicado("DTALTER") == "DTALTER >= DATEADD(MINUTE, -15, GETDATE())"
+    assert JANELA.predicado("CAB.DTALTER") == (
+        "CAB.DTALTER > '2026-01-01T10:00:00' AND CAB.DTALTER <= '2026-01-01T10:15:00'"
+    )
+    # Margem de segurança: a janela recua antes do watermark anterior
+    assert JanelaTempo(15, "2026-01-01T10:00:00", "2026-01-01T10:15:00", 300).predicado("DTALTER") == (
+        "DTALTER > DATEADD(SECOND, -300, '2026-01-01T10:00:00') AND DTALTER <= '2026-01-01T10:15:00'"
+    )
+    # Primeira execução com watermark: `minutos` antes do horário do Sankhya
+    assert JanelaTempo(30, ate="2026-01-01T10:15:00").predicado("DTALTER") == (
+        "DTALTER > DATEADD(MINUTE, -30, '2026-01-01T10:15:00') AND DTALTER <= '2026-01-01T10:15:00'"
+    )
+
+
+def test_parceiros():
+    assert CONSULTA_PARCEIROS.sql(JANELA) == (
+        "SELECT CODPARC FROM TGFPAR "
+        "WHERE DTALTER > '2026-01-01T10:00:00' AND DTALTER <= '2026-01-01T10:15:00' "
+        "ORDER BY CODPARC"
+    )
+
+
+def test_produtos_filtram_cada_ramo_pela_sua_coluna():
+    ramos = _ramos(CONSULTA_PRODUTOS.sql(JANELA))
+    assert len(ramos) == 3
+    cadastro, notas, exclusoes = ramos
+    assert cadastro.startswith("SELECT PRO.CODPROD FROM TGFPRO PRO WHERE PRO.DTALTER > '2026-01-01T10:00:00'")
+    assert "INNER JOIN TGFCAB CAB" in notas
+    assert notas.endswith(
+        "WHERE CAB.DTALTER > '2026-01-01T10:00:00' AND CAB.DTALTER <= '2026-01-01T10:15:00'"
+    )
+    assert exclusoes.endswith(
+        "FROM TSILGT WHERE NOMETAB = 'TGFEXC' "
+        "AND DTALTER > '2026-01-01T10:00:00' AND DTALTER <= '2026-01-01T10:15:00'"
+    )
+
+
+def test_estoque_so_notas_e_exclusoes():
+    ramos = _ramos(CONSULTA_ESTOQUE.sql(JanelaTempo(2)))
+    assert len(ramos) == 2
+    assert "TGFPRO" not in " ".join(ramos)
+    assert all("DATEADD(MINUTE, -2, GETDATE())" in r for r in ramos)
+
+
+def test_sem_janela_nao_ha_filtro_de_tempo():
+    assert Ramo("CODPARC", "TGFPAR", "DTALTER").sql(None) == "SELECT CODPARC FROM TGFPAR"
+    assert "DTALTER" not in CONSULTA_PRODUTOS.sql().replace("NOMETAB", "")
@@ -0,0 +1,109 @@
+import sys
+import os
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import processamentos
+from benchmarks.fake_servers import FakeConfig
+from estado import RetryQueue
+from icorp_api import cs_sender
+from icorp_api.cs_sender import ResultadoCS, enviar_registros, interpretar_resposta, orcamento_bisseccao
+
+
+def test_interpretar_resposta_por_registro_e_do_lote_inteiro():
+    resultado = interpretar_resposta(
+        {"Sucesso": False, "Itens": [{"Sucesso": True}, {"Sucesso": False, "Mensagem": "CPF inválido"}]}, 2
+    )
+    assert resultado.erro is None
+    assert resultado.aceitos == [0]
+    assert resultado.rejeitados == {1: "CPF inválido"}
+
+    resultado = interpretar_resposta([{"Status": "OK"}, {"Status": "Erro", "Erro": "timeout"}], 2)
+    assert resultado.rejeitados == {1: "timeout"}
+
+    # Sem retorno por registro: vale para o lote inteiro
+    resultado = interpretar_resposta({"Sucesso": False, "Mensagem": "Erro ao processar"}, 3)
+    assert resultado.erro == "Erro ao processar"
+    assert resultado.aceitos == []
+
+    assert interpretar_resposta({"Sucesso": True, "Quantidade": 3}, 3).ok
+    assert interpretar_resposta(None, 3).ok
+
+
+def test_recusas_isoladas_por_registro_e_bisseccao(fake_servers):
+    config = FakeConfig(
+        n_parceiros=30, latencia_sankhya=0, latencia_cs=0,
+        codigos_recusados={5}, codigos_transitorios={9}, codigos_opacos={17}
+    )
+    fake = fake_servers(config)
+
+    resumo = processamentos.processar_parceiros(10, 10, 2, forcar=True)
+    assert resumo["lotes_com_falha"] == 0
+    assert resumo["registros_recusados"] == 2
+
+    # Só os dois registros ruins ficaram de fora; o transitório passou no reenvio
+    assert fake.stats.resumo()["Cliente"]["registros"] == 28
+    erros = {int(e["codigo"]): e["erro"] for e in RetryQueue().listar()}
+    assert erros == {
+        5: "envio: registro recusado: Registro 5 inválido",
+        17: "envio: registro recusado: Erro ao processar o lote",
+    }
+
+
+def test_endpoint_que_recusa_gzip_recebe_o_corpo_simples(fake_servers):
+    config = FakeConfig(latencia_cs=0, endpoints_sem_gzip={"ProdutoUpdate"})
+    fake = fake_servers(config)
+    produtos = [{"CODPROD": c, "DESCRPROD": f"Produto {c}"} for c in range(1, 21)]
+    # Compressão é opt-in: o cliente padrão manda corpo simples
+    assert cs_sender.CSClient(compress_min_bytes=1).preparar_corpo(produtos, "produto")[1] == {}
+    cliente = cs_sender.CSClient(compress=True, compress_min_bytes=1, max_retries=0)
+
+    # 415 ao corpo gzip: reenvio sem compressão, sem gastar tentativa, e a recusa fica lembrada
+    assert 415 in cs_sender.STATUS_GZIP_RECUSADO
+    resultado = cliente.send(produtos, "produto")
+    assert resultado.ok and resultado.status == 200
+    assert "produto" in cliente._sem_gzip
+    produto = fake.stats.resumo()["ProdutoUpdate"]
+    assert (produto["requisicoes"], produto["erros"], produto["gzip"]) == (2, 1, 1)
+    assert produto["registros"] == 20
+
+    # Próximos envios do tipo já saem sem gzip; os outros endpoints seguem comprimidos
+    fake.stats.reset()
+    assert cliente.send(produtos, "produto").ok
+    assert cliente.send([{"CODPARC": 1, "NOMEPARC": "Parceiro 1"}], "parceiro").ok
+    endpoints = fake.stats.resumo()
+    assert (endpoints["ProdutoUpdate"]["requisicoes"], endpoints["ProdutoUpdate"]["gzip"]) == (1, 0)
+    assert endpoints["Cliente"]["gzip"] == 1
+
+
+class _CSOpaco:
+    """CS que recusa por inteiro, com `status`, todo lote que contém o registro `ruim`."""
+
+    def __init__(self, ruim, status=400):
+        self.ruim = ruim
+        self.status = status
+        self.posts = 0
+
+    def send(self, payload, tipo):
+        self.posts += 1
+        if any(r["CODPARC"] == self.ruim for r in payload):
+            return ResultadoCS(len(payload), erro="Erro ao processar o lote", status=self.status)
+        return ResultadoCS(len(payload), status=200)
+
+
+def test_bisseccao_isola_um_registro_em_lote_grande_e_so_para_recusa_de_conteudo():
+    registros = [{"CODPARC": c} for c in range(500)]
+    assert orcamento_bisseccao(500) == 18 and orcamento_bisseccao(1) == 0
+
+    cs = _CSOpaco(ruim=321)
+    resultado = enviar_registros(cs, registros, "parceiro")
+    assert resultado.erro is None
+    assert list(resultado.rejeitados) == [321]
+    assert cs.posts == 1 + orcamento_bisseccao(500)
+
+    # Autenticação, endpoint ou serviço fora: o lote volta como falhou, sem dividir
+    for status in (401, 403, 404, 500, 503):
+        cs = _CSOpaco(ruim=321, status=status)
+        assert enviar_registros(cs, registros, "parceiro").erro is not None
+        assert cs.posts == 1
@@ -0,0 +1,127 @@
+import sys
+import os
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import daemon as daemon_mod
+from daemon import Daemon, Tarefa
+
+
+def test_rodadas_nao_se_sobrepoem_e_sao_agrupadas():
+    liberar = threading.Event()
+    rodando = []
+
+    def _lenta():
+        rodando.append(1)
+        assert len(rodando) == 1
+        liberar.wait(5)
+        rodando.pop()
+        return {"registros": 1}
+
+    tarefa = Tarefa("lenta", intervalo=0.05, executar=_lenta, jitter=0)
+    tarefa.proxima_em = 0
+    inicio = time.time()
+    tarefa.verificar(inicio)
+    for i in range(1, 10):
+        tarefa.verificar(inicio + i)  # venceu várias vezes durante a primeira rodada
+    assert tarefa.em_execucao and tarefa.pendente and tarefa.adiadas == 1
+
+    liberar.set()
+    tarefa.aguardar()
+    # A rodada adiada roda uma única vez, logo que a anterior termina
+    tarefa.verificar(time.time())
+    tarefa.aguardar()
+    assert tarefa.execucoes == 2
+    assert not tarefa.pendente
+    assert tarefa.ultimo_resumo == {"registros": 1}
+
+
+def test_health_mostra_ultima_execucao_e_atraso(monkeypatch):
+    monkeypatch.setattr(daemon_mod, "notificar", lambda msg, agrupar=False: None)
+
+    def _falha():
+        raise RuntimeError("Sankhya fora")
+
+    ok = Tarefa("ok", intervalo=60, executar=lambda: {"registros": 3}, jitter=0)
+    atrasada = Tarefa("atrasada", intervalo=0.01, executar=_falha, jitter=0)
+    daemon = Daemon([ok, atrasada], porta=0)
+    for tarefa in daemon.tarefas:
+        tarefa.proxima_em = 0
+        tarefa.verificar(time.time())
+        tarefa.aguardar()
+    time.sleep(0.05)
+
+    daemon.iniciar_servidor()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{daemon.porta}/health") as resp:
+            raise AssertionError(f"esperava 503, veio {resp.status}")
+    except urllib.error.HTTPError as e:
+        assert e.code == 503
+        status = json.loads(e.read())
+    finally:
+        daemon._servidor.shutdown()
+
+    assert status["status"] == "atrasado"
+    assert status["tarefas"]["ok"]["ultimo_resumo"] == {"registros": 3}
+    assert status["tarefas"]["ok"]["atrasada"] is False
+    assert status["tarefas"]["atrasada"]["ultimo_erro"] == "Sankhya fora"
+    assert status["tarefas"]["atrasada"]["falhas"] == 1
+
+
+def test_parar_o_daemon_interrompe_o_pipeline_em_andamento(monkeypatch, tmp_path):
+    import metricas
+    from pipeline import Pipeline
+
+    monkeypatch.setattr(metricas, "METRICAS_DIR", str(tmp_path))
+    listou = threading.Event()
+    finalizados = []
+
+    class _Checkpoint:
+        def pendentes(self, tipo, codigos):
+            return codigos
+
+        def pagina_listada(self, idx, pagina, enfileirados):
+            pass
+
+        def concluidos(self, tipo, codigos):
+            pass
+
+        def falharam(self, tipo, codigos, guardados=False):
+            pass
+
+        def finalizar(self, interrompido):
+            finalizados.append(interrompido)
+
+    def _paginas():
+        for i in range(1000):  # sem o stop(), listaria por minutos
+            listou.set()
+            time.sleep(0.05)
+            yield [i]
+
+    def _envio():
+        pipeline = Pipeline(
+            nome="daemon-teste",
+            tipos=["produto"],
+            extrair_fn=lambda tipo, codigos: [(c, [{"CODPROD": c}]) for c in codigos],
+            enviar_fn=lambda lote: True,
+            checkpoint=_Checkpoint()
+        )
+        return pipeline.run(_paginas())
+
+    tarefa = Tarefa("produto", intervalo=60, executar=_envio, jitter=0)
+    daemon = Daemon([tarefa], porta=None)
+    t = threading.Thread(target=daemon.rodar, daemon=True)
+    t.start()
+    assert listou.wait(5)
+
+    daemon.parar()
+    t.join(10)
+    assert not t.is_alive(), "daemon não encerrou"
+    assert tarefa.ultimo_resumo["interrompido"] == 1
+    assert finalizados == [True]
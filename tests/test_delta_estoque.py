@@ -0,0 +1,88 @@
+import sys
+import os
+import tempfile
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import metricas
+from estado import EstoqueSnapshot
+from filtros import FiltroDeltaEstoque
+from pipeline import LoteCS, Pipeline
+
+
+def _saldos(codprod, quantidades):
+    return [
+        {"CODPROD": codprod, "CODLOCAL": local, "CONTROLE": "", "ESTOQUE": qtd}
+        for local, qtd in enumerate(quantidades, start=1)
+    ]
+
+
+def _confirmar(filtro, extraidos):
+    origem = [c for c, regs in extraidos for _ in regs]
+    registros = [r for _, regs in extraidos for r in regs]
+    filtro.confirmar(LoteCS("estoque", 1, [c for c, _ in extraidos], registros, origem))
+
+
+def test_envia_so_as_linhas_de_saldo_alteradas():
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = EstoqueSnapshot(os.path.join(tmp, "estado.db"))
+        filtro = FiltroDeltaEstoque(snapshot)
+
+        primeira = [(1, _saldos(1, [10, 20, 30])), (2, _saldos(2, [5]))]
+        assert filtro.filtrar("estoque", primeira) == primeira
+        _confirmar(filtro, primeira)
+
+        segunda = filtro.filtrar("estoque", [(1, _saldos(1, [10, 21, 30])), (2, _saldos(2, [5]))])
+        assert segunda == [(1, [_saldos(1, [10, 21, 30])[1]]), (2, [])]
+        assert filtro.resumo() == {"estoque_linhas_verificadas": 8, "estoque_linhas_inalteradas": 3}
+
+        # Outros tipos passam intactos; forcar reenvia tudo
+        assert filtro.filtrar("produto", primeira) == primeira
+        assert FiltroDeltaEstoque(snapshot, forcar=True).filtrar("estoque", primeira) == primeira
+
+
+def test_snapshot_expira_e_linhas_sem_identidade_usam_o_conteudo():
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, "estado.db")
+        filtro = FiltroDeltaEstoque(EstoqueSnapshot(caminho), campos=("CODPROD", "CODLOCAL", "LOTE"))
+
+        sem_lote = [(7, _saldos(7, [1, 2]))]
+        _confirmar(filtro, sem_lote)
+        assert filtro.filtrar("estoque", sem_lote) == [(7, [])]
+        alterado = _saldos(7, [1, 3])
+        assert filtro.filtrar("estoque", [(7, alterado)]) == [(7, [alterado[1]])]
+
+        # Snapshot vencido: todas as linhas voltam a ser enviadas
+        vencido = FiltroDeltaEstoque(EstoqueSnapshot(caminho, max_idade_horas=0), campos=filtro.campos)
+        assert vencido.filtrar("estoque", sem_lote) == sem_lote
+
+
+def test_snapshot_recebe_so_as_linhas_aceitas_pela_cs(monkeypatch):
+    def _chave(codprod, local):
+        return f"CODPROD={codprod}|CODLOCAL={local}|CONTROLE="
+
+    def enviar(lote):
+        linhas = [(r["CODPROD"], r["CODLOCAL"]) for r in lote.registros]
+        if (1, 3) in linhas:
+            return False  # lote inteiro recusado: a outra parte do código 1 foi aceita
+        lote.recusados = {i: "saldo inválido" for i, linha in enumerate(linhas) if linha == (2, 2)}
+        return True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(metricas, "METRICAS_DIR", tmp)
+        snapshot = EstoqueSnapshot(os.path.join(tmp, "estado.db"))
+        pipeline = Pipeline(
+            nome="estoque",
+            tipos=["estoque"],
+            extrair_fn=lambda tipo, codigos: [(c, _saldos(c, [10] * (4 - c))) for c in codigos],
+            enviar_fn=enviar,
+            extract_workers=1,
+            send_workers=1,
+            lote_max_registros=2,
+            filtros=[FiltroDeltaEstoque(snapshot)],
+        )
+        pipeline.run([[1, 2]])
+
+        gravadas = snapshot.get_many([_chave(1, 1), _chave(1, 2), _chave(1, 3), _chave(2, 2)])
+        assert set(gravadas) == {_chave(1, 1), _chave(1, 2)}
@@ -0,0 +1,74 @@
+import sys
+import os
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import estado
+import metricas
+from benchmarks.fake_servers import FakeConfig
+from icorp_api import cs_sender
+
+
+def test_envio_parceiros_e_produtos_contra_servidores_locais(fake_servers, tmp_path):
+    config = FakeConfig(n_parceiros=120, n_produtos=80, locais_por_produto=2,
+                        latencia_sankhya=0, latencia_cs=0, seed=1)
+    fake = fake_servers(config)
+    metricas.metricas.limpar()
+
+    from processamentos import processar_parceiros, processar_produtos
+
+    resumo = processar_parceiros(step=50, lote=20, workers=4, forcar=True)
+    assert resumo["lotes_com_falha"] == 0
+    assert resumo["registros"] == 120
+
+    resumo = processar_produtos(step=50, lote=20, workers=4, forcar=True)
+    assert resumo["lotes_com_falha"] == 0
+    assert resumo["registros"] == 80 + 80 * 2
+
+    endpoints = fake.stats.resumo()
+    assert endpoints["Cliente"]["registros"] == 120
+    assert endpoints["ProdutoUpdate"]["registros"] == 80
+    assert endpoints["Saldos_Atualiza"]["registros"] == 160
+
+    with open(os.path.join(tmp_path, "metricas", "atualiza_cs.prom"), encoding="utf-8") as f:
+        prom = f.read()
+    assert 'atualiza_cs_registros_enviados_total{tipo="parceiro"} 120' in prom
+    assert "atualiza_cs_cs_requisicao_segundos_bucket" in prom
+
+
+def test_faixa_de_estoque_envia_so_saldos(fake_servers):
+    config = FakeConfig(n_produtos=40, locais_por_produto=3, latencia_sankhya=0, latencia_cs=0)
+    fake = fake_servers(config)
+
+    import main
+
+    main.envio_estoque(step=25, lote=10, tempo=2)
+
+    endpoints = fake.stats.resumo()
+    assert endpoints["Saldos_Atualiza"]["registros"] == 40 * 3
+    assert "ProdutoUpdate" not in endpoints
+    # Watermark próprio, sem mexer no de produtos
+    assert estado.WatermarkStore().get("estoque")
+    assert estado.WatermarkStore().get("produto") is None
+
+
+def test_produto_e_estoque_extraidos_numa_consulta_por_bloco(fake_servers, monkeypatch):
+    config = FakeConfig(n_produtos=80, locais_por_produto=2, latencia_sankhya=0, latencia_cs=0)
+    fake = fake_servers(config)
+
+    from processamentos import processar_produtos
+
+    consultas = {}
+    for conjunta in (False, True):
+        monkeypatch.setattr(cs_sender, "SNK_EXTRACAO_CONJUNTA", conjunta)
+        fake.stats.reset()
+        resumo = processar_produtos(step=40, lote=20, workers=4, forcar=True)
+        assert resumo["lotes_com_falha"] == 0
+        endpoints = fake.stats.resumo()
+        assert endpoints["ProdutoUpdate"]["registros"] == 80
+        assert endpoints["Saldos_Atualiza"]["registros"] == 160
+        consultas[conjunta] = endpoints["executeQuery"]["requisicoes"]
+
+    # 3 páginas (a última vazia) + 4 blocos conjuntos, contra 4 blocos de cada tipo
+    assert consultas == {False: 11, True: 7}
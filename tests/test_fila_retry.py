@@ -0,0 +1,96 @@
+import sys
+import os
+import tempfile
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import metricas
+import processamentos
+from benchmarks.fake_servers import FakeConfig
+from estado import RetryQueue
+from fila_retry import FilaRetry
+from icorp_api import cs_sender
+
+
+def test_backoff_exponencial_e_dead_letter():
+    with tempfile.TemporaryDirectory() as tmp:
+        fila = RetryQueue(os.path.join(tmp, "estado.db"), max_tentativas=3,
+                          backoff_segundos=10, backoff_max_segundos=25)
+
+        assert fila.registrar("produto", [1, 2], "timeout") == 0
+        primeira = {e["codigo"]: e for e in fila.listar()}
+        fila.registrar("produto", [1], "timeout")
+        segunda = {e["codigo"]: e for e in fila.listar()}
+        assert segunda["1"]["tentativas"] == 2
+        assert segunda["1"]["proxima_em"] - primeira["1"]["proxima_em"] >= 10
+
+        # Nada vencido ainda
+        assert fila.reservar(["produto"]) == {}
+
+        assert fila.registrar("produto", [1], "HTTP 500") == 1
+        mortos = fila.listar(mortos=True)
+        assert [(e["codigo"], e["erro"]) for e in mortos] == [("1", "HTTP 500")]
+
+        # Reativado: vence agora e fica reservado para um único consumidor
+        assert fila.reativar(mortos=True) == 1
+        assert fila.reservar(["produto"]) == {"produto": ["1"]}
+        assert fila.reservar(["produto"]) == {}
+
+        fila.remover("produto", ["1"])
+        assert fila.descartar(tipo="produto") == 1
+        assert fila.listar() == []
+
+
+def test_falhas_de_envio_vao_para_a_fila_e_sao_reprocessadas(fake_servers, monkeypatch):
+    config = FakeConfig(n_parceiros=30, latencia_sankhya=0, latencia_cs=0)
+    fake = fake_servers(config)
+
+    original = cs_sender.enviar_lote
+
+    def _cs_fora(cs_client, lote):
+        lote.erro = "CS indisponível"
+        return False
+
+    monkeypatch.setattr(cs_sender, "enviar_lote", _cs_fora)
+    resumo = processamentos.processar_parceiros(10, 5, 2, forcar=True)
+    assert resumo["lotes_enviados"] == 0
+    assert resumo["retry_registrados"] == 30
+
+    fila = RetryQueue()
+    entradas = fila.listar(tipo="parceiro")
+    assert sorted(int(e["codigo"]) for e in entradas) == list(range(1, 31))
+    assert {e["erro"] for e in entradas} == {"envio: CS indisponível"}
+
+    # Ainda no backoff: não entra na próxima execução
+    monkeypatch.setattr(cs_sender, "enviar_lote", original)
+    assert processamentos.processar_retentativas(["parceiro"], 5, 2)["retry_reprocessados"] == 0
+
+    fila.reativar(tipo="parceiro")
+    resumo = processamentos.processar_retentativas(["parceiro"], 5, 2)
+    assert resumo["retry_reprocessados"] == 30
+    assert resumo["retry_recuperados"] == 30
+    assert resumo["registros"] == 30
+    assert fake.stats.resumo()["Cliente"]["registros"] == 30
+    assert fila.listar() == []
+
+
+def test_busca_individual_que_falha_vai_para_a_fila(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(metricas, "METRICAS_DIR", os.path.join(tmp, "metricas"))
+        store = RetryQueue(os.path.join(tmp, "estado.db"))
+        pipeline = cs_sender.criar_pipeline(
+            nome="produto",
+            tipos=["produto"],
+            cs_client=None,
+            fetch_json_fn=lambda codigo, tipo: None if codigo == 2 else "",
+            fetch_lote_fn=lambda codigos, tipo: {},
+            fila_retry=FilaRetry(store, ["produto"])
+        )
+        resumo = pipeline.run([[1, 2]])
+
+        # Só a busca que falhou vai para a fila; o código sem payload não tem o que enviar
+        assert resumo["registros"] == 0
+        assert resumo["retry_registrados"] == 1
+        entradas = {int(e["codigo"]): e["erro"] for e in store.listar()}
+        assert entradas == {2: "JSON ausente ou inválido"}
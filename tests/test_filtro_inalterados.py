@@ -0,0 +1,74 @@
+import sys
+import os
+import tempfile
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import estado
+from estado import PayloadHashCache
+from filtros import FiltroInalterados
+from pipeline import LoteCS
+
+
+def _produtos(*codigos, versao=1):
+    return [(c, [{"CODPROD": c, "DESCRPROD": f"Produto {c} v{versao}"}]) for c in codigos]
+
+
+def _confirmar(filtro, extraidos):
+    origem = [c for c, regs in extraidos for _ in regs]
+    registros = [r for _, regs in extraidos for r in regs]
+    filtro.confirmar(LoteCS("produto", 1, [c for c, _ in extraidos], registros, origem))
+
+
+def test_so_payloads_confirmados_e_iguais_sao_descartados():
+    with tempfile.TemporaryDirectory() as tmp:
+        filtro = FiltroInalterados(PayloadHashCache(os.path.join(tmp, "estado.db")))
+
+        primeira = _produtos(1, 2, 3)
+        assert filtro.filtrar("produto", primeira) == primeira
+        # Só o que a CS confirmou entra no cache; o código 3 não foi confirmado
+        _confirmar(filtro, primeira[:2])
+
+        segunda = _produtos(1, 3) + _produtos(2, versao=2)
+        assert filtro.filtrar("produto", segunda) == segunda[1:]
+        # O mesmo código de outro tipo não é afetado
+        assert filtro.filtrar("estoque", _produtos(1)) == _produtos(1)
+        assert filtro.resumo() == {"cache_verificados": 7, "cache_inalterados": 1}
+
+
+def test_forcar_envia_tudo_mas_atualiza_o_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PayloadHashCache(os.path.join(tmp, "estado.db"))
+        normal = FiltroInalterados(cache)
+        _confirmar(normal, normal.filtrar("produto", _produtos(1)))
+        assert normal.filtrar("produto", _produtos(1)) == []
+
+        forcado = FiltroInalterados(cache, forcar=True)
+        novos = _produtos(1) + _produtos(2)
+        assert forcado.filtrar("produto", novos) == novos
+        _confirmar(forcado, novos)
+        assert forcado.resumo()["cache_inalterados"] == 0
+
+        # Sem forcar, a execução seguinte já enxerga os hashes gravados
+        assert FiltroInalterados(cache).filtrar("produto", novos) == []
+
+
+def test_entradas_vencidas_e_excedentes_sao_removidas(monkeypatch):
+    agora = [1_000_000.0]
+    monkeypatch.setattr(estado.time, "time", lambda: agora[0])
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PayloadHashCache(os.path.join(tmp, "estado.db"), max_entradas=2, max_idade_dias=1)
+        for codigo in ("1", "2", "3"):
+            cache.set_many("produto", {codigo: f"h{codigo}"})
+            agora[0] += 60
+
+        # Acima de max_entradas, as mais antigas saem
+        assert cache.evict() == 1
+        assert cache.get_many("produto", ["1", "2", "3"]) == {"2": "h2", "3": "h3"}
+
+        # Vencida, a entrada deixa de valer mesmo antes do evict
+        agora[0] += 86400 - 90
+        assert cache.get_many("produto", ["2", "3"]) == {"3": "h3"}
+        assert cache.evict() == 1
+        assert cache.get_many("produto", ["2", "3"]) == {"3": "h3"}
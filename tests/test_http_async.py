@@ -0,0 +1,56 @@
+import sys
+import os
+
+import pytest
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip("httpx")
+
+import estado
+import metricas
+import processamentos
+from benchmarks.fake_servers import FakeConfig
+from icorp_api import cs_async, cs_sender
+from limitador import get_limiter
+from sankhya_api import sankhya_async, sankhya_fetch
+
+
+def test_pipeline_completo_sobre_o_transporte_assincrono(fake_servers, monkeypatch):
+    config = FakeConfig(n_parceiros=60, latencia_sankhya=0, latencia_cs=0, codigos_opacos={17})
+    fake = fake_servers(config)
+    monkeypatch.setattr(sankhya_fetch, "HTTP_ASYNC", True)
+    monkeypatch.setattr(cs_sender, "HTTP_ASYNC", True)
+    metricas.metricas.limpar()
+
+    resumo = processamentos.processar_parceiros(20, 10, 2, forcar=True)
+    assert isinstance(cs_sender.get_cs_client(), cs_async.CSClientSincrono)
+    assert sankhya_async._cliente is not None
+    # Bissecção e fila de retentativas seguem valendo sobre o transporte assíncrono
+    assert resumo["lotes_com_falha"] == 0
+    assert resumo["registros_recusados"] == 1
+    assert fake.stats.resumo()["Cliente"]["registros"] == 59
+    assert [e["codigo"] for e in estado.RetryQueue().listar()] == ["17"]
+
+    # Mesmas métricas e limitadores do caminho síncrono
+    contadores = metricas.metricas.resumo()["contadores"]
+    assert any(k.startswith("sankhya_requisicoes_total") for k in contadores)
+    assert any(k.startswith("cs_requisicoes_total") for k in contadores)
+    assert get_limiter("cs").em_uso == 0 and get_limiter("sankhya").em_uso == 0
+
+
+def test_gzip_recusado_no_cliente_assincrono_nao_gasta_tentativa(fake_servers):
+    config = FakeConfig(latencia_cs=0, endpoints_sem_gzip={"ProdutoUpdate"})
+    fake = fake_servers(config)
+    cliente = cs_async.AsyncCSClient(max_retries=0)
+    cliente._sync.compress, cliente._sync.compress_min_bytes = True, 1
+    produtos = [{"CODPROD": c, "DESCRPROD": f"Produto {c}"} for c in range(1, 21)]
+
+    resultado = sankhya_async.executar(cliente.send(produtos, "produto"))
+    assert resultado.ok and resultado.status == 200
+    assert "produto" in cliente._sync._sem_gzip
+    produto = fake.stats.resumo()["ProdutoUpdate"]
+    assert (produto["requisicoes"], produto["erros"], produto["gzip"]) == (2, 1, 1)
+    assert produto["registros"] == 20
+    sankhya_async.executar(cliente.aclose())
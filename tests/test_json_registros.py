@@ -0,0 +1,82 @@
+import sys
+import os
+import json
+
+import pytest
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils
+from icorp_api.cs_sender import extrair_registros, parse_registros
+from sankhya_api import sankhya_fetch
+from sankhya_api.sankhya_fetch import snk_map_json_rows
+from utils import util_iter_json
+
+
+@pytest.mark.parametrize("com_orjson", [True, False])
+def test_registros_concatenados_lidos_numa_passada(monkeypatch, com_orjson):
+    if not com_orjson:
+        monkeypatch.setattr(utils, "orjson", None)
+
+    estoque = '{"CODLOCAL": 1, "OBS": "caixa }{ lacrada"}{"CODLOCAL": 2}\n{"CODLOCAL": 3}'
+    assert [r["CODLOCAL"] for r in util_iter_json(estoque)] == [1, 2, 3]
+    assert next(util_iter_json(estoque))["OBS"] == "caixa }{ lacrada"
+
+    # Parceiro vem como lista, às vezes com mais de um registro
+    assert list(util_iter_json('[{"CODPARC": 1}, {"CODPARC": 2}]')) == [{"CODPARC": 1}, {"CODPARC": 2}]
+    assert list(util_iter_json('{"CODPROD": 7}')) == [{"CODPROD": 7}]
+    assert list(util_iter_json('{"A": 1},{"A": 2}')) == [{"A": 1}, {"A": 2}]
+    for invalido in ('{"A": 1}{"A": ', "", "  \n"):
+        with pytest.raises(json.JSONDecodeError):
+            list(util_iter_json(invalido))
+
+
+def test_parse_registros_json_invalido_ou_ausente():
+    assert parse_registros("estoque", 1, '{"A": 1}{"A": 2}') == [{"A": 1}, {"A": 2}]
+    assert parse_registros("estoque", 1, '{"A": 1}{') is None
+    assert parse_registros("parceiro", 1, None) is None
+    # Como no antigo util_remove_brackets, texto vazio é falha, não lista vazia
+    assert parse_registros("parceiro", 1, "") is None
+    assert parse_registros("parceiro", 1, "   ") is None
+    assert parse_registros("parceiro", 1, "[]") == []
+
+
+def test_coluna_null_no_lote_nao_dispara_busca_individual():
+    resultado = {}
+    snk_map_json_rows([[1, '{"A": 1}'], [2, None], [3, ""]], {1: 1, 2: 2, 3: 3, 4: 4}, resultado)
+    assert resultado == {1: '{"A": 1}', 2: "", 3: ""}
+
+    individuais = []
+
+    def fetch_json(codigo, tipo):
+        individuais.append(codigo)
+        return '{"A": %d}' % codigo
+
+    extraidos = extrair_registros(
+        "estoque", [1, 2, 3, 4], fetch_json_fn=fetch_json, fetch_lote_fn=lambda c, t: resultado
+    )
+    # Só o código ausente do resultado (sem linha) vai para a busca individual
+    assert individuais == [4]
+    assert extraidos == [(1, [{"A": 1}]), (2, []), (3, []), (4, [{"A": 4}])]
+
+
+def test_payload_vazio_tem_o_mesmo_resultado_no_lote_e_na_busca_individual(monkeypatch):
+    def _consulta(sql):
+        if "IN (" in sql:
+            return [[1, None], [2, '{"A": 2}']]
+        return [[None]] if "(1)" in sql else [['{"A": 2}']]
+
+    monkeypatch.setattr(sankhya_fetch, "snk_fetch_data", _consulta)
+    lote = extrair_registros("estoque", [1, 2], fetch_lote_fn=sankhya_fetch.snk_fetch_json_lote)
+    individual = extrair_registros("estoque", [1, 2], fetch_lote_fn=None)
+    # Função NULL: código sem payload, concluído com a lista vazia nos dois caminhos
+    assert lote == individual == [(1, []), (2, [{"A": 2}])]
+
+    def _falha(sql):
+        raise ConnectionError("Sankhya fora do ar")
+
+    # Consulta que falha: o código fica de fora (vai para a fila) nos dois caminhos
+    monkeypatch.setattr(sankhya_fetch, "snk_fetch_data", _falha)
+    assert extrair_registros("estoque", [1], fetch_lote_fn=sankhya_fetch.snk_fetch_json_lote) == []
+    assert extrair_registros("estoque", [1], fetch_lote_fn=None) == []
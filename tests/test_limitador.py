@@ -0,0 +1,121 @@
+import sys
+import os
+import threading
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import limitador
+from icorp_api import cs_sender
+from limitador import AdaptiveLimiter, get_limiter, limiter_atual, orcamento_limites
+
+
+def test_orcamento_proprio_nao_divide_vagas_com_o_host(monkeypatch):
+    monkeypatch.setattr(limitador, "_limiters", {})
+    host = get_limiter("cs", inicial=6)
+    estoque = get_limiter("cs:estoque", inicial=2)
+    assert estoque is not host
+    assert (host.limite, estoque.limite) == (6, 2)
+    # `inicial` só vale na criação
+    assert get_limiter("cs:estoque", inicial=9).limite == 2
+
+    assert limiter_atual("cs") is host
+    with orcamento_limites("estoque"):
+        assert limiter_atual("cs") is estoque
+        assert limiter_atual("sankhya").nome == "sankhya:estoque"
+        # O orçamento vale só para o thread que o definiu
+        outro = []
+        t = threading.Thread(target=lambda: outro.append(limiter_atual("cs")))
+        t.start()
+        t.join()
+        assert outro == [host]
+    assert limiter_atual("cs") is host
+
+
+def test_pipeline_com_orcamento_envia_pelos_limitadores_dele(monkeypatch):
+    monkeypatch.setattr(limitador, "_limiters", {})
+    usados = []
+    monkeypatch.setattr(
+        cs_sender, "enviar_lote", lambda cs_client, lote: usados.append(limiter_atual("cs").nome) or True
+    )
+    pipeline = cs_sender.criar_pipeline(
+        nome="estoque", tipos=["estoque"], cs_client=None, send_workers=3, extract_workers=2, orcamento="estoque"
+    )
+    assert pipeline.limiters["cs"].nome == "cs:estoque" and pipeline.limiters["cs"].limite == 3
+    assert pipeline.limiters["sankhya"].nome == "sankhya:estoque"
+    assert pipeline.enviar_fn(None) is True
+    assert usados == ["cs:estoque"]
+
+
+def _janela(limiter, latencia, n=None):
+    """Completa uma janela de respostas saudáveis com a latência dada."""
+    for _ in range(n or max(limiter.limite, 5)):
+        limiter.release(limiter.acquire(), latencia)
+
+
+def test_aimd_sobe_um_por_janela_saudavel():
+    limiter = AdaptiveLimiter("teste", inicial=2, maximo=4)
+    _janela(limiter, 0.1)
+    assert limiter.limite == 3
+    _janela(limiter, 0.1)
+    _janela(limiter, 0.1)
+    assert limiter.limite == 4  # não passa do máximo
+
+
+def test_aimd_corta_pela_metade_em_429_e_5xx_uma_vez_por_janela():
+    limiter = AdaptiveLimiter("teste", inicial=16)
+    vagas = [limiter.acquire() for _ in range(3)]
+    for vaga, status in zip(vagas, (503, 429, 500)):
+        vaga.status(status)
+    limiter.release(vagas[0], 0.1)
+    assert limiter.limite == 8
+    # Erros de requisições iniciadas antes do corte não cortam de novo
+    limiter.release(vagas[1], 0.1)
+    limiter.release(vagas[2], 0.1)
+    assert limiter.limite == 8
+
+    vaga = limiter.acquire()
+    vaga.status(429)
+    limiter.release(vaga, 0.1)
+    assert limiter.limite == 4
+
+
+def test_aimd_corta_25_por_cento_com_latencia_alta():
+    limiter = AdaptiveLimiter("teste", inicial=8, tolerancia=2.0)
+    _janela(limiter, 0.1)  # latência de base
+    assert limiter.limite == 9
+    _janela(limiter, 1.0)
+    assert limiter.limite == 6
+
+
+class _Resposta:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_backoff_do_envio_fica_fora_da_vaga_do_limitador(monkeypatch):
+    monkeypatch.setattr(limitador, "_limiters", {})
+    limiter = get_limiter("cs", inicial=4)
+    respostas = [_Resposta(503, {"Retry-After": "3"}), _Resposta(502), _Resposta(200)]
+    latencias, esperas = [], []
+
+    class _Sessao:
+        def post(self, **kwargs):
+            return respostas.pop(0)
+
+    release = limiter.release
+    monkeypatch.setattr(
+        limiter, "release", lambda vaga, latencia: latencias.append(latencia) or release(vaga, latencia)
+    )
+    monkeypatch.setattr(cs_sender.time, "sleep", lambda s: esperas.append((s, limiter.em_uso)))
+
+    cliente = cs_sender.CSClient(max_retries=5, backoff_factor=0.5)
+    cliente.session = _Sessao()
+    resp, _ = cliente._post([{"CODPROD": 1}], "produto")
+
+    assert resp.status_code == 200
+    # Uma vaga por tentativa, e nenhuma ocupada durante as esperas
+    assert len(latencias) == 3
+    assert esperas == [(3.0, 0), (1.0, 0)]
+    assert all(latencia < 1 for latencia in latencias)
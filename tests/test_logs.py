@@ -0,0 +1,105 @@
+import sys
+import os
+import json
+import logging
+import logging.handlers
+import queue
+import tempfile
+import threading
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import metricas
+from pipeline import Pipeline
+from utils import FilaLog, FiltroContexto, FormatterJSON, _nivel_log
+
+
+class _Coletor(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.addFilter(FiltroContexto())
+        self.registros = []
+
+    def emit(self, record):
+        self.registros.append(record)
+
+
+def test_uma_linha_por_lote_com_ids_de_contexto(monkeypatch):
+    coletor = _Coletor()
+    raiz = logging.getLogger()
+    nivel = raiz.level
+    raiz.setLevel(logging.INFO)
+    raiz.addHandler(coletor)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            monkeypatch.setattr(metricas, "METRICAS_DIR", tmp)
+            pipeline = Pipeline(
+                nome="teste",
+                tipos=["produto"],
+                extrair_fn=lambda tipo, codigos: [(c, [{"CODPROD": c}]) for c in codigos],
+                enviar_fn=lambda lote: True,
+                lote_size=5,
+                lote_max_registros=4,
+            )
+            pipeline.run([list(range(1, 9))])
+    finally:
+        raiz.removeHandler(coletor)
+        raiz.setLevel(nivel)
+
+    lotes = [r for r in coletor.registros if r.getMessage().startswith("📦 Lote")]
+    assert [r.lote for r in lotes] == [1, 2]
+    assert {r.tipo for r in lotes} == {"produto"}
+    assert {r.execucao for r in lotes} == {pipeline.execucao}
+    assert pipeline.execucao.startswith("teste-")
+
+    linha = json.loads(FormatterJSON().format(lotes[0]))
+    assert linha["nivel"] == "INFO"
+    assert linha["lote"] == 1 and linha["tipo"] == "produto" and linha["execucao"] == pipeline.execucao
+    assert "4 registros" in linha["msg"]
+
+
+def test_nivel_padrao_info_e_debug_so_quando_pedido(monkeypatch):
+    monkeypatch.delenv("LOG_LEVEL", raising=False)
+    monkeypatch.delenv("DEBUG_LOGS", raising=False)
+    assert _nivel_log() == "INFO"
+    monkeypatch.setenv("DEBUG_LOGS", "0")
+    assert _nivel_log() == "INFO"
+    monkeypatch.setenv("LOG_LEVEL", "debug")
+    assert _nivel_log() == "DEBUG"
+
+
+def test_formatacao_e_traceback_ficam_no_thread_do_listener():
+    threads = []
+
+    class _Formatter(FormatterJSON):
+        def format(self, record):
+            threads.append(threading.current_thread().name)
+            return super().format(record)
+
+    linhas = []
+
+    class _Saida(logging.Handler):
+        def emit(self, record):
+            linhas.append(json.loads(self.format(record)))
+
+    saida = _Saida()
+    saida.setFormatter(_Formatter())
+    fila = FilaLog(queue.SimpleQueue())
+    listener = logging.handlers.QueueListener(fila.queue, saida)
+    logger = logging.getLogger("teste.filalog")
+    logger.propagate = False
+    logger.addHandler(fila)
+    listener.start()
+    try:
+        try:
+            raise ValueError("falhou")
+        except ValueError:
+            logger.error("lote %d", 7, exc_info=True)
+    finally:
+        listener.stop()
+        logger.removeHandler(fila)
+
+    assert threading.current_thread().name not in threads and len(threads) == 1
+    assert linhas[0]["msg"] == "lote 7"
+    assert "ValueError: falhou" in linhas[0]["exc"]
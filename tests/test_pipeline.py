@@ -0,0 +1,143 @@
+import sys
+import os
+import sqlite3
+import tempfile
+import threading
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import estado
+import metricas
+from fila_retry import FilaRetry
+from pipeline import Pipeline, execucao_confirmada
+
+
+class _CheckpointQuebrado:
+    """Checkpoint cujo banco falha ao gravar os códigos concluídos."""
+
+    def __init__(self):
+        self.finalizado = None
+
+    def pendentes(self, tipo, codigos):
+        return codigos
+
+    def pagina_listada(self, idx, pagina, enfileirados):
+        pass
+
+    def concluidos(self, tipo, codigos):
+        raise sqlite3.OperationalError("database is locked")
+
+    def falharam(self, tipo, codigos, guardados=False):
+        pass
+
+    def finalizar(self, interrompido):
+        self.finalizado = interrompido
+
+
+def _rodar_com_timeout(pipeline, paginas, timeout=30):
+    resultado = {}
+    t = threading.Thread(target=lambda: resultado.update(pipeline.run(paginas)), daemon=True)
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), "pipeline travou"
+    return resultado
+
+
+def test_falha_ao_gravar_estado_encerra_sem_travar(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(metricas, "METRICAS_DIR", tmp)
+        checkpoint = _CheckpointQuebrado()
+        pipeline = Pipeline(
+            nome="teste",
+            tipos=["produto"],
+            extrair_fn=lambda tipo, codigos: [(c, [{"CODPROD": c}]) for c in codigos],
+            enviar_fn=lambda lote: True,
+            lote_size=2,
+            extract_workers=1,
+            send_workers=1,
+            queue_size=1,
+            lote_max_registros=2,
+            checkpoint=checkpoint,
+            flush_segundos=0.1,
+        )
+        paginas = ([p * 10 + i for i in range(10)] for p in range(50))
+        resumo = _rodar_com_timeout(pipeline, paginas)
+
+    assert resumo["interrompido"] == 1
+    assert resumo["paginas"] < 50
+    assert checkpoint.finalizado is True
+
+
+def test_erro_inesperado_num_estagio_encerra_sem_travar(monkeypatch):
+    def extrair(tipo, codigos):
+        if 7 in codigos:
+            return None  # resultado inválido: quebra a extração
+        if 3 in codigos:
+            return [(c, [{"CODPROD": object()}]) for c in codigos]  # não serializa: quebra a montagem
+        return [(c, [{"CODPROD": c}]) for c in codigos]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(metricas, "METRICAS_DIR", tmp)
+        pipeline = Pipeline(
+            nome="teste",
+            tipos=["produto"],
+            extrair_fn=extrair,
+            enviar_fn=lambda lote: True,
+            lote_size=2,
+            extract_workers=1,
+            send_workers=1,
+            queue_size=1,
+            flush_segundos=0.1,
+        )
+        paginas = ([p * 10 + i for i in range(10)] for p in range(50))
+        resumo = _rodar_com_timeout(pipeline, paginas)
+
+    assert resumo["interrompido"] == 1
+    assert resumo["lotes_enviados"] > 0
+
+
+def test_execucao_confirmada():
+    assert execucao_confirmada({"paginas": 3, "lotes_com_falha": 0})
+    # Sem fila de retentativas, qualquer falha segura o watermark
+    assert not execucao_confirmada({"lotes_com_falha": 1})
+    assert not execucao_confirmada({"erros_extracao": 1})
+    # Com a fila, as falhas já estão guardadas lá
+    assert execucao_confirmada({"registros_recusados": 2, "retry_registrados": 2})
+    assert not execucao_confirmada({"interrompido": 1, "retry_registrados": 0})
+    assert not execucao_confirmada({"erros_listagem": 1, "retry_registrados": 0})
+
+
+def test_falhas_guardadas_na_fila_nao_seguram_o_watermark(monkeypatch):
+    def paginas_quebradas():
+        yield [1, 2, 3]
+        raise ConnectionError("Sankhya fora do ar")
+
+    def enviar(lote):
+        # Um registro recusado pela CS em cada lote
+        lote.recusados = {0: "campo obrigatório"}
+        return True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(metricas, "METRICAS_DIR", tmp)
+        monkeypatch.setattr(estado, "ESTADO_DB", os.path.join(tmp, "estado.db"))
+
+        def rodar(paginas):
+            store = estado.RetryQueue()
+            pipeline = Pipeline(
+                nome="teste",
+                tipos=["produto"],
+                extrair_fn=lambda tipo, codigos: [(c, [{"CODPROD": c}]) for c in codigos],
+                enviar_fn=enviar,
+                fila_retry=FilaRetry(store, ["produto"]),
+            )
+            return pipeline.run(paginas), store
+
+        resumo, store = rodar([[1, 2, 3]])
+        assert resumo["registros_recusados"] == 1 and resumo["retry_registrados"] == 1
+        assert [e["codigo"] for e in store.listar()] == ["1"]
+        assert execucao_confirmada(resumo)
+
+        resumo, _ = rodar(paginas_quebradas())
+        assert resumo["erros_listagem"] == 1
+        assert not execucao_confirmada(resumo)
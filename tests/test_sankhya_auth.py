@@ -0,0 +1,77 @@
+import sys
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_servers import FakeConfig
+from sankhya_api import sankhya_fetch
+from sankhya_api.sankhya_auth import SankhyaClient
+
+
+def _logins(fake):
+    return fake.stats.resumo().get("login", {}).get("requisicoes", 0)
+
+
+def test_um_unico_login_para_threads_simultaneas(fake_servers, tmp_path):
+    fake = fake_servers(FakeConfig(latencia_sankhya=0))
+    client = SankhyaClient(arquivo=os.path.join(tmp_path, "token.json"))
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(client.gerar_token())) for _ in range(35)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(tokens)) == 1
+    assert _logins(fake) == 1
+
+
+def test_token_reaproveitado_entre_clientes_pelo_arquivo(fake_servers, tmp_path):
+    fake = fake_servers(FakeConfig(latencia_sankhya=0))
+    arquivo = os.path.join(tmp_path, "token.json")
+    primeiro = SankhyaClient(arquivo=arquivo).gerar_token()
+    segundo = SankhyaClient(arquivo=arquivo).gerar_token()
+
+    assert primeiro == segundo
+    assert _logins(fake) == 1
+
+
+def test_token_expirado_gera_novo_login_e_repete_a_consulta(fake_servers):
+    config = FakeConfig(n_parceiros=10, latencia_sankhya=0, token_ttl=0.2)
+    fake = fake_servers(config)
+
+    assert len(sankhya_fetch.snk_fetch_data("SELECT CODPARC FROM TGFPAR")) == 10
+    time.sleep(0.3)
+    assert len(sankhya_fetch.snk_fetch_data("SELECT CODPARC FROM TGFPAR")) == 10
+    assert _logins(fake) == 2
+
+
+def test_timeout_no_login_libera_os_locks(monkeypatch):
+    from sankhya_api import sankhya_auth
+
+    chamadas = []
+
+    def _post_lento(url, headers, timeout=None):
+        chamadas.append(timeout)
+        raise sankhya_auth.requests.Timeout("login sem resposta")
+
+    monkeypatch.setattr(sankhya_auth, "SNK_LOGIN_TIMEOUT", 3)
+    monkeypatch.setattr(sankhya_auth.requests, "post", _post_lento)
+    with tempfile.TemporaryDirectory() as tmp:
+        arquivo = os.path.join(tmp, "token.json")
+        client = SankhyaClient(arquivo=arquivo)
+        with pytest.raises(sankhya_auth.requests.Timeout):
+            client.gerar_token()
+
+        assert chamadas == [3]
+        assert client._lock.acquire(blocking=False)
+        client._lock.release()
+        with open(f"{arquivo}.lock", "a+") as f:
+            sankhya_auth.fcntl.flock(f, sankhya_auth.fcntl.LOCK_EX | sankhya_auth.fcntl.LOCK_NB)
+            sankhya_auth.fcntl.flock(f, sankhya_auth.fcntl.LOCK_UN)
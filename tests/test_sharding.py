@@ -0,0 +1,69 @@
+import sys
+import os
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_servers import FakeConfig
+from estado import CheckpointStore
+from coordenador import gerar_faixas, somar_resumos
+from processamentos import build_keyset_page_sql, filtro_chave, parse_shard
+
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+    for invalido in ("4/4", "-1/2", "1", "a/b"):
+        try:
+            parse_shard(invalido)
+        except ValueError:
+            continue
+        raise AssertionError(f"'{invalido}' deveria ser recusado")
+
+
+def test_filtro_entra_na_pagina_keyset():
+    filtro = filtro_chave("CODPARC", shard=(1, 4), faixa=(100, 200))
+    sql = build_keyset_page_sql("SELECT CODPARC FROM TGFPAR ORDER BY CODPARC", "CODPARC", 50, 120, filtro)
+    assert "WHERE K.CODPARC > 120 AND K.CODPARC % 4 = 1 AND K.CODPARC >= 100 AND K.CODPARC < 200" in sql
+
+
+def test_faixas_cobrem_o_intervalo_sem_sobreposicao():
+    faixas = gerar_faixas("parceiros", 1, 1000, 300)
+    assert faixas == [
+        ("parceiros", 1, 301), ("parceiros", 301, 601),
+        ("parceiros", 601, 901), ("parceiros", 901, 1001),
+    ]
+    assert gerar_faixas("parceiros", None, None, 300) == []
+
+
+def test_somar_resumos():
+    total = somar_resumos([
+        {"registros": 10, "interrompido": 0, "limite_cs": 4, "duracao_s": 3.0},
+        {"registros": 5, "interrompido": 1, "limite_cs": 7, "duracao_s": 2.0},
+    ])
+    assert total == {"registros": 15, "interrompido": 1, "limite_cs": 7}
+
+
+def test_faixas_concluidas_ficam_fora_dos_codigos_confirmados(tmp_path):
+    store = CheckpointStore(str(tmp_path / "estado.db"))
+    execucao = "coordenador:parceiros:300"
+    store.concluir_faixa(execucao, "parceiros", 1, 301)
+    store.concluir_faixa(execucao, "parceiros", 1, 301)
+    store.concluir_faixa(execucao, "produtos", 301, 601)
+
+    assert store.faixas_concluidas(execucao, "parceiros") == {(1, 301)}
+    assert store.faixas_concluidas(execucao, "produtos") == {(301, 601)}
+    assert store.confirmados(execucao, "parceiros") == []
+
+    store.limpar(execucao)
+    assert store.faixas_concluidas(execucao, "parceiros") == set()
+
+
+def test_shards_somados_cobrem_todos_os_parceiros(fake_servers):
+    config = FakeConfig(n_parceiros=90, latencia_sankhya=0, latencia_cs=0)
+    fake = fake_servers(config)
+
+    from processamentos import processar_parceiros
+
+    resumos = [processar_parceiros(20, 10, 2, forcar=True, shard=(i, 3)) for i in range(3)]
+    assert [r["registros"] for r in resumos] == [30, 30, 30]
+    assert fake.stats.resumo()["Cliente"]["registros"] == 90
@@ -0,0 +1,62 @@
+import sys
+import os
+import threading
+import time
+
+# Garante que a raiz do projeto esteja no path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from telegram_notification import NotificadorTelegram
+
+
+def test_alertas_agrupados_num_resumo_e_flush_na_saida():
+    enviadas = []
+    liberar = threading.Event()
+
+    def _enviar(mensagem):
+        liberar.wait(5)  # Telegram lento: notificar() não pode esperar por ele
+        enviadas.append(mensagem)
+        return True, 0.0
+
+    notificador = NotificadorTelegram(_enviar, intervalo=0, janela=60)
+    inicio = time.perf_counter()
+    notificador.notificar("🚀 início")
+    for i in range(5):
+        notificador.notificar(f"❌ Falha no lote {i % 2}", agrupar=True)
+    notificador.notificar("🏁 fim")
+    assert time.perf_counter() - inicio < 0.5
+
+    liberar.set()
+    assert notificador.flush(5)
+    assert enviadas[0] == "🚀 início"
+    resumo = enviadas[1]
+    assert resumo.startswith("⚠️ 5 alertas")
+    assert "• ❌ Falha no lote 0 (x3)" in resumo
+    assert "• ❌ Falha no lote 1 (x2)" in resumo
+    assert "📈 extração:" in resumo
+    assert enviadas[2:] == ["🏁 fim"]
+
+
+def test_limite_do_telegram_e_fila_limitada():
+    respostas = [(True, 0.0), (False, 0.05), (True, 0.0), (True, 0.0)]
+    enviadas = []
+    liberar = threading.Event()
+
+    def _enviar(mensagem):
+        liberar.wait(5)
+        ok, espera = respostas.pop(0)
+        enviadas.append((mensagem, ok))
+        return ok, espera
+
+    notificador = NotificadorTelegram(_enviar, intervalo=0, janela=60, fila_max=2)
+    notificador.notificar("a")
+    while not notificador._enviando:  # "a" preso no envio enquanto a fila enche
+        time.sleep(0.01)
+    for texto in ("b", "c", "d"):
+        notificador.notificar(texto)
+    assert notificador.descartadas == 1
+
+    liberar.set()
+    assert notificador.flush(5)
+    # 429: "c" volta para a fila e é reenviado depois do retry_after; "b" foi descartado
+    assert enviadas == [("a", True), ("c", False), ("c", True), ("d", True)]
@@ -1,22 +1,137 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import re
+import threading
 import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+
+# Formato dos logs: "texto" (padrão) ou "json", uma linha por registro com
+# os ids de contexto (execucao, lote, tipo) para análise
+LOG_FORMATO = os.getenv("LOG_FORMATO", "texto").lower()
+
+_FORMATO_INFO = '%(asctime)s - %(levelname)s - %(message)s'
+_FORMATO_DEBUG = '%(asctime)s - %(levelname)s - %(name)s - %(filename)s:%(lineno)d - %(message)s'
+_CAMPOS_CONTEXTO = ("execucao", "lote", "tipo")
+
+# Contexto do thread atual, copiado em cada registro de log (ver util_log_contexto)
+_log_contexto = threading.local()
+_log_listener: Optional[logging.handlers.QueueListener] = None
+_log_lock = threading.Lock()
+
+
+class FiltroContexto(logging.Filter):
+    """Copia os ids de contexto do thread para o registro, antes de ir para a fila."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for campo in _CAMPOS_CONTEXTO:
+            if not hasattr(record, campo):
+                setattr(record, campo, getattr(_log_contexto, campo, None))
+        return True
+
+
+class FilaLog(logging.handlers.QueueHandler):
+    """
+    QueueHandler que não formata no thread que loga: o prepare() padrão já
+    chama format() (junção dos args e traceback) antes de enfileirar. Aqui o
+    registro vai como está e toda a formatação fica com o QueueListener.
+    A fila é em memória (SimpleQueue), então exc_info e args não precisam ser
+    serializados; args mutáveis alterados logo depois do log podem aparecer
+    já alterados na linha, como em qualquer handler assíncrono.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class FormatterJSON(logging.Formatter):
+    """Uma linha JSON por registro, com os ids de contexto presentes e o traceback, se houver."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        dados = {
+            "ts": self.formatTime(record),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for campo in _CAMPOS_CONTEXTO:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                dados[campo] = valor
+        if record.exc_info:
+            dados["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            dados["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+@contextmanager
+def util_log_contexto(**campos) -> Iterator[None]:
+    """Define ids de contexto (execucao, lote, tipo) nos logs do thread atual dentro do bloco."""
+    anteriores = {campo: getattr(_log_contexto, campo, None) for campo in campos}
+    for campo, valor in campos.items():
+        setattr(_log_contexto, campo, valor)
+    try:
+        yield
+    finally:
+        for campo, valor in anteriores.items():
+            setattr(_log_contexto, campo, valor)
+
+
+def _parar_log_listener() -> None:
+    global _log_listener
+    with _log_lock:
+        if _log_listener is not None:
+            _log_listener.stop()
+            _log_listener = None
+
+
+def _nivel_log() -> str:
+    """LOG_LEVEL, ou INFO: as mensagens por código e por POST (DEBUG) só com LOG_LEVEL=DEBUG."""
+    return (os.getenv("LOG_LEVEL") or "INFO").upper()
 
 
 def logging_config():
-    env = os.getenv('DEBUG_LOGS')
+    """
+    Configura o logger raiz uma vez por processo (chamadas seguintes não
+    fazem nada, como em basicConfig). Os threads só enfileiram os registros
+    (FilaLog); a formatação, inclusive args e traceback, e a escrita no stderr
+    ficam num thread próprio (QueueListener), drenado na saída do processo.
+    Nível: LOG_LEVEL (padrão INFO); em DEBUG, o texto inclui arquivo e linha.
+    """
+    global _log_listener
 
-    if env == '1':
-        logging.basicConfig(level=logging.INFO,
-                            format='%(asctime)s - %(levelname)s - %(message)s')
-    else:
-        logging.basicConfig(level=logging.DEBUG,
-                            format='%(asctime)s - %(levelname)s - %(name)s - %(filename)s:%(lineno)d - %(message)s')
+    with _log_lock:
+        raiz = logging.getLogger()
+        if raiz.handlers:
+            return
+        nivel = _nivel_log()
+        if LOG_FORMATO == "json":
+            formatter: logging.Formatter = FormatterJSON()
+        else:
+            formatter = logging.Formatter(_FORMATO_DEBUG if nivel == "DEBUG" else _FORMATO_INFO)
 
-    logging.debug(f"Valor da variável de ambiente APP_ENV: '{env}'")
+        saida = logging.StreamHandler()
+        saida.setFormatter(formatter)
+        fila = FilaLog(queue.SimpleQueue())
+        fila.addFilter(FiltroContexto())
+        raiz.addHandler(fila)
+        raiz.setLevel(nivel)
 
-def util_remove_brackets(json_parc: str):
-    return json_parc.strip("[]")
+        _log_listener = logging.handlers.QueueListener(fila.queue, saida, respect_handler_level=True)
+        _log_listener.start()
+        atexit.register(_parar_log_listener)
 
 
 def util_query_name(tipo: str) -> str:
@@ -31,6 +146,19 @@ def util_query_name(tipo: str) -> str:
         raise ValueError(f"❌ Tipo de query inválido: '{tipo}'")
 
 
+def util_query_key(tipo: str) -> tuple[str, str]:
+    """Retorna (tabela, coluna-chave) de onde saem os códigos de cada tipo."""
+    mapa = {
+        "parceiro": ("TGFPAR", "CODPARC"),
+        "produto": ("TGFPRO", "CODPROD"),
+        "estoque": ("TGFPRO", "CODPROD"),
+    }
+    try:
+        return mapa[tipo]
+    except KeyError:
+        raise ValueError(f"❌ Tipo de query inválido: '{tipo}'")
+
+
 
 def util_cs_enpoint(tipo: str) -> str:
     mapa = {
@@ -41,4 +169,54 @@ def util_cs_enpoint(tipo: str) -> str:
     try:
         return mapa[tipo]
     except KeyError:
-        raise ValueError(f"❌ Endpoint inválido: '{tipo}'")
\ No newline at end of file
+        raise ValueError(f"❌ Endpoint inválido: '{tipo}'")
+
+
+def util_json_dumps(dados) -> bytes:
+    """Serializa em JSON compacto UTF-8 (orjson quando instalado)."""
+    if orjson is not None:
+        return orjson.dumps(dados)
+    return json.dumps(dados, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+_JSON_DECODER = json.JSONDecoder()
+# Espaços e vírgulas entre valores concatenados ('{...}{...}', '{...},{...}')
+_JSON_SEPARADORES = re.compile(r"[\s,]*")
+# Junta '}{' com vírgula e quebra de linha: fora de strings é só espaço entre
+# valores; dentro de uma string, a quebra de linha crua é JSON inválido
+_JSON_JUNCAO = "},\n{"
+
+
+def _iter_json_concatenado(raw: str) -> Iterator[Any]:
+    """Valores JSON de `raw`, um a um, com raw_decode a partir de cada posição."""
+    pos = _JSON_SEPARADORES.match(raw).end()
+    fim = len(raw)
+    while pos < fim:
+        dados, pos = _JSON_DECODER.raw_decode(raw, pos)
+        yield dados
+        pos = _JSON_SEPARADORES.match(raw, pos).end()
+
+
+def util_iter_json(raw: str) -> Iterator[Dict[str, Any]]:
+    """
+    Registros do texto devolvido pelas funções CC_CS_JSON_* ('{...}',
+    '{...}{...}', '[{...},{...}]'), abrindo as listas.
+
+    O texto inteiro vai numa chamada só ao parser (orjson quando instalado),
+    com cada '}{' virando '},\\n{'. Se algum '}{' estava dentro de um campo
+    texto, a quebra de linha torna o JSON inválido e o texto é lido valor a
+    valor com raw_decode, sem reescrita. JSONDecodeError se for inválido,
+    vazio ou só espaços.
+    """
+    if not raw or raw.isspace():
+        raise json.JSONDecodeError("JSON vazio", raw or "", 0)
+    loads = orjson.loads if orjson is not None else json.loads
+    try:
+        valores = loads("[" + raw.replace("}{", _JSON_JUNCAO) + "]")
+    except ValueError:
+        valores = _iter_json_concatenado(raw)
+    for valor in valores:
+        if isinstance(valor, list):
+            yield from valor
+        else:
+            yield valor